@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from src.config import DATASETS
+
+# 合成資料的會計科目 (與 FinMind 長表相同的 type 名稱，含 *_per 百分比列與無關科目)
+BS_TYPES = ['TotalAssets', 'Liabilities', 'CurrentAssets', 'CurrentLiabilities', 'NonCurrentLiabilities',
+            'RetainedEarnings', 'Equity', 'OrdinaryShares', 'NonCurrentAssets', 'CashAndCashEquivalents',
+            'AccountsReceivableNet', 'Inventories', 'OtherCurrentAssets', 'ShortTermBorrowings', 'CapitalSurplus']
+INC_TYPES = ['Revenue', 'CostOfRevenue', 'GrossProfit', 'OperatingExpenses', 'OperatingIncome', 'PreTaxIncome',
+             'IncomeAfterTaxes', 'FinanceCosts', 'EPS', 'TotalNonoperatingIncomeAndExpense', 'IncomeTaxExpense']
+CF_TYPES = ['CashFlowsFromOperatingActivities', 'Depreciation', 'AmortizationExpense', 'PropertyAndPlantAndEquipment',
+            'CashProvidedByInvestingActivities', 'CashBalancesIncrease', 'InterestExpense']
+INSTITUTIONS = ['Foreign_Investor', 'Foreign_Dealer_Self', 'Investment_Trust', 'Dealer_self', 'Dealer_Hedging']
+
+
+def _long(rng, sid, dates, types, scale, with_per=False):
+    """財報長表 (date, stock_id, type, value, origin_name)"""
+    d = np.repeat(dates, len(types)); t = np.tile(types, len(dates))
+    value = rng.normal(scale, scale * 0.3, len(d)).round()
+    df = pd.DataFrame({'date': d, 'stock_id': sid, 'type': t, 'value': value, 'origin_name': t})
+    if with_per:
+        per = df.assign(type=df['type'] + '_per', value=rng.random(len(df)) * 100)
+        df = pd.concat([df, per], ignore_index=True)
+    return df[rng.random(len(df)) > 0.03].reset_index(drop=True)  # 少量缺漏科目
+
+
+def make_stock(sid, rng, asof=None, years=5):
+    """
+    單一股票的合成資料: FinMind 各資料集長表 + Yahoo 日線 OHLCV 與 info。
+    日期以 asof (預設今天) 往回推，讓資料落在 DataEngine 的抓取區間內。
+    """
+    asof = pd.Timestamp(asof or pd.Timestamp.now()).normalize()
+    scale = float(rng.lognormal(21, 1.2))  # 總資產級距 (約 1e8 ~ 1e11)
+
+    quarters = pd.date_range(end=asof, periods=years * 4, freq='QE').strftime('%Y-%m-%d')
+    months = pd.date_range(end=asof, periods=years * 12, freq='MS')
+    days = pd.bdate_range(end=asof, periods=years * 245)
+    recent = days[-60:].strftime('%Y-%m-%d')
+
+    bs = _long(rng, sid, quarters, BS_TYPES, scale, with_per=True)
+    inc = _long(rng, sid, quarters, INC_TYPES, scale * 0.1)
+    cf = _long(rng, sid, quarters, CF_TYPES, scale * 0.05)
+
+    rev = pd.DataFrame({'date': months.strftime('%Y-%m-%d'), 'stock_id': sid, 'country': 'Taiwan',
+                        'revenue': (scale * 0.03 * rng.lognormal(0, 0.15, len(months))).astype('int64'),
+                        'revenue_month': ((months - pd.DateOffset(months=1)).month).astype(int),
+                        'revenue_year': ((months - pd.DateOffset(months=1)).year).astype(int)})
+    div_years = pd.date_range(end=asof, periods=years, freq='YS') + pd.DateOffset(months=6)
+    div = pd.DataFrame({'date': div_years.strftime('%Y-%m-%d'), 'stock_id': sid,
+                        'year': (div_years.year - 1912).astype(str) + '年',
+                        'CashEarningsDistribution': rng.random(years) * 5,
+                        'StockEarningsDistribution': rng.random(years) * 0.5})
+
+    n = len(recent) * len(INSTITUTIONS)
+    chip = pd.DataFrame({'date': np.repeat(recent, len(INSTITUTIONS)), 'stock_id': sid,
+                         'buy': rng.integers(0, 5_000_000, n), 'name': np.tile(INSTITUTIONS, len(recent)),
+                         'sell': rng.integers(0, 5_000_000, n)})
+    bal = 1_000_000 + rng.integers(-50_000, 50_000, len(recent)).cumsum()
+    margin = pd.DataFrame({'date': recent, 'stock_id': sid,
+                           'MarginPurchaseBuy': rng.integers(0, 50_000, len(recent)),
+                           'MarginPurchaseSell': rng.integers(0, 50_000, len(recent)),
+                           'MarginPurchaseTodayBalance': bal, 'MarginPurchaseYesterdayBalance': np.r_[bal[0], bal[:-1]],
+                           'ShortSaleTodayBalance': rng.integers(0, 100_000, len(recent))})
+
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+    price = pd.DataFrame({'Open': close * (1 + rng.normal(0, 0.005, len(days))), 'High': close * 1.01,
+                          'Low': close * 0.99, 'Close': close, 'Volume': rng.integers(1e5, 1e7, len(days)),
+                          'Dividends': 0.0, 'Stock Splits': 0.0},
+                         index=days.tz_localize('Asia/Taipei').rename('Date'))
+    info = {'marketCap': float(close[-1] * scale / 100), 'trailingPE': float(rng.random() * 30),
+            'currentPrice': float(close[-1]), 'regularMarketPreviousClose': float(close[-2]),
+            'sector': 'Financial Services' if rng.random() < 0.1 else 'Technology',
+            'averageVolume': int(rng.integers(1e5, 1e7))}
+
+    return {DATASETS['BALANCE_SHEET']: bs, DATASETS['INCOME_STATEMENT']: inc, DATASETS['CASH_FLOW']: cf,
+            DATASETS['REVENUE']: rev, DATASETS['DIVIDEND']: div, DATASETS['INSTITUTIONAL']: chip,
+            DATASETS['MARGIN']: margin, 'price': price, 'info': info}
+
+
+def make_universe(n, seed=0, asof=None):
+    """n 檔合成股票 {stock_id: make_stock(...)}，同一 seed 結果固定"""
+    rng = np.random.default_rng(seed)
+    return {str(1101 + i): make_stock(str(1101 + i), rng, asof) for i in range(n)}
+
+
+def frames(stock):
+    """MetricCalculator 的輸入順序 (bs, inc, cf, rev, div, chip, margin)"""
+    keys = ['BALANCE_SHEET', 'INCOME_STATEMENT', 'CASH_FLOW', 'REVENUE', 'DIVIDEND', 'INSTITUTIONAL', 'MARGIN']
+    return tuple(stock[DATASETS[k]] for k in keys)
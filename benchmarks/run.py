@@ -0,0 +1,249 @@
+"""
+離線效能基準測試 (非 pytest)，以合成的 FinMind / Yahoo 資料量測:
+MetricCalculator._pivot_data 與所有 calculate_*、generate_signals (逐檔)、score_frame 與技術指標 (整欄)，
+DataEngine 對本地替身伺服器的冷/熱抓取 (本地資料庫為空 / 已有資料)、籌碼全市場批次下載、多個工作階段同時抓同一檔，
+以及每檔的快取大小 (原始長表 vs src/compact 精簡格式)。
+
+    python -m benchmarks.run                          # 1 / 100 / 2000 檔
+    python -m benchmarks.run --sizes 1 100 --repeat 5
+    python -m benchmarks.run --save-baseline          # 更新 benchmarks/baseline.json
+
+回報每項最佳耗時、吞吐量 (檔/秒)、峰值記憶體 (tracemalloc)，並與基準比較；
+完整跑一次約 20 分鐘 (多數時間在 2000 檔的記憶體量測，可用 --skip-memory 略過)。結果比基準慢超過 --tolerance 即列為退化 (regression)，結束碼為 1。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 必須在匯入 src 前設定: 本地資料庫放暫存目錄、FinMind 端點指向替身伺服器 ---
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+PORT = _free_port()
+STORE_DIR = tempfile.mkdtemp(prefix='twquant-bench-')
+os.environ['TWQUANT_STORE_DIR'] = STORE_DIR
+os.environ['FINMIND_API_URL'] = f"http://127.0.0.1:{PORT}/api"
+os.environ['FINMIND_USER_INFO_URL'] = f"http://127.0.0.1:{PORT}/v2/user_info"
+logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+import pandas as pd
+from src.config import FETCH_WORKERS
+from src.metrics import MetricCalculator
+from src.strategy import generate_signals, signal_inputs, score_frame
+from src import data_loader, store, memo, bulk, technicals, scheduler
+from src.compact import compact_statement, compact_frame, compact_price, footprint
+from .fixtures import make_universe, frames
+from .stub_server import StubFinMind
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+METHODS = ['calculate_f_score', 'calculate_z_score', 'calculate_revenue_growth', 'calculate_guru_metrics',
+           'calculate_chip_metrics', 'calculate_margin_metrics', 'calculate_f_score_history',
+           'calculate_z_score_history']
+NOISE_FLOOR = 0.005  # 低於 5ms 的差異視為雜訊，不列為退化
+
+
+# ========================================================
+# 1. 量測工具
+# ========================================================
+def measure(fn, repeat, setup=None, memory=True):
+    """回傳 (最佳秒數, 峰值 MB)；峰值另跑一次 (tracemalloc 會拖慢計時)"""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup: setup()
+        t = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t)
+    if not memory: return best, float('nan')
+    if setup: setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+# ========================================================
+# 2. 計算層: _pivot_data / calculate_* / generate_signals / score_frame
+# ========================================================
+def metric_cases(universe):
+    """{名稱: (函式, 每次量測前的準備)}；calculate_* 每次先清空記憶化 (量測實際計算)，另量測全部命中的情況"""
+    inputs = [(frames(s), s['info']) for s in universe.values()]
+    calcs = [MetricCalculator(*f, info) for f, info in inputs]
+    pivot = calcs[0]._pivot_data
+
+    cases = {
+        '_pivot_data': (lambda: [pivot(f[i]) for f, _ in inputs for i in (0, 1, 2)], None),
+        'MetricCalculator()': (lambda: [MetricCalculator(*f, info) for f, info in inputs], None),
+    }
+    for name in METHODS:
+        cases[name] = (lambda name=name: [getattr(c, name)() for c in calcs], memo.clear)
+
+    def all_methods():
+        # 新的計算器 (如同 Streamlit 重跑)，輸入內容相同
+        for f, info in inputs:
+            c = MetricCalculator(*f, info)
+            for name in METHODS: getattr(c, name)()
+    cases['memo hit (all methods)'] = (all_methods, all_methods)
+
+    def signal_args(c):
+        mom, yoy = c.calculate_revenue_growth()
+        return (c.calculate_f_score()[0], c.calculate_z_score()[0], c.info, mom, yoy,
+                c.calculate_guru_metrics(), c.calculate_chip_metrics(), c.calculate_margin_metrics())
+    args = [signal_args(c) for c in calcs]
+    cases['generate_signals'] = (lambda: [generate_signals(*a) for a in args], None)
+    frame = pd.DataFrame([signal_inputs(*a) for a in args])
+    cases['score_frame'] = (lambda: score_frame(frame), None)
+
+    # 技術指標: 全部股票一次整欄計算 (日期 × 股票)
+    wide = {f: pd.DataFrame({sid: s['price'][f] for sid, s in universe.items()}) for f in technicals.FIELDS}
+    cases['technicals.latest'] = (lambda: technicals.latest(*(wide[f] for f in technicals.FIELDS)), None)
+    return cases
+
+
+def cache_footprint(universe):
+    """每檔平均的快取大小 (KB): st.cache_data 保存 pickle，取出後佔用記憶體"""
+    raw = [0, 0]; small = [0, 0]
+    for s in universe.values():
+        bs, inc, cf, rev, div, _, _ = frames(s)
+        for acc, obj in ((raw, (bs, inc, cf, rev, div, s['price'])),
+                         (small, (compact_statement(bs), compact_statement(inc), compact_statement(cf),
+                                  compact_frame(rev), compact_frame(div), compact_price(s['price'])))):
+            mem, pickled = footprint(obj)
+            acc[0] += mem; acc[1] += pickled
+    n = len(universe) * 1024
+    return {'raw_mem_kb': raw[0] / n, 'raw_pickle_kb': raw[1] / n, 'compact_mem_kb': small[0] / n, 'compact_pickle_kb': small[1] / n}
+
+
+# ========================================================
+# 3. 資料層: DataEngine 對替身伺服器
+# ========================================================
+def engine_cases(universe):
+    engine = data_loader.DataEngine(token='bench')
+    ids = list(universe)
+
+    def clear_cache():
+        data_loader.fetch_fundamentals_data.clear(); data_loader.fetch_chip_data.clear()
+
+    def cold():
+        clear_cache()
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
+        store.get_store.cache_clear(); scheduler.get_scheduler.cache_clear()
+
+    def fetch_all():
+        # 與 Screener.load 相同: 每檔一個工作，檔內各資料集再並行
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            list(pool.map(engine.get_financial_data, ids))
+
+    def chip_bulk():
+        # 全市場逐日下載後分送各檔，之後逐檔讀本地 (對照 DataEngine (cold) 的逐檔籌碼請求)
+        bulk.refresh(ids, token='bench')
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            list(pool.map(lambda sid: data_loader.fetch_chip_data(sid, 'bench'), ids))
+
+    def hot_ticker():
+        # 每檔一個「工作階段」同時分析同一檔: singleflight 下只有第一個向替身伺服器抓取
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            list(pool.map(lambda _: engine.get_financial_data(ids[0]), ids))
+
+    return {'DataEngine (cold)': (fetch_all, cold), 'DataEngine (warm)': (fetch_all, clear_cache),
+            'chip bulk (cold)': (chip_bulk, cold), 'hot ticker (cold)': (hot_ticker, cold)}
+
+
+# ========================================================
+# 4. 報表與基準比較
+# ========================================================
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+def compare(results, baseline, tolerance):
+    """在 results 中加上 'ratio' (相對基準)，回傳退化項目"""
+    regressions = []
+    for key, r in results.items():
+        base = baseline.get(key)
+        if not base: continue
+        r['ratio'] = r['seconds'] / base['seconds'] if base['seconds'] else None
+        if r['ratio'] and r['ratio'] > 1 + tolerance and r['seconds'] - base['seconds'] > NOISE_FLOOR:
+            regressions.append(key)
+    return regressions
+
+def report(results, regressions):
+    print(f"\n{'case':<28}{'n':>6}{'best (ms)':>12}{'stocks/s':>12}{'peak MB':>10}{'vs base':>10}")
+    print('-' * 78)
+    for key, r in results.items():
+        ratio = f"{r['ratio']:.2f}x" if r.get('ratio') else '-'
+        peak = '-' if r['peak_mb'] != r['peak_mb'] else f"{r['peak_mb']:.1f}"  # NaN: 未量測
+        flag = '  <-- regression' if key in regressions else ''
+        print(f"{r['case']:<28}{r['n']:>6}{r['seconds']*1000:>12.1f}{r['per_sec']:>12.1f}{peak:>10}{ratio:>10}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台股量化系統離線效能基準測試")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 2000], help="合成股票檔數")
+    parser.add_argument('--repeat', type=int, default=3, help="計算層每項重複次數 (取最佳；1000 檔以上固定 1 次)")
+    parser.add_argument('--engine-repeat', type=int, default=1, help="DataEngine 每項重複次數")
+    parser.add_argument('--skip-engine', action='store_true', help="只量測計算層")
+    parser.add_argument('--skip-memory', action='store_true', help="不量測峰值記憶體 (約快一倍)")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="將本次結果寫為基準")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="慢於基準多少比例視為退化")
+    parser.add_argument('--json', help="另存完整結果 (JSON)")
+    args = parser.parse_args(argv)
+
+    results, footprints = {}, {}
+    try:
+        for n in args.sizes:
+            t = time.perf_counter()
+            universe = make_universe(n)
+            print(f"[{n} 檔] 合成資料 {time.perf_counter() - t:.1f}s")
+            fp = footprints[n] = cache_footprint(universe)
+            print(f"  快取大小 (每檔): 記憶體 {fp['raw_mem_kb']:.0f} -> {fp['compact_mem_kb']:.0f} KB，"
+                  f"pickle {fp['raw_pickle_kb']:.0f} -> {fp['compact_pickle_kb']:.0f} KB")
+
+            repeat = args.repeat if n < 1000 else 1
+            cases = {name: (fn, setup, repeat) for name, (fn, setup) in metric_cases(universe).items()}
+            if not args.skip_engine:
+                cases.update({name: (fn, setup, args.engine_repeat) for name, (fn, setup) in engine_cases(universe).items()})
+
+            with StubFinMind(universe, port=PORT):
+                for name, (fn, setup, repeat) in cases.items():
+                    seconds, peak = measure(fn, repeat, setup, memory=not args.skip_memory)
+                    results[f"{n}/{name}"] = {'case': name, 'n': n, 'seconds': seconds, 'per_sec': n / seconds, 'peak_mb': peak}
+                    print(f"  {name:<28}{seconds*1000:>10.1f} ms")
+    finally:
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f: stored = json.load(f)
+        baseline = stored.get('results', {})
+        if stored.get('machine') != machine():
+            print(f"\n注意: 基準來自不同環境 {stored.get('machine')}，比較僅供參考")
+    regressions = compare(results, baseline, args.tolerance)
+    report(results, regressions)
+
+    if args.json:
+        with open(args.json, 'w') as f: json.dump({'machine': machine(), 'results': results, 'footprint': footprints}, f, indent=1)
+    if args.save_baseline:
+        merged = {**baseline, **{k: {f: r[f] for f in ('case', 'n', 'seconds', 'per_sec', 'peak_mb')} for k, r in results.items()}}
+        with open(args.baseline, 'w') as f: json.dump({'machine': machine(), 'results': merged}, f, indent=1, sort_keys=True)
+        print(f"\n基準已更新: {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} 項退化 (> {args.tolerance:.0%})")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import json
+import threading
+import pandas as pd
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubFinMind:
+    """
+    本地 FinMind 替身伺服器 (127.0.0.1，port=0 表示隨機埠)，供 DataEngine 離線基準測試。
+    - /api/v4/data: 依 dataset、data_id、start_date、end_date 回傳 universe 內的合成資料 (不帶 data_id 為全市場)
+    - /v2/user_info: 回傳極大額度，避免排程器節流影響量測
+    """
+    def __init__(self, universe, port=0):
+        self.universe = universe
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _payload(self, path, query):
+        """回傳 JSON 字串；未知路徑回傳 None"""
+        if path.endswith('/user_info'):
+            return json.dumps({'user_count': 0, 'api_request_limit': 10**9})
+        if path.endswith('/v4/data'):
+            dataset, sid = query.get('dataset', ''), query.get('data_id', '')
+            if sid:
+                df = self.universe.get(sid, {}).get(dataset)
+            else:  # 不帶 data_id: 全市場
+                parts = [stock[dataset] for stock in self.universe.values() if dataset in stock]
+                df = pd.concat(parts, ignore_index=True) if parts else None
+            if df is None: return '{"msg": "success", "status": 200, "data": []}'
+            since, until = query.get('start_date'), query.get('end_date')
+            if since: df = df[df['date'] >= since]
+            if until: df = df[df['date'] <= until]
+            return '{"msg": "success", "status": 200, "data": ' + df.to_json(orient='records') + '}'
+        return None
+
+    def _handler(self):
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive，與正式環境的連線池行為一致
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with stub._lock: stub.requests += 1
+                payload = stub._payload(url.path, query)
+                body = (payload if payload is not None else '{"msg": "not found"}').encode()
+                self.send_response(200 if payload is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args): pass
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
+from datetime import datetime
 from src.data_loader import DataEngine
-from src.metrics import MetricCalculator
-from src.strategy import generate_signals, suggest_order_type
+from src.pipeline import analyze, update, save_snapshot, load_snapshot
+from src.worker import last_event
+from src.strategy import suggest_order_type
+from src.telemetry import trace, span, waterfall
+from src.charts import price_figure
+from src import memo, health
+from src.config import CHART_RANGES, CHART_DEFAULT_RANGE
 
 st.set_page_config(page_title="台股全方位量化系統", layout="wide")
 st.title("🇹🇼 台股在地化全方位決策系統")
@@ -20,52 +25,64 @@ with st.sidebar:
         token = st.text_input("FinMind Token", type="password")
     
     run_btn = st.button("執行全方位分析", type="primary")
+    use_snapshot = st.checkbox("⚡ 使用預先計算結果", value=True, help="背景預熱或先前的分析結果，之後沒有新資料公布時直接讀取")
     
     st.divider()
     show_debug = st.checkbox("🔧 顯示原始數據狀態 (除錯用)")
 
+@st.fragment
+def price_chart(stock_id, price_df):
+    # 切換區間只重跑這一段 (不重新分析)；圖表依 (股票, 區間, 日 K 內容) 快取
+    rng = st.radio("K 線區間", list(CHART_RANGES), index=list(CHART_RANGES).index(CHART_DEFAULT_RANGE), horizontal=True)
+    st.plotly_chart(price_figure(stock_id, rng, price_df), use_container_width=True)
+
 if run_btn:
     engine = DataEngine(token=token if token else None)
     
-    with st.spinner(f"正在分析 {stock_id} (籌碼/財報/營收)..."):
+    debug_box = st.expander("🔍 原始數據檢查 (Debug)") if show_debug else None
+
+    with st.spinner(f"正在分析 {stock_id} (籌碼/財報/營收)..."), trace(stock_id) as tr:
         try:
-            # 1. 獲取數據
-            price_df, info = engine.get_price_data(stock_id)
-            bs, inc, cf, rev, div, chip, margin = engine.get_financial_data(stock_id)
-            
-            # --- 除錯模式顯示 ---
-           # main.py 的一部分，請替換 if show_debug: 這一塊
+            # 1. 先讀背景預熱 (python -m src.worker) 或先前的結果；之後有新資料公布才增量重算
+            res = None
+            if use_snapshot:
+                with span('pipeline', 'load_snapshot', cache='store'): res = load_snapshot(stock_id, fresh_after=last_event())
+            if res is None:
+                res = update(engine, stock_id) if use_snapshot else analyze(engine, stock_id)
+                with span('pipeline', 'save_snapshot'): save_snapshot(res)
+            else:
+                st.caption(f"⚡ 使用預先計算結果 ({datetime.fromtimestamp(res['computed_at']):%Y-%m-%d %H:%M})")
+
+            price_df, info, chip, margin = res['price_df'], res['info'], res['chip'], res['margin']
+            f_score, z_score, mom, yoy = res['f_score'], res['z_score'], res['mom'], res['yoy']
+            guru_metrics, chip_metrics, margin_metrics = res['guru_metrics'], res['chip_metrics'], res['margin_metrics']
+            total_score, action, color, reasons = res['total_score'], res['action'], res['color'], res['reasons']
 
             # --- 除錯模式顯示 ---
             if show_debug:
-                with st.expander("🔍 原始數據檢查 (Debug)"):
-                    st.write("--- 籌碼數據 (Chip) ---")
-                    if not chip.empty: 
-                        st.write(f"資料筆數: {len(chip)}")
-                        st.write(f"欄位名稱: {list(chip.columns)}") # 秀出欄位名
-                        st.dataframe(chip.tail(5)) # 秀出最近5筆
-                    else: 
-                        st.error("⚠️ 籌碼資料 (Chip) 為空！")
-                    
-                    st.write("--- 融資數據 (Margin) ---")
-                    if not margin.empty:
-                        st.write(f"欄位名稱: {list(margin.columns)}")
-                        st.dataframe(margin.tail(5))
-            
-            # 2. 計算指標
-            calculator = MetricCalculator(bs, inc, cf, rev, div, chip, margin, info)
-            
-            f_score, f_details = calculator.calculate_f_score()
-            z_score, z_msg = calculator.calculate_z_score()
-            mom, yoy = calculator.calculate_revenue_growth()
-            guru_metrics = calculator.calculate_guru_metrics()
-            chip_metrics = calculator.calculate_chip_metrics()
-            margin_metrics = calculator.calculate_margin_metrics()
-            
-            # 3. 策略生成
-            total_score, action, color, reasons = generate_signals(
-                f_score, z_score, info, mom, yoy, guru_metrics, chip_metrics, margin_metrics
-            )
+                with debug_box:
+                    if chip is None:
+                        st.info("使用預先計算結果，未載入原始數據 (取消勾選「使用預先計算結果」可重新抓取)")
+                    else:
+                        st.write("--- 籌碼數據 (Chip) ---")
+                        if not chip.empty: 
+                            st.write(f"資料筆數: {len(chip)}")
+                            st.write(f"欄位名稱: {list(chip.columns)}") # 秀出欄位名
+                            st.dataframe(chip.tail(5)) # 秀出最近5筆
+                        else: 
+                            st.error("⚠️ 籌碼資料 (Chip) 為空！")
+                        
+                        st.write("--- 融資數據 (Margin) ---")
+                        if not margin.empty:
+                            st.write(f"欄位名稱: {list(margin.columns)}")
+                            st.dataframe(margin.tail(5))
+
+                    q = engine.get_quota()
+                    st.write(f"--- FinMind 額度 (近一小時) --- 已用 {q['used']} / {q['limit']}，剩餘 {q['remaining']}")
+                    m = memo.stats()
+                    st.write(f"--- 指標快取 --- 命中 {m['hits']} / 未命中 {m['misses']}，{m['entries']} 筆 ({m['bytes'] / 1024:.0f} KB)")
+                    for name, h in health.status().items():
+                        st.write(f"--- 上游 {name} --- {h['state']}，連續失敗 {h['failures']} 次" + (f"，{h['retry_in']:.0f} 秒後試探" if h['retry_in'] else ""))
             
             # --- UI ---
             st.divider()
@@ -113,11 +130,28 @@ if run_btn:
             g2.metric("神奇公式", f"ROC {guru_metrics.get('Magic ROC', 0):.1f}%")
             g3.metric("F-Score", f"{f_score}/9")
 
+            # D. 技術指標 (日線計算；舊快照沒有此欄)
+            tech = res.get('technical') or {}
+            fmt = lambda k, spec: format(tech[k], spec) if k in tech else "N/A"
+            st.subheader("📉 技術指標")
+            t1, t2, t3, t4 = st.columns(4)
+            t1.metric("RSI (14)", fmt('RSI', '.0f'), help="> 80 過熱，< 30 超賣")
+            t2.metric("ATR", f"{fmt('ATR %', '.1f')}%", help="14 日平均真實波幅 / 現價")
+            t3.metric("距 52 週高點", f"{fmt('52W High Dist', '.1f')}%")
+            t4.metric("量能 z 分數", fmt('Volume Z', '.1f'), help="今日成交量相對近 20 日的標準差倍數")
+
             st.markdown("#### 📝 評分依據")
             for r in reasons: st.write(r)
 
             if not price_df.empty:
-                st.plotly_chart(go.Figure(data=[go.Candlestick(x=price_df.index, open=price_df['Open'], high=price_df['High'], low=price_df['Low'], close=price_df['Close'])]), use_container_width=True)
+                price_chart(stock_id, price_df)
 
         except Exception as e:
             st.error(f"分析失敗: {e}")
+
+    # --- 各階段耗時瀑布圖 (失敗時也顯示，方便找出卡在哪一步) ---
+    if debug_box is not None:
+        with debug_box:
+            st.write("--- 各階段耗時 (Waterfall) ---")
+            st.plotly_chart(waterfall(tr), use_container_width=True)
+            st.dataframe(tr.frame(), use_container_width=True)
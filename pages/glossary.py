@@ -1,5 +1,5 @@
 import streamlit as st
-import pandas as pd
+from src.strategy import rule_table, ACTIONS
 
 st.set_page_config(page_title="系統說明書", layout="wide")
 
@@ -13,42 +13,12 @@ st.markdown("""
 st.header("1. 台股在地化估值模型 (Localized Valuation)")
 st.info("總分越高，代表買進訊號越強烈。本系統結合「基本面體質」與「在地化動能」。")
 
-# 建立評分邏輯表 (與 strategy.py 邏輯完全一致)
-score_data = {
-    "維度": [
-        "基本面 (F-Score)", "基本面 (F-Score)", 
-        "風險 (Z-Score)", 
-        "價值 (Graham)", "價值 (Graham)",
-        "成長 (Lynch)", "成長 (Lynch)",
-        "品質 (Magic)",
-        "在地化 (Revenue)", "在地化 (Revenue)",
-        "在地化 (Chips)", "在地化 (Chips)",
-        "風險 (Liquidity)"
-    ],
-    "判斷邏輯": [
-        "F-Score ≥ 8 分", "F-Score ≤ 3 分",
-        "Z-Score < 1.81",
-        "現價 < 葛拉漢數 (且流動比>1.5)", "現價 < 葛拉漢數 (流動比不足)",
-        "PEG < 0.5 (極度低估)", "PEG < 1.0 (合理)",
-        "ROC > 20% 且 盈餘殖利率 > 5%",
-        "營收 YoY > 20% & MoM > 0", "營收 YoY > 20%",
-        "投信積極認養 (中小型股)", "外資連續 3 日買超",
-        "日均量 < 500 張"
-    ],
-    "分數": [
-        "+2", "-2",
-        "-3 (重扣)",
-        "+2", "+1",
-        "+2", "+1",
-        "+2",
-        "+2", "+1",
-        "+2", "+1",
-        "-2 (扣分)"
-    ]
-}
-
-df_score = pd.DataFrame(score_data)
+# 評分邏輯表直接由 strategy.RULES 產生 (與實際評分同一份定義)
+df_score = rule_table()
 st.table(df_score)
+st.caption("總分 → 評級: " + "、".join(
+    f"{'≥ ' + str(floor) if floor > -float('inf') else '< ' + str(ACTIONS[i - 1][0])} {action}"
+    for i, (floor, action, _) in enumerate(ACTIONS)))
 
 st.divider()
 
@@ -106,7 +76,7 @@ with st.expander("💰 三大法人籌碼 (Institutional Chips)"):
     * **台股：** 每日盤後揭露三大法人買賣超。
     
     [cite_start]**策略邏輯 [cite: 323, 330-334]:**
-    * **外資 (Foreign):** 資金量大，**連續 3 日買超** 通常代表波段趨勢 (+1 分)。
+    * **外資 (Foreign):** 資金量大，**連續 3 日買超** 通常代表波段趨勢 (+1 分)。外資以每日「外資 + 外資自營商」合計計算，近 3 日為最近 3 個交易日。
     * **投信 (Trust):** 追求績效，偏好認養 **中小型成長股** (股本 < 50億)。當投信近期積極買超這類股票時，往往隱含作帳行情 (+2 分)。
     """)
 
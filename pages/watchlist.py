@@ -0,0 +1,120 @@
+import re
+import streamlit as st
+import pandas as pd
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from src.config import WATCHLIST, COMPARE_WORKERS, COMPARE_TIMEOUT
+from src.pipeline import analyze_row, process_pool
+from src.worker import last_event
+
+MAX_WORKERS = max(COMPARE_WORKERS, 1) * 2   # 並行程序數上限 (程序池大小)
+
+st.set_page_config(page_title="觀察清單比較", layout="wide")
+st.title("📋 觀察清單比較")
+st.markdown("多檔股票並行分析 (每檔一個程序)，完成一檔即加入表格；點欄位標題可排序。")
+
+with st.sidebar:
+    st.header("比較設定")
+    tickers = st.text_area("股票代號 (空白、逗號或換行分隔)", value=" ".join(WATCHLIST), height=150)
+
+    if "FINMIND_TOKEN" in st.secrets:
+        token = st.secrets["FINMIND_TOKEN"]
+        st.success("✅ Token 已載入")
+    else:
+        token = st.text_input("FinMind Token", type="password")
+
+    workers = st.slider("並行程序數", 1, MAX_WORKERS, COMPARE_WORKERS)
+    use_snapshot = st.checkbox("⚡ 使用預先計算結果", value=True, help="背景預熱或先前的分析結果，之後沒有新資料公布時直接讀取")
+    run_btn = st.button("開始比較", type="primary")
+
+@st.cache_resource
+def get_pool():
+    """
+    程序池跨重新執行保留 (啟動子程序需匯入 pandas 等，約 1~2 秒)。只建一個上限大小的池子，
+    並行程序數由送出的工作數控制 (調整滑桿不會另建池子)；子程序只在有工作時才啟動。
+    """
+    return process_pool(MAX_WORKERS)
+
+def reset_pool(pool):
+    """子程序異常結束: 關閉舊池子，下次重建"""
+    pool.shutdown(wait=False, cancel_futures=True)
+    get_pool.clear()
+
+COLUMNS = {
+    'Score': st.column_config.NumberColumn("總分", format="%d"),
+    'Action': st.column_config.TextColumn("評級"),
+    'F-Score': st.column_config.NumberColumn("F-Score", format="%d"),
+    'Z-Score': st.column_config.NumberColumn("Z-Score", format="%.2f"),
+    'MoM': st.column_config.NumberColumn("營收 MoM %", format="%.1f"),
+    'YoY': st.column_config.NumberColumn("營收 YoY %", format="%.1f"),
+    'Lynch Category': st.column_config.TextColumn("林區分類"),
+    'Lynch PEG': st.column_config.NumberColumn("PEG", format="%.2f"),
+    'Magic ROC': st.column_config.NumberColumn("ROC %", format="%.1f"),
+    'Magic EY': st.column_config.NumberColumn("EY %", format="%.1f"),
+    'Foreign Net (3d)': st.column_config.NumberColumn("外資 3日 (股)", format="%d"),
+    'Foreign Consecutive': st.column_config.CheckboxColumn("外資連買"),
+    'Trust Net (10d)': st.column_config.NumberColumn("投信 10日 (股)", format="%d"),
+    'Trust Active Buy': st.column_config.CheckboxColumn("投信認養"),
+    'Latest Balance': st.column_config.NumberColumn("融資餘額 (張)", format="%d"),
+    'Change': st.column_config.NumberColumn("融資 5日增減", format="%d"),
+    'computed_at': st.column_config.DatetimeColumn("計算時間", format="MM-DD HH:mm"),
+}
+
+def _table(rows):
+    df = pd.DataFrame(rows).set_index('stock_id')
+    if 'computed_at' in df.columns: df['computed_at'] = pd.to_datetime(df['computed_at'], unit='s', utc=True).dt.tz_convert('Asia/Taipei')
+    if 'Score' in df.columns: df = df.sort_values('Score', ascending=False, na_position='last')
+    return df
+
+if run_btn:
+    stock_ids = list(dict.fromkeys(t for t in re.split(r'[\s,，]+', tickers.upper()) if t))
+    if not stock_ids:
+        st.warning("請輸入至少一檔股票代號")
+        st.stop()
+
+    pool = get_pool()
+    fresh_after = last_event() if use_snapshot else None
+    pending = list(stock_ids)   # 尚未送出 (同時最多 workers 檔在程序池中)
+    running = {}                # future -> (股票, 送出時的程序池)
+    deadline = time.monotonic() + COMPARE_TIMEOUT
+
+    progress = st.progress(0.0, text=f"0 / {len(stock_ids)}")
+    table = st.empty()
+    rows = []
+
+    def broken(pool, p, sid, e):
+        """子程序異常結束: 該檔記為失敗；p (送出時的池子) 仍是目前的池子才重建 (同一個壞池子只重建一次)"""
+        rows.append({'stock_id': sid, 'Action': f"失敗: {e}"})
+        if p is not pool: return pool
+        reset_pool(pool)
+        return get_pool()
+
+    # 依完成順序填入，慢的股票不會擋住其他股票
+    while pending or running:
+        while pending and len(running) < workers:
+            sid = pending.pop(0)
+            try:
+                running[pool.submit(analyze_row, sid, token or None, fresh_after)] = (sid, pool)
+            except BrokenProcessPool as e:
+                pool = broken(pool, pool, sid, e)
+        if not running: continue
+        done, _ = wait(running, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if not done: break
+        for fut in done:
+            sid, p = running.pop(fut)
+            try:
+                rows.append(fut.result())
+            except BrokenProcessPool as e:
+                pool = broken(pool, p, sid, e)
+            except Exception as e:
+                rows.append({'stock_id': sid, 'Action': f"失敗: {e}"})
+            progress.progress(len(rows) / len(stock_ids), text=f"{len(rows)} / {len(stock_ids)} ({sid})")
+        table.dataframe(_table(rows), column_config=COLUMNS, use_container_width=True)
+
+    if pending or running:
+        # 執行中的工作無法中止: 在背景算完後寫入快照 (下次比較可直接讀取)；未送出的不再執行
+        rows += [{'stock_id': sid, 'Action': "逾時 (背景繼續計算)"} for sid, _ in running.values()]
+        rows += [{'stock_id': sid, 'Action': "逾時 (未開始)"} for sid in pending]
+        table.dataframe(_table(rows), column_config=COLUMNS, use_container_width=True)
+        st.warning(f"超過 {COMPARE_TIMEOUT} 秒: {len(running)} 檔仍在背景計算 (完成後存入預先計算結果)，{len(pending)} 檔未開始")
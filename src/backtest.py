@@ -0,0 +1,258 @@
+import os
+import pandas as pd
+import numpy as np
+from .config import STATEMENT_LAG_DAYS, REVENUE_LAG_DAYS, STATEMENT_YOY_DAYS, REVENUE_YOY_DAYS
+from .metrics import f_score_components, F_COMPONENTS
+from .screener import Screener, statement_panel
+from .data_loader import DataEngine
+from .strategy import score_frame
+from . import technicals
+
+
+# ========================================================
+# 0. 面板工具
+# ========================================================
+def _prior_rows(panel, query, days):
+    """query 為 (stock_id, date) 索引，回傳每列去年同期 (± days 天內最新) 的面板列"""
+    if panel.empty or len(query) == 0: return pd.DataFrame(np.nan, index=query, columns=panel.columns)
+    q = query.to_frame(index=False)
+    q['key'] = q['date'] - pd.DateOffset(years=1) + pd.Timedelta(days=days)
+    q['_pos'] = np.arange(len(q))
+    right = panel.index.to_frame(index=False).rename(columns={'date': 'match'}).sort_values('match')
+    m = pd.merge_asof(q.sort_values('key'), right, left_on='key', right_on='match', by='stock_id',
+                      direction='backward', tolerance=pd.Timedelta(days=2 * days)).sort_values('_pos')
+    out = panel.reindex(pd.MultiIndex.from_arrays([m['stock_id'], m['match']]))
+    out.index = query
+    return out
+
+def _rolling(s, window):
+    """依股票分組的滾動加總 (面板需依日期由舊到新排序)"""
+    return s.groupby(level=0).rolling(window, min_periods=1).sum().droplevel(0)
+
+def _asof_join(grid, table, on):
+    """grid (stock_id, date) 對 table 依公告日 on 做時點合併：只取 date 當下已公告的最新一筆"""
+    right = table.reset_index().drop(columns='date').sort_values(on)
+    return pd.merge_asof(grid.sort_values('date'), right, left_on='date', right_on=on, by='stock_id', direction='backward')
+
+
+# ========================================================
+# 1. 每季指標 (所有股票 × 所有季度)
+# ========================================================
+def quarterly_metrics(bs, inc, cf):
+    """
+    每檔每季的 F-Score、Z-Score 比率 (不含市值)、葛拉漢與神奇公式所需欄位。
+    規則與 MetricCalculator 相同，只是對所有季度一次做欄位運算。
+    """
+    if inc.empty or bs.empty: return pd.DataFrame()
+    q = inc.sort_index(level=[0, 1]).index
+    c_inc = inc.reindex(q).fillna(0)
+    b = bs.reindex(q).fillna(0)
+    c_cf = cf.reindex(q).fillna(0) if not cf.empty else pd.DataFrame(0.0, index=q, columns=inc.columns)
+
+    # --- F-Score (該季缺資產負債表/現金流量表記 0 分) ---
+    comp = f_score_components(c_inc, b, c_cf, _prior_rows(inc, q, STATEMENT_YOY_DAYS).fillna(0), _prior_rows(bs, q, STATEMENT_YOY_DAYS).fillna(0))
+    has_cf = q.isin(cf.index) | ~q.get_level_values(0).isin(cf.index.get_level_values(0))
+    comp.loc[~(q.isin(bs.index) & has_cf)] = False
+    out = pd.DataFrame({'F-Score': comp[F_COMPONENTS].sum(axis=1)}, index=q)
+
+    # --- Z-Score 比率 (X4 = 市值/負債 在回測日計算) ---
+    ta = b['ASSETS'].where(b['ASSETS'] != 0); tl = b['LIABILITIES'].where(b['LIABILITIES'] != 0)
+    ebit = c_inc['EBIT'].where(c_inc['EBIT'] != 0, c_inc['PRE_TAX_INCOME'] + c_inc['INTEREST_EXPENSE'])
+    out['Z_BASE'] = (1.2 * (b['CURRENT_ASSETS'] - b['CURRENT_LIABILITIES']) + 1.4 * b['RETAINED_EARNINGS']
+                     + 3.3 * ebit + 1.0 * c_inc['REVENUE']) / ta
+    out['TL'] = tl
+
+    # --- 葛拉漢數: 過去 20 季平均 EPS (EPS 缺值時以淨利/股數代替，可拆成兩組滾動加總) ---
+    cs = b['COMMON_STOCK']
+    shares = (cs / 10).where(cs > 0, 1)
+    eps = c_inc['EPS']; ni = c_inc['NET_INCOME']
+    n_eps = _rolling((eps != 0).astype(float), 20); s_eps = _rolling(eps, 20)
+    n_ni = _rolling(((eps == 0) & (ni != 0)).astype(float), 20); s_ni = _rolling(ni.where(eps == 0, 0), 20)
+    n = n_eps + n_ni
+    avg_eps = ((s_eps + s_ni / shares) / n).where(n > 0, 0) * 4
+    bvps = b['EQUITY'] / shares
+    out['Graham Number'] = np.sqrt((22.5 * avg_eps * bvps).where((avg_eps > 0) & (bvps > 0), 0))
+    out['Avg EPS'] = avg_eps
+    # 近 4 季 EPS 合計 (推算本益比用)
+    full4 = _rolling(((eps != 0) | (ni != 0)).astype(float), 4) >= 4
+    out['TTM EPS'] = (_rolling(eps, 4) + _rolling(ni.where(eps == 0, 0), 4) / shares).where(full4)
+    out['SHARES'] = shares
+
+    curr_assets = b['CURRENT_ASSETS']; curr_liab = b['CURRENT_LIABILITIES']
+    out['Current Ratio'] = (curr_assets / curr_liab).where(curr_liab > 0, 0)
+    out['NCAV'] = (curr_assets - b['LIABILITIES']) / shares
+
+    # --- 神奇公式: TTM EBIT (不足 4 季以平均年化) ---
+    nz = ebit.where(ebit != 0, 0)
+    cnt = _rolling((ebit != 0).astype(float), 4); total = _rolling(nz, 4)
+    ebit_ttm = (total / cnt * 4).where((cnt > 0) & (cnt < 4), total)
+    ic = b['FIXED_ASSETS'] + (curr_assets - curr_liab)
+    out['Magic ROC'] = (ebit_ttm / ic * 100).where(ic > 0, 0)
+    out['EBIT TTM'] = ebit_ttm
+    out['NET_DEBT'] = b['LIABILITIES'] - b['CASH']
+
+    # 公告日
+    months = q.get_level_values(1).month
+    lag = pd.to_timedelta([STATEMENT_LAG_DAYS.get(m, 90) for m in months], unit='D')
+    out['avail'] = q.get_level_values(1) + lag
+    return out
+
+
+# ========================================================
+# 2. 每月營收動能 (所有股票 × 所有月份)
+# ========================================================
+def monthly_revenue(rev):
+    if rev.empty: return pd.DataFrame()
+    val_col = 'revenue' if 'revenue' in rev.columns else ('value' if 'value' in rev.columns else None)
+    if not val_col: return pd.DataFrame()
+
+    df = rev[['stock_id', 'date', val_col]].copy()
+    df['date'] = pd.to_datetime(df['date'])
+    panel = df.drop_duplicates(['stock_id', 'date']).set_index(['stock_id', 'date'])[[val_col]].rename(columns={val_col: 'rev'})
+    panel = panel.sort_index(level=[0, 1])
+
+    curr = panel['rev']
+    last = curr.groupby(level=0).shift(1)
+    prev = _prior_rows(panel, panel.index, REVENUE_YOY_DAYS)['rev']
+    out = pd.DataFrame({
+        'MoM': ((curr - last) / last * 100).where(last.fillna(0) != 0, 0).where(last.notna()),
+        'YoY': ((curr - prev) / prev * 100).where(prev.fillna(0) != 0, 0).where(last.notna()),
+    }, index=panel.index)
+    out['avail_rev'] = out.index.get_level_values(1) + pd.Timedelta(days=REVENUE_LAG_DAYS)
+    return out
+
+
+# ========================================================
+# 3. 回測引擎
+# ========================================================
+def rebalance_dates(close, freq='M'):
+    """每期 (月/週) 最後一個交易日"""
+    idx = close.index
+    return pd.DatetimeIndex(idx.to_series().groupby(idx.to_period(freq)).max().values)
+
+class Backtester:
+    """
+    估值評分卡的時點 (point-in-time) 回測。
+    每個調整日只使用當時已公告的財報 (季底 + 公告期限) 與月營收 (次月 10 日)，
+    股價相關欄位 (市值、本益比、均量、技術指標) 由當日股價重建。籌碼/融資無長期歷史，不納入回測。
+    """
+    def __init__(self, panels, freq='M', horizons=(21, 63)):
+        self.panels = panels
+        self.freq = freq
+        self.horizons = horizons
+
+    def _grid(self):
+        close = self.panels['close']
+        dates = rebalance_dates(close, self.freq)
+        ids = close.columns
+        grid = pd.DataFrame({'stock_id': np.repeat(ids.values, len(dates)), 'date': np.tile(dates.values, len(ids))})
+        return grid, dates
+
+    def inputs(self):
+        """
+        每個 (調整日, 股票) 的評分輸入 (strategy.INPUTS 欄名) 與未來報酬 (fwd_*)。
+        scorable 標記有股價與財報、可評分的列。參數掃描 (src/optimizer.py) 只算這一次，之後只換門檻重評分。
+        """
+        p = self.panels
+        close = p['close']; volume = p.get('volume', pd.DataFrame())
+        grid, dates = self._grid()
+
+        # --- A. 時點財報與營收 ---
+        q = quarterly_metrics(statement_panel(p['bs']), statement_panel(p['inc']), statement_panel(p['cf']))
+        if not q.empty: grid = _asof_join(grid, q, 'avail')
+        r = monthly_revenue(p['rev'])
+        if not r.empty: grid = _asof_join(grid, r, 'avail_rev')
+
+        div = p.get('div', pd.DataFrame())
+        if not div.empty and 'CashEarningsDistribution' in div.columns:
+            d = div[['stock_id', 'date', 'CashEarningsDistribution']].copy()
+            d['div_date'] = pd.to_datetime(d['date'])
+            d['CashEarningsDistribution'] = pd.to_numeric(d['CashEarningsDistribution'], errors='coerce')
+            grid = pd.merge_asof(grid.sort_values('date'), d.drop(columns='date').sort_values('div_date'),
+                                 left_on='date', right_on='div_date', by='stock_id', direction='backward')
+
+        # --- B. 當日股價重建 info ---
+        def at(matrix, name):
+            if matrix.empty: return pd.Series(np.nan, index=grid.index)
+            s = matrix.reindex(dates).stack().rename(name)
+            s.index.names = ['date', 'stock_id']
+            return grid[['date', 'stock_id']].merge(s.reset_index(), on=['date', 'stock_id'], how='left')[name].values
+
+        grid = grid.reset_index(drop=True)
+        grid['price'] = at(close.ffill(), 'price')
+        # 技術指標: 與即時評分同一套整欄計算 (technicals.indicators)，取調整日當天的值
+        ohlv = [None if p.get(k) is None or p[k].empty else p[k].reindex_like(close) for k in ('high', 'low', 'volume')]
+        tech = technicals.indicators(close, *ohlv)
+        for name in ['MA60', 'RSI', 'Volume Z', '52W High Dist']: grid[name] = at(tech[name], name)
+        grid['avg_volume'] = at(tech['Average Volume'], 'avg_volume') if not volume.empty else np.nan
+        for c in ['SHARES', 'TTM EPS', 'Z_BASE', 'TL', 'EBIT TTM', 'NET_DEBT', 'MoM', 'YoY', 'CashEarningsDistribution']:
+            if c not in grid.columns: grid[c] = np.nan
+        grid['mcap'] = grid['price'] * grid['SHARES']
+        grid['pe'] = (grid['price'] / grid['TTM EPS']).where(grid['TTM EPS'] > 0)
+        sector = p['info']['sector'] if 'sector' in p['info'].columns else pd.Series(dtype=object)
+        grid['sector'] = grid['stock_id'].map(sector).fillna('').astype(str)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = grid['Z_BASE'] + 0.6 * grid['mcap'] / grid['TL']
+        financial = grid['sector'].str.contains('Financial|Bank|Insurance', regex=True)
+        grid['Z-Score'] = z.where(~financial)
+        dy = (grid['CashEarningsDistribution'] / grid['price'] * 100).where(grid['price'] > 0).fillna(0)
+        growth = grid['YoY'].fillna(0)
+        denom = growth + dy
+        grid['Lynch PEG'] = (grid['pe'] / denom).where((denom > 0) & (grid['pe'] > 0))
+        ev = grid['mcap'] + grid['NET_DEBT']
+        grid['Magic EY'] = (grid['EBIT TTM'] / ev * 100).where(ev > 0, 0)
+
+        # --- C. 未來報酬 (下一個調整日 + 固定交易日數) ---
+        px = close.ffill()
+        fwd = {'fwd_period': px.reindex(dates).shift(-1) / px.reindex(dates) - 1}
+        for h in self.horizons: fwd[f'fwd_{h}d'] = (px.shift(-h) / px - 1).reindex(dates)
+        for name, m in fwd.items(): grid[name] = at(m, name)
+
+        grid['Price'] = grid['price']; grid['Average Volume'] = grid['avg_volume']
+        grid['scorable'] = grid['price'].notna() & grid['F-Score'].notna() if 'F-Score' in grid.columns else False
+        return grid
+
+    def signals(self):
+        """每個 (調整日, 股票) 的評分、動作與未來報酬"""
+        grid = self.inputs()
+
+        # --- 評分卡 (strategy.RULES 整欄計算；回測無籌碼 / 融資) ---
+        grid['Score'] = np.nan; grid['Action'] = None
+        ok = grid['scorable']
+        if ok.any():
+            scored = score_frame(grid.loc[ok])
+            grid.loc[ok, 'Score'] = scored['Score']; grid.loc[ok, 'Action'] = scored['Action']
+
+        keep = ['date', 'stock_id', 'Score', 'Action', 'F-Score', 'Z-Score', 'Lynch PEG', 'Magic ROC', 'Magic EY', 'MoM', 'YoY', 'price']
+        keep += [c for c in grid.columns if c.startswith('fwd_')]
+        return grid[[c for c in keep if c in grid.columns]].sort_values(['date', 'stock_id']).reset_index(drop=True)
+
+    def run(self):
+        """回傳 (每期訊號明細, 各分數區間的報酬統計)"""
+        sig = self.signals()
+        return sig, summarize(sig)
+
+
+def summarize(signals, by='Action', ret='fwd_period'):
+    """各評分區間的樣本數、平均/中位數報酬與勝率"""
+    df = signals.dropna(subset=['Score', ret])
+    g = df.groupby(by)[ret]
+    out = pd.DataFrame({'count': g.size(), 'mean': g.mean(), 'median': g.median(),
+                        'hit_rate': (df[ret] > 0).groupby(df[by]).mean()})
+    return out.sort_values('mean', ascending=False)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="評分卡時點回測")
+    parser.add_argument("--stocks", nargs="*", help="股票代號 (預設為全市場)")
+    parser.add_argument("--freq", default="M", choices=["M", "W"])
+    parser.add_argument("--out", default="backtest.csv")
+    args = parser.parse_args()
+
+    screener = Screener(DataEngine(token=os.environ.get("FINMIND_TOKEN")))
+    stocks = args.stocks or screener.engine.get_stock_universe()['stock_id'].tolist()
+    sig, summary = Backtester(screener.load(stocks), freq=args.freq).run()
+    sig.to_csv(args.out, index=False, encoding="utf-8-sig")
+    print(summary)
@@ -0,0 +1,121 @@
+"""
+籌碼 / 融資的全市場批次下載:
+FinMind 不帶 data_id 時一次回傳某交易日的全市場資料。逐日抓取後存成全市場檔 (stock_id='_all')，
+再分送到各檔的本地資料 (與逐檔抓取同一份 Parquet)，fetch_chip_data 在 ttl 內直接讀本地。
+全市場刷新由每檔 2 個請求降為每個交易日 2 個請求 (另加 1 個交易日曆)。
+"""
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import pandas as pd
+from .config import DATASETS, STORE_TTL, CHIP_LOOKBACK_DAYS, PREWARM_TIMEZONE
+from .store import get_store
+from .data_loader import fetch_raw_api
+from .prices import clean_id
+from .telemetry import span, annotate
+from . import singleflight
+
+BULK_KEYS = ['INSTITUTIONAL', 'MARGIN']
+MARKET = '_all'                        # 全市場檔在本地資料庫的 stock_id
+CALENDAR = 'TaiwanStockTradingDate'
+TZ = ZoneInfo(PREWARM_TIMEZONE)
+
+
+# ========================================================
+# 1. 交易日
+# ========================================================
+def window_start():
+    """與 fetch_chip_data 相同的起始日 (YYYY-MM-DD)"""
+    return (datetime.now() - timedelta(days=CHIP_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+
+def trading_days(start, token=None):
+    """
+    start (含) 到今天的交易日 -> (日期清單, 是否為實際日曆)。
+    交易日曆查不到時以週一至週五代替 (國定假日會被當成交易日，抓到空表即略過)。
+    """
+    today = datetime.now(TZ).strftime('%Y-%m-%d')
+    cal = fetch_raw_api(CALENDAR, '', start, token)
+    if not cal.empty and 'date' in cal.columns:
+        days = set(cal['date'].astype(str))
+        if datetime.now(TZ).weekday() < 5: days.add(today)  # 日曆可能尚未列入今天
+        return sorted(d for d in days if start <= d <= today), True
+    days = pd.bdate_range(start, today).strftime('%Y-%m-%d')
+    return list(days), False
+
+
+# ========================================================
+# 2. 逐日抓取全市場
+# ========================================================
+def ingest(key, token=None, refetch_last=False, max_days=None):
+    """
+    補齊全市場檔在視窗內缺少的交易日 -> (視窗內的全市場資料, 是否完整)。
+    refetch_last: 重抓最近一個交易日 (剛公布或更正)。max_days: 待補日數超過時不抓，回傳 (None, False)。
+    過去的交易日抓到空表視為失敗 (例如 token 無全市場權限)，立即停止並回傳不完整。
+    同一資料集同時只有一個呼叫端抓取 (singleflight)。
+    """
+    dataset, store = DATASETS[key], get_store()
+    start = window_start()
+    days, exact = trading_days(start, token)
+    since_wait = time.time()
+    with singleflight.hold((dataset, MARKET), root=store.root):
+        # 等待期間其他呼叫端補進的交易日不再抓 (剛重抓過的最近一日也不重抓)
+        st = store.status(dataset, MARKET)
+        refetch_last = refetch_last and not (st and st['updated_at'] >= since_wait)
+        return _ingest(store, dataset, start, days, exact, token, refetch_last, max_days)
+
+def _ingest(store, dataset, start, days, exact, token, refetch_last, max_days):
+    market = store.read(dataset, MARKET, start)
+    have = set(market['date'].astype(str)) if not market.empty else set()
+    todo = [d for d in days if d not in have]
+    if refetch_last and days and days[-1] in have: todo.append(days[-1])
+    if max_days is not None and len(todo) > max_days: return None, False
+
+    today = datetime.now(TZ).strftime('%Y-%m-%d')
+    new, complete = [], True
+    for day in todo:
+        with span('finmind', f"{dataset} (bulk)", cache='api') as s:
+            df = fetch_raw_api(dataset, '', day, token, end_date=day)
+            s['rows'] = len(df)
+        if not df.empty:
+            new.append(df)
+        elif day < today and exact:
+            complete = False
+            break
+        # 今天尚未公布 (或非實際日曆的假日): 略過，下次再抓
+
+    if new:
+        # 只保留視窗內的資料，整檔改寫 (全市場檔不需要更早的歷史)
+        market = store.merge(dataset, MARKET, pd.concat([market, *new], ignore_index=True), first_date=start, replace=True)
+    return market, complete
+
+
+# ========================================================
+# 3. 分送各檔
+# ========================================================
+def refresh(stock_ids, token=None, fresh=(), ttl=STORE_TTL['CHIP']):
+    """
+    更新多檔的籌碼 / 融資本地資料: ttl 內更新過的略過；其餘由全市場檔補齊後分送。
+    fresh 中的資料集 (剛公布) 重抓最近一個交易日。回傳 {資料集鍵: 分送的檔數}。
+    待補交易日數多於過期檔數時不做 (逐檔抓較省)；全市場抓取不完整時也不分送，
+    兩者都留給 fetch_chip_data 逐檔補上。
+    """
+    store, start = get_store(), window_start()
+    ids = list(dict.fromkeys(map(clean_id, stock_ids)))
+    done = {}
+    for key in BULK_KEYS:
+        dataset = DATASETS[key]
+        status = {sid: store.status(dataset, sid) for sid in ids}
+        stale = [sid for sid in ids if not status[sid] or not status[sid]['first_date'] or status[sid]['first_date'] > start
+                 or time.time() - status[sid]['updated_at'] >= ttl]
+        if not stale: continue
+        annotate(cache='api')
+
+        market, complete = ingest(key, token, refetch_last=key in fresh, max_days=len(stale))
+        if market is None or not complete: continue
+        groups = dict(tuple(market.groupby(market['stock_id'].astype(str), sort=False))) if not market.empty else {}
+        for sid in stale:
+            # 視窗內沒有資料的檔 (例如不能融資) 也寫入索引: 與逐檔抓到空表相同，ttl 內不再重抓
+            rows = groups.get(sid)
+            store.merge(dataset, sid, rows.reset_index(drop=True) if rows is not None else None, first_date=start)
+        done[key] = len(stale)
+    return done
@@ -0,0 +1,69 @@
+"""
+K 線圖: 依區間在伺服器端把日 K 聚合為週 K / 月 K (每張圖最多 CHART_MAX_BARS 根)，
+成交量與均線使用 WebGL (Scattergl)，圖表依 (股票, 區間, 日 K 內容指紋) 快取序列化後的 JSON。
+"""
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+from plotly.subplots import make_subplots
+from .config import CHART_RANGES, CHART_MAX_BARS, CHART_MA, CHART_CACHE_ENTRIES
+from .memo import fingerprint
+
+FREQS = [('D', '日K'), ('W-FRI', '週K'), ('ME', '月K')]
+OHLC = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+MA_COLORS = ['#ff7f0e', '#1f77b4', '#9467bd', '#8c564b']
+
+
+# ========================================================
+# 1. 取樣
+# ========================================================
+def window(df, months):
+    """最近 months 個月的日 K (None=全部)"""
+    if months is None or df.empty: return df
+    return df[df.index > df.index[-1] - pd.DateOffset(months=months)]
+
+def resample_ohlc(df, freq):
+    """日 K -> freq K 棒 (開=首日開、高=最高、低=最低、收=末日收、量=加總)；均線欄取每根的最後一天"""
+    if freq == 'D': return df
+    agg = {**{c: OHLC[c] for c in OHLC if c in df}, **{c: 'last' for c in df if c.startswith('MA')}}
+    return df.resample(freq).agg(agg).dropna(subset=['Close'])
+
+def downsample(df, months, max_bars=CHART_MAX_BARS):
+    """區間內的 K 棒: 日 K 超過 max_bars 根改週 K，仍超過改月 K -> (K 棒, 名稱)"""
+    df = df[[c for c in OHLC if c in df]]
+    ma = {f'MA{n}': df['Close'].rolling(n).mean() for n in CHART_MA}  # 先以完整日 K 計算，區間開頭才有值
+    df = window(df.assign(**ma), months)
+    for freq, label in FREQS:
+        bars = resample_ohlc(df, freq)
+        if len(bars) <= max_bars: break
+    return bars, label
+
+
+# ========================================================
+# 2. 圖表 (快取)
+# ========================================================
+def _figure(bars, title):
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.78, 0.22], vertical_spacing=0.02)
+    fig.add_trace(go.Candlestick(x=bars.index, open=bars['Open'], high=bars['High'], low=bars['Low'],
+                                 close=bars['Close'], name='K線'), row=1, col=1)
+    for i, n in enumerate(CHART_MA):
+        fig.add_trace(go.Scattergl(x=bars.index, y=bars[f'MA{n}'], mode='lines', name=f'MA{n}',
+                                   line=dict(width=1, color=MA_COLORS[i % len(MA_COLORS)])), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=bars.index, y=bars['Volume'] / 1000, mode='lines', name='成交量 (張)',
+                               fill='tozeroy', line=dict(width=0.5, shape='hvh', color='#7f7f7f')), row=2, col=1)
+    fig.update_layout(title=title, height=560, margin=dict(l=10, r=10, t=40, b=20), hovermode='x unified',
+                      xaxis_rangeslider_visible=False,  # range slider 會把整組 K 棒再送一次
+                      legend=dict(orientation='h', y=1.02, x=1, xanchor='right', yanchor='bottom'))
+    return fig
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def _figure_json(stock_id, range_key, content, _price_df):
+    # 以日 K 內容指紋為鍵 (不讓 Streamlit 雜湊整個 DataFrame)；還原權值、更正等改寫舊 K 棒時也會重建
+    bars, label = downsample(_price_df, CHART_RANGES[range_key])
+    return _figure(bars, f"{stock_id} · {range_key} {label} ({len(bars)} 根)").to_json()
+
+def price_figure(stock_id, range_key, price_df):
+    """price_df (index=Date 的日 K) 在 range_key 區間的 K 線圖；每次回傳新的 Figure (呼叫端可自由修改)"""
+    content = fingerprint(price_df[[c for c in OHLC if c in price_df]])
+    return pio.from_json(_figure_json(stock_id, range_key, content, price_df))
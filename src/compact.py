@@ -0,0 +1,45 @@
+"""
+st.cache_data 保存的精簡格式 (本地資料庫仍存原始格式):
+財報抓取後即轉為標準欄位寬表、文字欄改為類別、日期為 datetime64、股價降為 float32。
+"""
+import pickle
+import numpy as np
+import pandas as pd
+from .metrics import pivot_statement
+
+PRICE_FLOAT = 'float32'   # K 棒價格精度 (約 7 位有效數字，台股報價足夠)
+
+
+def compact_statement(df):
+    """財報長表 -> 標準欄位寬表 (每檔約 20 季 × 20 欄，取代數千列的長表)"""
+    return pivot_statement(df if df is not None else pd.DataFrame())
+
+def compact_frame(df):
+    """一般長表 (月營收、股利): date 轉 datetime64、文字欄轉類別，數值欄不動"""
+    if df is None or df.empty: return pd.DataFrame() if df is None else df
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if col == 'date': s = pd.to_datetime(s, errors='coerce')
+        elif s.dtype == object: s = s.astype('category')
+        out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+def _integral(s):
+    """全為有限整數值 (Yahoo 停牌 / 剛上市的 K 棒成交量可能是 NaN，不能轉 int64)"""
+    v = s.to_numpy(dtype=float)
+    return bool(np.isfinite(v).all() and (v == np.round(v)).all())
+
+def compact_price(df):
+    """Yahoo 日線: 價格欄轉 float32；成交量全為整數時轉 int64，含 NaN 時維持浮點 (缺值照常保留)"""
+    if df is None or df.empty: return df
+    dtypes = {c: PRICE_FLOAT for c in df.columns if c != 'Volume' and pd.api.types.is_numeric_dtype(df[c])}
+    if 'Volume' in df.columns and pd.api.types.is_numeric_dtype(df['Volume']) and _integral(df['Volume']):
+        dtypes['Volume'] = np.int64
+    return df.astype(dtypes)
+
+def footprint(obj):
+    """(記憶體位元組, pickle 位元組)；obj 為 DataFrame 或其 tuple。st.cache_data 保存的是 pickle"""
+    frames = obj if isinstance(obj, tuple) else (obj,)
+    mem = sum(int(f.memory_usage(index=True, deep=True).sum()) for f in frames if isinstance(f, pd.DataFrame))
+    return mem, len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
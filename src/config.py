@@ -1,14 +1,150 @@
 # src/config.py
+import os
 
 DATASETS = {
     'BALANCE_SHEET': 'TaiwanStockBalanceSheet',
     'INCOME_STATEMENT': 'TaiwanStockFinancialStatements',
-    'CASH_FLOW': 'TaiwanStockCashFlows',
+    'CASH_FLOW': 'TaiwanStockCashFlowsStatement',
     'REVENUE': 'TaiwanStockMonthRevenue',
     'DIVIDEND': 'TaiwanStockDividend',
-    'INSTITUTIONAL': 'TaiwanStockInstitutionalInvestorsBuySell' # [新增] 三大法人
+    'INSTITUTIONAL': 'TaiwanStockInstitutionalInvestorsBuySell', # [新增] 三大法人
+    'MARGIN': 'TaiwanStockMarginPurchaseShortSale'
 }
 
+# 本地增量資料庫 (Parquet + SQLite 索引)
+STORE_DIR = os.environ.get('TWQUANT_STORE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'store'))
+
+# 請求合併 (src/singleflight.py): 同鍵同時只有一個呼叫端向 API 抓取，鍵依雜湊分到幾個鎖檔
+SINGLEFLIGHT_STRIPES = 256
+
+# 各資料集的唯一鍵 (合併增量資料時去重用，未列出者以整列去重)
+STORE_KEYS = {
+    'TaiwanStockBalanceSheet': ['date', 'type'],
+    'TaiwanStockFinancialStatements': ['date', 'type'],
+    'TaiwanStockCashFlowsStatement': ['date', 'type'],
+    'TaiwanStockMonthRevenue': ['date'],
+    'TaiwanStockInstitutionalInvestorsBuySell': ['date', 'stock_id', 'name'],
+    'TaiwanStockMarginPurchaseShortSale': ['date', 'stock_id'],
+    'YahooPrice': ['date'],
+}
+
+# 本地資料多久內視為最新 (秒)，超過才向 API 增量抓取
+STORE_TTL = {
+    'FUNDAMENTALS': 86400,
+    'CHIP': 21600,
+}
+
+# 籌碼 / 融資只保留近 N 天；全市場批次下載 (src/bulk.py) 逐日抓取後分送各檔，
+# 待補的交易日數多於過期檔數時 (例如只更新少數幾檔) 改回逐檔抓取
+CHIP_LOOKBACK_DAYS = 30
+
+# Yahoo 日線 (src/prices.py): 本地只追加新 K 棒，多檔合併成一次下載
+PRICE_HISTORY = '5y'       # 首次下載的期間
+PRICE_TTL = 3600           # 本地日線多久內視為最新 (秒)
+PRICE_INFO_TTL = 86400     # Yahoo 基本資料 (.info) 快取 (秒)
+PRICE_BATCH = 200          # 每次 yf.download 的檔數
+# 評分卡用到的 Yahoo 基本資料欄位 (只快取這些)
+INFO_KEYS = ['marketCap', 'trailingPE', 'currentPrice', 'regularMarketPreviousClose', 'sector', 'averageVolume']
+
+# 網路請求 (共用連線池與並行抓取)
+HTTP_TIMEOUT = 10      # 單次請求超時 (秒)
+HTTP_RETRIES = 3       # 每個請求的重試次數
+FETCH_WORKERS = 16     # 並行抓取的執行緒數 (同時也是連線池大小)
+
+# 上游斷路器 (src/health.py): 連續失敗幾次即斷開，斷開期間立即失敗並改用本地舊資料；
+# 冷卻期滿放行一個試探請求，再失敗則冷卻加倍
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 30          # 首次斷開的冷卻 (秒)
+BREAKER_MAX_COOLDOWN = 600     # 冷卻上限 (秒)
+
+# FinMind 端點 (可用環境變數指向本地替身伺服器，例如 benchmarks/)
+FINMIND_API_URL = os.environ.get('FINMIND_API_URL', 'https://api.finmindtrade.com/api')
+FINMIND_USER_INFO_URL = os.environ.get('FINMIND_USER_INFO_URL', 'https://api.web.finmindtrade.com/v2/user_info')
+
+# FinMind 每小時請求額度 (有 token 時以 user_info 回報的 api_request_limit 為準)
+FINMIND_QUOTA = {
+    'anonymous': 300,    # 未帶 token
+    'registered': 600,   # 免費會員
+}
+QUOTA_BURST = 0.1      # 額度中保留給突發的比例，其餘平均分散在一小時內
+QUOTA_RETRIES = 5      # 遇到 402/429 時的重試次數 (指數退避)
+# 排程器狀態存在 STORE_DIR/scheduler.sqlite，所有程序共用同一份額度
+SCHEDULER_POLL = 0.25  # 等待令牌時重新檢查共用狀態的間隔 (秒)，其他程序取令牌或暫停不會喚醒本程序
+PRIORITY_HOLD = 1.0    # 互動請求等待中時，其他程序的背景請求讓路的時間 (秒)
+
+# 各階段耗時的結構化日誌 (JSON lines)，未設定時只送往 logging 的 twquant.telemetry
+TELEMETRY_LOG = os.environ.get('TWQUANT_TELEMETRY_LOG')
+
+# 籌碼 / 融資滾動視窗 (交易日)；評分卡使用 3 日外資、10 日投信、5 日融資
+FLOW_WINDOWS = (3, 5, 10, 20, 60)
+
+# 背景預熱 (python -m src.worker): 觀察清單與刷新時點 (台北時間)
+# 觀察清單可用環境變數覆寫，例如 TWQUANT_WATCHLIST="2330,2317,2454"
+WATCHLIST = os.environ.get('TWQUANT_WATCHLIST', '2330,2317,2454,2308,2881,2882,2412,1301').replace(',', ' ').split()
+PREWARM_WORKERS = 4
+PREWARM_TIMEZONE = 'Asia/Taipei'
+# 交易日 (週一至週五) 的刷新時點 -> 需強制重抓的資料集: 收盤後法人買賣超約 15:00、融資融券約 21:00 公布
+PREWARM_DAILY = [('15:30', ['INSTITUTIONAL']), ('21:30', ['MARGIN'])]
+# 月營收公告期限 (每月 10 日) 與財報公告期限 (見 STATEMENT_LAG_DAYS) 當晚再刷新一次
+REVENUE_DEADLINE_DAY = 10
+PREWARM_DEADLINE_TIME = '22:00'
+
+# 盤中監控 (python -m src.monitor): 股價與籌碼 / 融資的輪詢間隔 (秒) 與時段 (台北時間，週一至週五)
+# Yahoo 台股報價延遲約 20 分鐘，收盤 13:30 後輪詢到 13:50 以取得最後報價；法人買賣超 / 融資於盤後公布
+MONITOR_PRICE_INTERVAL = 60
+MONITOR_CHIP_INTERVAL = 300
+MONITOR_PRICE_HOURS = ('09:00', '13:50')
+MONITOR_CHIP_HOURS = ('14:30', '22:00')
+MONITOR_IDLE = 60      # 時段外多久檢查一次是否進入時段
+
+# 觀察清單比較頁 (pages/watchlist.py): 程序池大小與整批逾時 (秒)
+COMPARE_WORKERS = min(8, os.cpu_count() or 2)
+COMPARE_TIMEOUT = 300
+
+# K 線圖: 區間 (月數，None=全部) 與每張圖最多的 K 棒數 (超過時依序改用週 K、月 K)
+CHART_RANGES = {'3月': 3, '6月': 6, '1年': 12, '3年': 36, '5年': 60, '10年': 120, '全部': None}
+CHART_DEFAULT_RANGE = '1年'
+CHART_MAX_BARS = 400
+CHART_MA = (20, 60, 120)   # 均線 (交易日，以日 K 計算後再取樣)
+CHART_CACHE_ENTRIES = 64
+
+# 技術指標 (src/technicals.py，交易日): 均線、RSI / ATR 平滑期、量能 z 分數視窗、52 週高點、均量 (約 3 個月，同 Yahoo averageVolume)
+# 最新值只用最後 TECH_LOOKBACK 列計算 (涵蓋 52 週與平滑的暖身期)
+TECH_MA = (20, 60)
+TECH_RSI = 14
+TECH_ATR = 14
+TECH_VOLUME_Z = 20
+TECH_HIGH_DAYS = 252
+TECH_AVG_VOLUME_DAYS = 63
+TECH_LOOKBACK = 320
+
+# 評分卡參數掃描 (src/optimizer.py): 門檻 (strategy.PARAMS 的鍵) 與規則分數 (strategy.RULES 的規則代號) 的候選值
+# 回測沒有籌碼 / 融資歷史，外資賣超等籌碼門檻掃描無效果，不列入
+OPTIMIZER_SPACE = {
+    'f_high': [7, 8, 9], 'f_low': [2, 3, 4], 'z_distress': [1.23, 1.5, 1.81, 2.2],
+    'peg_low': [0.3, 0.5, 0.7], 'peg_mid': [0.8, 1.0, 1.2], 'peg_high': [1.5, 2.0, 3.0],
+    'roc_min': [10, 15, 20, 25], 'ey_min': [3, 5, 8], 'yoy_min': [10, 20, 30],
+    'f_strong': [1, 2, 3], 'z_risk': [-1, -3, -5], 'magic': [1, 2, 3], 'revenue_both': [1, 2, 3],
+}
+OPTIMIZER_SAMPLES = 2000      # 隨機抽樣的組合數 (組合總數不超過時改為完整網格)
+OPTIMIZER_WORKERS = os.cpu_count() or 2
+OPTIMIZER_CHUNK = 50          # 每個程序任務評估的組合數
+OPTIMIZER_MIN_SIGNALS = 30    # 買進訊號少於此數的組合排在最後 (樣本太少，價差不可信)
+
+# 指標記憶化 (src/memo.py): 行程內 LRU 的筆數與總大小上限 (每個指標結果約 0.1-2 KB，歷史序列較大)
+MEMO_MAX_ENTRIES = 20000
+MEMO_MAX_BYTES = 64 * 1024 * 1024
+
+# 去年同期 (YoY) 對齊的寬容度: 一年前 ± N 天內最新的一筆；季報日期不一定落在季底同一天，月營收則固定為次月 1 日
+STATEMENT_YOY_DAYS = 45
+REVENUE_YOY_DAYS = 5
+
+# 財報公告時間差 (回測的時點資料用): 季底月份 -> 季底後幾天才公告
+# Q1/Q2/Q3 約 45 天 (5/15, 8/14, 11/14)，年報 90 天 (3/31)
+STATEMENT_LAG_DAYS = {3: 45, 6: 45, 9: 45, 12: 90}
+# 月營收: FinMind 日期為次月 1 日，每月 10 日前公告
+REVENUE_LAG_DAYS = 9
+
 # 會計科目映射 (支援 FinMind 多種命名可能)
 MAPPING = {
     # --- 資產負債表 ---
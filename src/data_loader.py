@@ -1,112 +1,225 @@
 import pandas as pd
-import yfinance as yf
-from FinMind.data import DataLoader
 import streamlit as st
 from datetime import datetime, timedelta
+import json
 import time
 import requests # 直接用 requests
+from requests.adapters import HTTPAdapter
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .config import DATASETS, FINMIND_API_URL, STORE_TTL, CHIP_LOOKBACK_DAYS, HTTP_TIMEOUT, HTTP_RETRIES, FETCH_WORKERS, QUOTA_RETRIES
+from .store import get_store
+from .flows import normalize_chip, normalize_margin
+from .compact import compact_statement, compact_frame, compact_price
+from .scheduler import get_scheduler, backoff_delay
+from . import telemetry, prices, health
+from .telemetry import span, annotate, incr, frame_size
+
+# --- 0. 共用連線池與執行緒池 ---
+class _GuardedAdapter(HTTPAdapter):
+    """
+    FinMind 請求都經過斷路器: 連線錯誤與 5xx 計為失敗，其餘回應計為成功。
+    斷開期間不連線、直接回 503。
+    """
+    def send(self, request, **kwargs):
+        breaker = health.breaker('finmind')
+        if not breaker.allow():
+            resp = requests.Response()
+            resp.status_code, resp.reason, resp.url, resp.request = 503, 'Circuit Open', request.url, request
+            resp._content = json.dumps({'msg': f"FinMind {breaker.state()}", 'status': 503}).encode()
+            return resp
+        try:
+            resp = super().send(request, **kwargs)
+        except Exception:
+            breaker.failure()
+            raise
+        if resp.status_code >= 500: breaker.failure()
+        else: breaker.success()
+        return resp
+
+def _mount_pool(session):
+    """keep-alive 連線池，讓並行請求重用 TCP/TLS 連線"""
+    adapter = _GuardedAdapter(pool_connections=4, pool_maxsize=FETCH_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+SESSION = _mount_pool(requests.Session())
+
+# 兩層池子避免巢狀等待造成死結: TASK 跑整組 (股價/財報/籌碼)，IO 跑單一資料集
+_TASK_POOL = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch-task')
+_IO_POOL = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch-io')
+
+def _submit(pool, fn, *args):
+    """帶著呼叫端的 context (請求優先順序) 送進執行緒池"""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _retry_after(resp, attempt):
+    """伺服器有給 Retry-After 就照辦，否則指數退避 (基數 5 秒)"""
+    try: return float(resp.headers.get('Retry-After'))
+    except (TypeError, ValueError): return backoff_delay(attempt, base=5)
 
 # --- 1. [核心修正] 繞過 SDK，直接打 API ---
-def fetch_raw_api(dataset, stock_id, start_date, token=None):
+def fetch_raw_api(dataset, stock_id, start_date, token=None, end_date=None, strict=False):
     """
     暴力直連 FinMind 伺服器，不透過套件包裝。
+    stock_id 為空字串時回傳全市場 (搭配 start_date = end_date 逐日抓取，見 src/bulk.py)。
+    上游斷路中 (src/health.py) 不發請求、斷開後不再重試；失敗時與查無資料相同回傳空表，
+    strict=True 則在上游不可用 (連線失敗 / 5xx / 額度用盡) 時拋出 health.Unavailable，讓本地資料庫改用舊資料。
     """
-    url = "https://api.finmindtrade.com/api/v4/data"
+    url = f"{FINMIND_API_URL}/v4/data"
     params = {
         "dataset": dataset,
         "data_id": stock_id,
         "start_date": start_date,
         "token": token if token else ""
     }
+    if end_date: params["end_date"] = end_date
     
-    # 重試機制 (3次)
-    for i in range(3):
+    # 每次請求先向排程器取得額度 (令牌桶 + 優先佇列)
+    sched = get_scheduler(token)
+    breaker = health.breaker('finmind')
+    failures = throttled = 0
+    down = False
+    while failures < HTTP_RETRIES and throttled < QUOTA_RETRIES:
+        if breaker.state() == health.OPEN:
+            down = True; break
+        sched.acquire()
         try:
-            r = requests.get(url, params=params, timeout=10) # 設定超時
+            r = SESSION.get(url, params=params, timeout=HTTP_TIMEOUT) # 設定超時
+            if r.status_code in (402, 429):
+                # 額度用盡: 所有請求一起暫停後再重試，不回傳空表
+                throttled += 1; incr('retries')
+                sched.penalize(_retry_after(r, throttled))
+                continue
+            down = r.status_code >= 500   # 參數錯誤等 4xx 不算上游故障
             if r.status_code == 200:
                 data = r.json()
-                if data.get('msg') == 'success' and data.get('data'):
-                    df = pd.DataFrame(data['data'])
-                    return df
-            time.sleep(1)
+                if data.get('msg') == 'success':
+                    return pd.DataFrame(data.get('data') or [])  # 查無資料不必重試
         except Exception as e:
-            print(f"Raw Fetch Error ({dataset}): {e}")
-            time.sleep(1)
-    
+            telemetry.error(f"fetch_raw_api({dataset})", e)
+            down = True
+        failures += 1; incr('retries')
+        if breaker.state() != health.CLOSED: break   # 已斷開: 不再退避重試
+        time.sleep(backoff_delay(failures))
+
+    if throttled >= QUOTA_RETRIES:
+        telemetry.error(f"fetch_raw_api({dataset})", RuntimeError(f"quota exhausted {sched.quota()}"))
+    if strict and (down or throttled >= QUOTA_RETRIES):
+        raise health.Unavailable(f"FinMind {dataset}: {breaker.state()}")
     return pd.DataFrame()
 
 # --- 2. 股價 (Yahoo) ---
 @st.cache_data(ttl=3600)
 def fetch_price_from_yahoo(ticker):
-    yf_ticker = ticker.strip()
-    if not yf_ticker.endswith(('.TW', '.TWO')): 
-        yf_ticker += ".TW"
+    """本地日線 + 增量 K 棒 (多檔批次更新見 prices.refresh)"""
+    annotate(cache='miss')  # 有執行到函式本體 = 快取未命中
     try:
-        stock = yf.Ticker(yf_ticker)
-        df = stock.history(period="5y")
-        info = stock.info
-        return df, info
-    except:
+        df, info = prices.load(ticker)
+        return compact_price(df), info
+    except Exception as e:
+        telemetry.error(f"yahoo({ticker})", e)
         return pd.DataFrame(), {}
 
-# --- 3. 基本面 (財報/營收) - 維持 SDK (因為這部分沒壞) ---
+# --- 3. 基本面 (財報/營收) - 改用直連 ---
+# SDK 的財報方法只是固定 dataset 的 /v4/data 包裝；改走直連才能經過共用連線池、斷路器與 FINMIND_API_URL
 @st.cache_data(ttl=86400)
 def fetch_fundamentals_data(stock_id, api_token_str):
-    fm = DataLoader()
-    if api_token_str and str(api_token_str).strip():
-        try: fm.login_by_token(api_token=str(api_token_str).strip())
-        except: pass
-
     clean_id = stock_id.replace('.TW', '').replace('.TWO', '').strip()
     start_date = (datetime.now() - timedelta(days=365*5)).strftime('%Y-%m-%d')
-    
-    def get_df(func):
-        try:
-            df = func(stock_id=clean_id, start_date=start_date)
-            return df if isinstance(df, pd.DataFrame) and not df.empty else pd.DataFrame()
-        except: return pd.DataFrame()
+    store = get_store()
+
+    annotate(cache='miss')
+    def get_df(key):
+        def fetch(since):
+            annotate(cache='api')  # 本地資料庫過期或未涵蓋，向 API 抓取
+            # 上游不可用時拋出 Unavailable，本地資料庫改用舊資料
+            return fetch_raw_api(DATASETS[key], clean_id, since, api_token_str, strict=True)
+        # 本地資料庫只抓最後日期之後的增量
+        with span('finmind', DATASETS[key], cache='store') as s:
+            df = store.sync(DATASETS[key], clean_id, start_date, fetch, ttl=STORE_TTL['FUNDAMENTALS'])
+            s['rows'], s['bytes'] = frame_size(df)
+            return df
 
-    bs = get_df(fm.taiwan_stock_balance_sheet)
-    inc = get_df(fm.taiwan_stock_financial_statement)
-    if inc.empty: inc = get_df(fm.taiwan_stock_financial_statements)
-    cf = get_df(fm.taiwan_stock_cash_flows_statement)
-    rev = get_df(fm.taiwan_stock_month_revenue)
-    div = get_df(fm.taiwan_stock_dividend)
+    # 五個資料集並行抓取
+    keys = ['BALANCE_SHEET', 'INCOME_STATEMENT', 'CASH_FLOW', 'REVENUE', 'DIVIDEND']
+    futures = [_submit(_IO_POOL, get_df, k) for k in keys]
+    bs, inc, cf, rev, div = [f.result() for f in futures]
 
-    return bs, inc, cf, rev, div
+    # 快取只保留精簡格式: 財報轉好的寬表、月營收 / 股利的類別與日期欄
+    return compact_statement(bs), compact_statement(inc), compact_statement(cf), compact_frame(rev), compact_frame(div)
 
 # --- 4. 籌碼面 (三大法人/融資) - 改用直連 ---
 @st.cache_data(ttl=21600) 
 def fetch_chip_data(stock_id, api_token_str):
     clean_id = stock_id.replace('.TW', '').replace('.TWO', '').strip()
     
-    # 只抓 30 天，確保輕量
-    start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    
-    # A. 抓籌碼 (直連)
-    chip = fetch_raw_api(
-        dataset="TaiwanStockInstitutionalInvestorsBuySell",
-        stock_id=clean_id,
-        start_date=start_date,
-        token=api_token_str
-    )
-    
-    # B. 抓融資 (直連)
-    margin = fetch_raw_api(
-        dataset="TaiwanStockMarginPurchaseShortSale",
-        stock_id=clean_id,
-        start_date=start_date,
-        token=api_token_str
-    )
+    # 只抓 CHIP_LOOKBACK_DAYS 天，確保輕量 (全市場批次更新過的檔在 ttl 內直接讀本地)
+    start_date = (datetime.now() - timedelta(days=CHIP_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    store = get_store()
+
+    annotate(cache='miss')
+    def get_df(key):
+        def fetch(since):
+            annotate(cache='api')
+            return fetch_raw_api(dataset=DATASETS[key], stock_id=clean_id, start_date=since, token=api_token_str, strict=True)
+        with span('finmind', DATASETS[key], cache='store') as s:
+            df = store.sync(DATASETS[key], clean_id, start_date, fetch, ttl=STORE_TTL['CHIP'])
+            s['rows'], s['bytes'] = frame_size(df)
+            return df
+
+    # A. 抓籌碼 (直連) / B. 抓融資 (直連) - 並行
+    f_chip = _submit(_IO_POOL, get_df, 'INSTITUTIONAL')
+    f_margin = _submit(_IO_POOL, get_df, 'MARGIN')
+    chip, margin = f_chip.result(), f_margin.result()
 
-    return chip, margin
+    # 本地資料庫保留原始格式；回傳前正規化一次 (int64、法人類別)，結果隨快取重用
+    return normalize_chip(chip), normalize_margin(margin)
+
+# --- 5. 股票清單 (全市場) ---
+@st.cache_data(ttl=86400)
+def fetch_stock_universe(api_token_str=None):
+    """上市 (twse) + 上櫃 (tpex) 普通股清單，供全市場篩選使用"""
+    info = fetch_raw_api(dataset="TaiwanStockInfo", stock_id="", start_date="", token=api_token_str)
+    if info.empty: return pd.DataFrame(columns=['stock_id', 'stock_name', 'industry_category', 'type'])
+
+    info = info[info['type'].isin(['twse', 'tpex'])]
+    # 只保留 4 碼普通股 (排除 ETF、權證、特別股)
+    info = info[info['stock_id'].astype(str).str.fullmatch(r'[1-9]\d{3}')]
+    cols = [c for c in ['stock_id', 'stock_name', 'industry_category', 'type'] if c in info.columns]
+    return info[cols].drop_duplicates('stock_id').reset_index(drop=True)
+
+# --- 6. 量測包裝 ---
+def _traced(stage, name, fn, *args):
+    """
+    呼叫 st.cache_data 函式並記錄階段；預設為快取命中，函式本體執行時會自行標記 miss。
+    過程中有改用舊資料 (上游斷路中) 的結果不留在快取，恢復後下次呼叫即重新同步。
+    """
+    with span(stage, name, cache='hit') as s, telemetry.watch() as events:
+        result = fn(*args)
+        if events.get('stale'): fn.clear(*args)
+        sizes = [frame_size(df) for df in (result if isinstance(result, tuple) else (result,)) if isinstance(df, pd.DataFrame)]
+        s['rows'] = sum(r for r, _ in sizes); s['bytes'] = sum(b for _, b in sizes)
+        return result
 
 # --- DataEngine 類別 ---
 class DataEngine:
     def __init__(self, token=None):
         self.token = token
-    def get_price_data(self, ticker): return fetch_price_from_yahoo(ticker)
+    def get_price_data(self, ticker): return _traced('yahoo', 'price', fetch_price_from_yahoo, ticker)
     def get_financial_data(self, stock_id):
-        bs, inc, cf, rev, div = fetch_fundamentals_data(stock_id, self.token)
-        chip, margin = fetch_chip_data(stock_id, self.token)
+        f_fund = _submit(_TASK_POOL, _traced, 'finmind', 'fundamentals', fetch_fundamentals_data, stock_id, self.token)
+        f_chip = _submit(_TASK_POOL, _traced, 'finmind', 'chip', fetch_chip_data, stock_id, self.token)
+        bs, inc, cf, rev, div = f_fund.result()
+        chip, margin = f_chip.result()
         return bs, inc, cf, rev, div, chip, margin
+    def get_all_data(self, stock_id):
+        """股價、財報、籌碼同時抓取，總耗時約等於最慢的單一請求"""
+        f_price = _submit(_TASK_POOL, self.get_price_data, stock_id)
+        financial = self.get_financial_data(stock_id)
+        return f_price.result(), financial
+    def get_stock_universe(self): return fetch_stock_universe(self.token)
+    def get_quota(self):
+        """FinMind 近一小時額度使用狀況 (本地估計)"""
+        return get_scheduler(self.token).quota()
@@ -0,0 +1,159 @@
+import re
+import numpy as np
+import pandas as pd
+from .config import FLOW_WINDOWS
+
+# 法人類別 (依序比對，先符合者優先: Foreign_Dealer_Self 歸外資)
+INVESTOR = pd.CategoricalDtype(['foreign', 'trust', 'dealer', 'other'])
+INVESTOR_PATTERNS = [('foreign', 'Foreign|外資'), ('trust', 'Trust|投信'), ('dealer', 'Dealer|自營')]
+MARGIN_BALANCE_COLS = ['MarginPurchaseBalance', 'MarginBalance', 'MarginPurchaseTodayBalance']
+
+
+# ========================================================
+# 1. 正規化 (抓取後做一次；已正規化的資料原樣回傳)
+# ========================================================
+def _int(s):
+    """'1,234' / 1234.0 / None -> int64 陣列"""
+    if not pd.api.types.is_numeric_dtype(s):
+        s = pd.to_numeric(s.astype(str).str.replace(',', ''), errors='coerce')
+    return s.fillna(0).round().to_numpy(dtype='int64')
+
+def investor_codes(names):
+    """法人名稱 -> INVESTOR 類別代碼；只對不重複的名稱做一次正規表示式比對"""
+    codes, uniques = pd.factorize(names.astype(str))
+    kinds = list(INVESTOR.categories)
+    label = [next((kinds.index(k) for k, p in INVESTOR_PATTERNS if re.search(p, u, re.IGNORECASE)), kinds.index('other'))
+             for u in uniques]
+    return np.asarray(label, dtype='int8')[codes]
+
+def empty_chip():
+    return pd.DataFrame({'stock_id': pd.Series(dtype=str), 'date': pd.Series(dtype='datetime64[ns]'),
+                         'investor': pd.Series(dtype=INVESTOR), 'buy': pd.Series(dtype='int64'),
+                         'sell': pd.Series(dtype='int64'), 'net': pd.Series(dtype='int64')})
+
+def empty_margin():
+    return pd.DataFrame({'stock_id': pd.Series(dtype=str), 'date': pd.Series(dtype='datetime64[ns]'),
+                         'margin_balance': pd.Series(dtype='int64'), 'short_balance': pd.Series(dtype='int64')})
+
+def normalize_chip(chip):
+    """
+    三大法人長表 -> (stock_id, date, investor, buy, sell, net)，數值為 int64 (股)。
+    同日同類別合併 (外資 = Foreign_Investor + Foreign_Dealer_Self)，依 stock_id、date 排序。
+    """
+    if chip is None: return empty_chip()
+    if 'investor' in chip.columns: return chip
+    if chip.empty or 'name' not in chip.columns: return empty_chip()
+    sid = chip['stock_id'].astype(str) if 'stock_id' in chip.columns else pd.Series('', index=chip.index)
+    sid_codes, sid_uniques = pd.factorize(sid, sort=True)
+    date = pd.to_datetime(chip['date']).to_numpy()
+    inv = investor_codes(chip['name'])
+    buy = _int(chip['buy']) if 'buy' in chip.columns else np.zeros(len(chip), dtype='int64')
+    sell = _int(chip['sell']) if 'sell' in chip.columns else np.zeros(len(chip), dtype='int64')
+
+    # 依 (stock_id, date, investor) 排序後以 reduceat 合併同鍵列
+    order = np.lexsort((inv, date, sid_codes))
+    k_sid, k_date, k_inv = sid_codes[order], date[order], inv[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (k_sid[1:] != k_sid[:-1]) | (k_date[1:] != k_date[:-1]) | (k_inv[1:] != k_inv[:-1])
+    at = np.flatnonzero(first)
+    buy = np.add.reduceat(buy[order], at); sell = np.add.reduceat(sell[order], at)
+    return pd.DataFrame({
+        'stock_id': np.asarray(sid_uniques, dtype=object)[k_sid[at]],
+        'date': k_date[at],
+        'investor': pd.Categorical.from_codes(k_inv[at], dtype=INVESTOR),
+        'buy': buy, 'sell': sell, 'net': buy - sell,
+    })
+
+def normalize_margin(margin):
+    """融資融券 -> (stock_id, date, margin_balance, short_balance)，int64 (張)，依 stock_id、date 排序"""
+    if margin is None: return empty_margin()
+    if 'margin_balance' in margin.columns: return margin
+    col = next((c for c in margin.columns if any(x in c for x in MARGIN_BALANCE_COLS)), None)
+    if margin.empty or col is None: return empty_margin()
+    sid = margin['stock_id'].astype(str) if 'stock_id' in margin.columns else pd.Series('', index=margin.index)
+    sid_codes, sid_uniques = pd.factorize(sid, sort=True)
+    date = pd.to_datetime(margin['date']).to_numpy()
+    bal = _int(margin[col])
+    short = _int(margin['ShortSaleTodayBalance']) if 'ShortSaleTodayBalance' in margin.columns else np.zeros(len(margin), dtype='int64')
+
+    # 穩定排序後同鍵保留最後一筆
+    order = np.lexsort((date, sid_codes))
+    k_sid, k_date = sid_codes[order], date[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (k_sid[1:] != k_sid[:-1]) | (k_date[1:] != k_date[:-1])
+    take = order[last]
+    return pd.DataFrame({
+        'stock_id': np.asarray(sid_uniques, dtype=object)[k_sid[last]],
+        'date': k_date[last],
+        'margin_balance': bal[take], 'short_balance': short[take],
+    })
+
+
+# ========================================================
+# 2. 多視窗滾動指標 (單檔或全市場皆可，一次向量化計算)
+# ========================================================
+def _segments(stock_ids):
+    """已排序的 stock_id 陣列 -> (列位置, 該股第一列的位置, 是否為該股最後一列)"""
+    sid = np.asarray(stock_ids)
+    n = len(sid)
+    idx = np.arange(n)
+    head = np.ones(n, dtype=bool); head[1:] = sid[1:] != sid[:-1]
+    start = np.maximum.accumulate(np.where(head, idx, 0))
+    tail = np.ones(n, dtype=bool); tail[:-1] = head[1:]
+    return idx, start, tail
+
+def chip_flows(chip, windows=FLOW_WINDOWS):
+    """
+    每檔每日的法人買賣超滾動加總與連續買超天數，索引為 (stock_id, date)。
+    欄位: {類別}_net_{w}d (近 w 個交易日加總，不足 w 日時為全部加總)、{類別}_streak。
+    類別為同日合併後的淨額 (外資 = Foreign_Investor + Foreign_Dealer_Self)，因此 foreign_net_3d 是
+    「近 3 個交易日的外資合計」。舊版取最後 3 筆外資明細列 (每日兩列時只涵蓋約 1.5 日，連買也是逐列判斷)，
+    數值與 Foreign Net (3d) / Foreign Consecutive 的舊快照不同。
+    """
+    chip = normalize_chip(chip)
+    kinds = list(INVESTOR.categories)
+    if chip.empty: return pd.DataFrame(columns=[f"{k}_net_{w}d" for w in windows for k in kinds] + [f"{k}_streak" for k in kinds])
+
+    # 已依 (stock_id, date, investor) 排序且不重複: 每個 (stock_id, date) 一列，法人類別為欄
+    sid = chip['stock_id'].to_numpy(); date = chip['date'].to_numpy()
+    new_day = np.ones(len(chip), dtype=bool)
+    new_day[1:] = (sid[1:] != sid[:-1]) | (date[1:] != date[:-1])
+    row = np.cumsum(new_day) - 1
+    net = np.zeros((row[-1] + 1, len(kinds)), dtype='int64')
+    net[row, chip['investor'].cat.codes.to_numpy()] = chip['net'].to_numpy()
+    sid, date = sid[new_day], date[new_day]
+    idx, start, _ = _segments(sid)
+
+    cs = np.vstack([np.zeros((1, len(kinds)), dtype='int64'), np.cumsum(net, axis=0)])
+    out = {}
+    for w in windows:
+        roll = cs[idx + 1] - cs[np.maximum(idx + 1 - w, start)]
+        for j, k in enumerate(kinds): out[f"{k}_net_{w}d"] = roll[:, j]
+    # 連續買超: 與最近一個非買超日 (或該股第一列之前) 的距離
+    last_stop = np.maximum.accumulate(np.where(net > 0, -1, idx[:, None]), axis=0)
+    streak = idx[:, None] - np.maximum(last_stop, (start - 1)[:, None])
+    for j, k in enumerate(kinds): out[f"{k}_streak"] = streak[:, j]
+    return pd.DataFrame(out, index=pd.MultiIndex.from_arrays([sid, date], names=['stock_id', 'date']))
+
+def margin_flows(margin, windows=FLOW_WINDOWS):
+    """
+    每檔每日的融資餘額與近 w 個交易日的變化，索引為 (stock_id, date)。
+    欄位: margin_balance、short_balance、margin_chg_{w}d (不足 w 日時與第一筆比較)、days (累計筆數)。
+    """
+    margin = normalize_margin(margin)
+    if margin.empty: return pd.DataFrame(columns=['margin_balance', 'short_balance'] + [f"margin_chg_{w}d" for w in windows] + ['days'])
+
+    bal = margin['margin_balance'].to_numpy()
+    idx, start, _ = _segments(margin['stock_id'].to_numpy())
+    out = {'margin_balance': bal, 'short_balance': margin['short_balance'].to_numpy()}
+    for w in windows:
+        out[f"margin_chg_{w}d"] = bal - bal[np.maximum(idx - w, start)]
+    out['days'] = idx - start + 1
+    return pd.DataFrame(out, index=pd.MultiIndex.from_arrays([margin['stock_id'].to_numpy(), margin['date'].to_numpy()],
+                                                             names=['stock_id', 'date']))
+
+def latest(flows):
+    """每檔最後一個交易日的指標 (index=stock_id)"""
+    if flows.empty: return flows.iloc[:0]
+    _, _, tail = _segments(flows.index.get_level_values('stock_id'))
+    return flows[tail].droplevel('date')
@@ -0,0 +1,89 @@
+"""
+上游健康度與斷路器 (circuit breaker)，每個上游一個 (finmind / yahoo):
+- 關閉: 正常放行；連續失敗 BREAKER_FAILURES 次即斷開。
+- 斷開: 冷卻期內的請求立即失敗 (不再等超時與退避)，呼叫端改用本地資料庫的舊資料。
+- 半開: 冷卻期滿放行一個試探請求，成功即恢復，失敗則再次斷開 (冷卻加倍，上限 BREAKER_MAX_COOLDOWN)。
+狀態只在程序內共用 (UI 與背景預熱各自判斷)。
+"""
+import json
+import time
+import threading
+from .config import BREAKER_FAILURES, BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN
+from .telemetry import logger, flag
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class Unavailable(Exception):
+    """上游斷路中或連線失敗用盡重試 (與「查無資料」區分，呼叫端可改用舊資料)"""
+
+
+class Breaker:
+    def __init__(self, name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.name = name
+        self.threshold = failures
+        self.base = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0       # 連續失敗次數
+        self.trips = 0          # 連續斷開次數 (決定冷卻長度)
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _cooldown(self):
+        return min(self.max_cooldown, self.base * 2 ** max(0, self.trips - 1))
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None: return CLOSED
+            return OPEN if time.monotonic() - self.opened_at < self._cooldown() else HALF_OPEN
+
+    def allow(self):
+        """可否發出請求；半開時只放行一個試探請求 (試探期間重新計時，試探沒有回報時冷卻期滿再放行下一個)"""
+        with self._lock:
+            if self.opened_at is None: return True
+            if time.monotonic() - self.opened_at < self._cooldown(): return False
+            self.opened_at = time.monotonic()
+            self.probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = self.trips = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            # 試探失敗或連續失敗達門檻: (再次) 斷開
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                self.trips += 1
+                self.opened_at = time.monotonic()
+                logger.warning(json.dumps({'event': 'breaker_open', 'upstream': self.name, 'failures': self.failures,
+                                           'cooldown': self._cooldown()}, ensure_ascii=False))
+            self.probing = False
+
+    def snapshot(self):
+        state = self.state()
+        with self._lock:
+            retry_in = max(0.0, self.opened_at + self._cooldown() - time.monotonic()) if state == OPEN else 0.0
+            return {'state': state, 'failures': self.failures, 'trips': self.trips, 'retry_in': retry_in}
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+def breaker(name):
+    """上游名稱 -> 共用的斷路器"""
+    with _lock:
+        if name not in _breakers: _breakers[name] = Breaker(name)
+        return _breakers[name]
+
+def served_stale():
+    """呼叫端改用舊資料時記一次 (store.sync / prices)，只計入進行中的 telemetry.watch() 區塊 (本次呼叫)"""
+    flag('stale')
+
+def status():
+    """各上游狀態 {名稱: {state, failures, trips, retry_in 秒}}，供除錯顯示"""
+    return {name: b.snapshot() for name, b in sorted(_breakers.items())}
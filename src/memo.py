@@ -0,0 +1,125 @@
+"""
+指標結果的記憶化 (行程內): 以輸入資料的指紋 (筆數、最後日期、內容雜湊) 與程式版本為鍵，
+每個指標分開快取，LRU 依筆數與總位元組淘汰。Streamlit 重跑、切換元件或重複查詢同一檔時直接取用。
+"""
+import os
+import pickle
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+import pandas as pd
+from .config import MEMO_MAX_ENTRIES, MEMO_MAX_BYTES
+from .telemetry import annotate, watch
+
+# 影響指標結果的原始碼: 內容變動 (改版) 後舊結果自動失效
+CODE_FILES = ['metrics.py', 'flows.py', 'config.py']
+
+def code_version(files=CODE_FILES):
+    """src/ 下 files 的內容雜湊"""
+    h = hashlib.sha1()
+    for name in files:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f: h.update(f.read())
+    return h.hexdigest()[:12]
+
+CODE_VERSION = code_version()
+
+
+# ========================================================
+# 1. 指紋
+# ========================================================
+def fingerprint(obj):
+    """DataFrame -> (筆數, 最後日期, 內容雜湊)；dict / 其他值 -> 內容雜湊"""
+    if obj is None: return None
+    if isinstance(obj, pd.DataFrame):
+        if obj.empty: return (0, None, tuple(map(str, obj.columns)))
+        last = obj['date'].max() if 'date' in obj.columns else obj.index.max()
+        # pickle 含欄名、型別與索引，且對小表比 hash_pandas_object 快約 10 倍 (後者每欄有固定成本)；
+        # 內容相同但區塊配置不同時只會多算一次，不會誤中
+        return (len(obj), str(last), hashlib.sha1(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest())
+    if isinstance(obj, dict): obj = sorted(obj.items(), key=lambda kv: str(kv[0]))
+    return hashlib.sha1(repr(obj).encode()).hexdigest()
+
+
+# ========================================================
+# 2. LRU (筆數 + 位元組上限)
+# ========================================================
+class LRUCache:
+    """執行緒安全的 LRU；值以 pickle 保存 (大小即位元組數，取出時為副本，呼叫端修改不影響快取)"""
+    def __init__(self, max_entries=MEMO_MAX_ENTRIES, max_bytes=MEMO_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        """-> (是否命中, 值)"""
+        with self._lock:
+            blob = self._data.get(key)
+            if blob is None:
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return True, pickle.loads(blob)
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes: return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self._bytes -= len(old)
+            self._data[key] = blob
+            self._bytes += len(blob)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+_cache = LRUCache()
+
+def stats():
+    return _cache.stats()
+
+def clear():
+    _cache.clear()
+
+
+# ========================================================
+# 3. 方法裝飾器
+# ========================================================
+def memoized(*inputs, info=()):
+    """
+    記憶化 MetricCalculator 的方法: inputs 為方法讀取的輸入資料名稱 (self.input_fingerprint)，
+    info 為讀取的 Yahoo 基本資料欄位 (只比對這些欄位，其他欄位如現價變動不影響)；方法參數一併計入鍵。
+    方法執行中有 telemetry.error (改用預設值) 時結果不快取。
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            key = (CODE_VERSION, fn.__qualname__, tuple(self.input_fingerprint(name) for name in inputs),
+                   fingerprint({k: self.info.get(k) for k in info}) if info else None, tuple(map(fingerprint, args)),
+                   tuple(sorted((k, fingerprint(v)) for k, v in kwargs.items())))
+            hit, value = _cache.get(key)
+            if hit:
+                annotate(cache='hit')
+                return value
+            with watch() as events:
+                value = fn(self, *args, **kwargs)
+            annotate(cache='miss')  # 在方法之後標記: 方法內呼叫的其他記憶化方法不會蓋掉
+            # 計算途中吞下例外 (結果含預設值) 時不快取，下次重算
+            if not events.get('error'): _cache.put(key, value)
+            return value
+        return wrapper
+    return decorator
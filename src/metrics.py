@@ -1,116 +1,201 @@
 import pandas as pd
 import numpy as np
-from .config import MAPPING, EXCLUDED_SECTORS
+from functools import cached_property
+from .config import MAPPING, EXCLUDED_SECTORS, STATEMENT_YOY_DAYS, REVENUE_YOY_DAYS
+from . import telemetry
+from .memo import memoized, fingerprint
+from .flows import normalize_chip, normalize_margin, chip_flows, margin_flows, latest
+
+def to_canonical(wide):
+    """
+    將寬表 (columns=FinMind 原始科目) 的同義詞欄位一次合併為 MAPPING 標準欄位。
+    每個標準欄位取第一個非空的同義詞 (與逐筆查找的優先順序相同)，全部存成 float64。
+    """
+    cols = {}
+    for key, names in MAPPING.items():
+        out = np.full(len(wide), np.nan)
+        for name in reversed([c for c in names if c in wide.columns]):
+            vals = wide[name].to_numpy(dtype=float)
+            out = np.where(np.isnan(vals), out, vals)
+        cols[key] = out
+    return pd.DataFrame(cols, index=wide.index)
+
+def pivot_statement(df):
+    """財報長表 (date/type/value) -> 標準欄位寬表 (ASSETS, NET_INCOME, EBIT...)，日期由新到舊；已是寬表則原樣回傳"""
+    if 'type' not in df.columns and set(MAPPING) <= set(df.columns): return df
+    if df.empty: return pd.DataFrame(columns=list(MAPPING), dtype=float)
+    try:
+        pivoted = df.pivot_table(index='date', columns='type', values='value')
+        pivoted.index = pd.to_datetime(pivoted.index)
+        return to_canonical(pivoted).sort_index(ascending=False)
+    except Exception as e:
+        telemetry.error('metrics.pivot_statement', e)
+        return pd.DataFrame(columns=list(MAPPING), dtype=float)
+
+def asof_positions(index, targets, days):
+    """
+    在 index (日期由新到舊) 中，為每個 target 找出 target ± days 範圍內最新日期的位置。
+    找不到時為 -1。以排序後的 searchsorted 一次完成，取代逐筆的布林遮罩。
+    """
+    if len(index) == 0: return np.full(len(targets), -1)
+    asc = index[::-1].values
+    t = pd.DatetimeIndex(targets).values
+    tol = np.timedelta64(days, 'D')
+    pos = np.searchsorted(asc, t + tol, side='right') - 1
+    ok = (pos >= 0) & (asc[np.clip(pos, 0, None)] >= t - tol)
+    return np.where(ok, len(asc) - 1 - pos, -1)
+
+def prior_year_positions(index, days):
+    """index (日期由新到舊) 每一列的去年同期列位置: 一年前 ± days 天內最新的一列，找不到為 -1"""
+    return asof_positions(index, index - pd.DateOffset(years=1), days)
+
+def take_rows(df, pos, index):
+    """依位置取列 (位置 -1 為 NaN)，並改用 index 作為列索引"""
+    out = pd.DataFrame(df.to_numpy(dtype=float)[np.clip(pos, 0, None)] if len(df) else np.full((len(pos), df.shape[1]), np.nan),
+                       index=index, columns=df.columns)
+    out[np.asarray(pos) < 0] = np.nan
+    return out
+
+F_COMPONENTS = ['F_ROA', 'F_CFO', 'F_ACCRUAL', 'F_ROA_YOY', 'F_LEVERAGE', 'F_LIQUIDITY', 'F_NO_DILUTION', 'F_MARGIN', 'F_TURNOVER']
+Z_COMPONENTS = ['X1', 'X2', 'X3', 'X4', 'X5']
+
+def f_score_components(inc, bs, cf, p_inc, p_bs):
+    """
+    F-Score 九項檢定的欄位運算版本 (與 calculate_f_score 規則相同)。
+    輸入為同索引、缺值已補 0 的標準欄位表；去年同期為 0 視同缺值。
+    """
+    ni = inc['NET_INCOME']; assets = bs['ASSETS']; cfo = cf['OPERATING_CASH_FLOW']
+    p_ni = p_inc['NET_INCOME']; p_assets = p_bs['ASSETS']
+    comp = pd.DataFrame(index=inc.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        comp['F_ROA'] = (assets > 0) & (ni / assets > 0)
+        comp['F_CFO'] = cfo > 0
+        comp['F_ACCRUAL'] = cfo > ni
+        comp['F_ROA_YOY'] = (p_ni != 0) & (p_assets != 0) & ((ni / assets) > (p_ni / p_assets))
+
+        lev = bs['LIABILITIES'] - bs['CURRENT_LIABILITIES']
+        p_lev = p_bs['LIABILITIES'] - p_bs['CURRENT_LIABILITIES']
+        comp['F_LEVERAGE'] = (p_bs['LIABILITIES'] != 0) & (assets > 0) & (p_assets > 0) & ((lev / assets) <= (p_lev / p_assets))
+
+        cur = bs['CURRENT_ASSETS']; cur_l = bs['CURRENT_LIABILITIES']
+        p_cur = p_bs['CURRENT_ASSETS']; p_cur_l = p_bs['CURRENT_LIABILITIES']
+        comp['F_LIQUIDITY'] = (cur_l > 0) & (p_cur_l != 0) & ((cur / cur_l) > (p_cur / p_cur_l))
+
+        stk = bs['COMMON_STOCK']; p_stk = p_bs['COMMON_STOCK']
+        comp['F_NO_DILUTION'] = (p_stk == 0) | (stk <= p_stk * 1.05)
+
+        rev = inc['REVENUE']; cost = inc['OPERATING_COSTS']; p_rev = p_inc['REVENUE']; p_cost = p_inc['OPERATING_COSTS']
+        comp['F_MARGIN'] = (rev > 0) & (cost > 0) & (p_rev != 0) & (p_cost != 0) & (((rev - cost) / rev) > ((p_rev - p_cost) / p_rev))
+        comp['F_TURNOVER'] = (assets > 0) & (p_assets != 0) & ((rev / assets) > (p_rev / p_assets))
+    return comp
+
+def z_score_components(bs, inc, mcap):
+    """Z-Score 五項比率的欄位運算版本 (資產或負債為 0 的列為 NaN)"""
+    ta = bs['ASSETS'].where(bs['ASSETS'] != 0); tl = bs['LIABILITIES'].where(bs['LIABILITIES'] != 0)
+    ebit = inc['EBIT'].where(inc['EBIT'] != 0, inc['PRE_TAX_INCOME'] + inc['INTEREST_EXPENSE'])
+    comp = pd.DataFrame({
+        'X1': (bs['CURRENT_ASSETS'] - bs['CURRENT_LIABILITIES']) / ta,
+        'X2': bs['RETAINED_EARNINGS'] / ta,
+        'X3': ebit / ta,
+        'X4': mcap / tl,
+        'X5': inc['REVENUE'] / ta,
+    }, index=bs.index)
+    comp['Z-Score'] = 1.2*comp['X1'] + 1.4*comp['X2'] + 3.3*comp['X3'] + 0.6*comp['X4'] + 1.0*comp['X5']
+    comp.loc[ta.isna() | tl.isna()] = np.nan
+    return comp
 
 class MetricCalculator:
     def __init__(self, bs_df, inc_df, cf_df, rev_df, div_df, chip_df, margin_df, info):
-        self.bs = self._pivot_data(bs_df)
-        self.inc = self._pivot_data(inc_df)
-        self.cf = self._pivot_data(cf_df)
+        # 財報寬表在第一次用到時才轉置 (增量重算只動到需要的報表)
+        # 籌碼 / 融資同樣延後正規化 (已於抓取時正規化則原樣使用)；記憶化命中時完全不需轉換
+        self._raw = {'bs': bs_df, 'inc': inc_df, 'cf': cf_df, 'rev': rev_df, 'div': div_df, 'chip': chip_df, 'margin': margin_df}
+        self._prior = {}  # 報表名稱 -> 每一列的去年同期列位置 (prior_year_positions)，第一次用到時建立
+        self._fingerprints = {}
         self.rev = rev_df 
         self.div = div_df
-        self.chip = chip_df
-        self.margin = margin_df
         self.info = info
-        
+
+    def input_fingerprint(self, name):
+        """原始輸入 (未轉置) 的指紋，每個計算器只算一次 (供 memo.memoized 組成快取鍵)"""
+        if name not in self._fingerprints: self._fingerprints[name] = fingerprint(self._raw[name])
+        return self._fingerprints[name]
+
+    @cached_property
+    def chip(self): return normalize_chip(self._raw['chip'])
+    @cached_property
+    def margin(self): return normalize_margin(self._raw['margin'])
+
+    @cached_property
+    def bs(self): return self._pivot_data(self._raw['bs'])
+    @cached_property
+    def inc(self): return self._pivot_data(self._raw['inc'])
+    @cached_property
+    def cf(self): return self._pivot_data(self._raw['cf'])
+
     def _pivot_data(self, df):
-        if df.empty: return pd.DataFrame()
-        try:
-            pivoted = df.pivot_table(index='date', columns='type', values='value')
-            pivoted.index = pd.to_datetime(pivoted.index)
-            return pivoted.sort_index(ascending=False)
-        except: return pd.DataFrame()
-
-    def _get_value_smart(self, df, date, key):
-        """智慧查找：根據 Config 中的同義詞列表尋找欄位"""
-        possible_names = MAPPING.get(key, [])
-        if not possible_names: possible_names = [key]
-        for name in possible_names:
-            if name in df.columns:
-                val = df.loc[date, name]
-                if pd.notna(val): return val
-        return 0
-
-    def _get_prev_value(self, df, curr_date, key):
-        """取得去年同期數據 (YoY)"""
-        try:
-            target_date = curr_date - pd.DateOffset(years=1)
-            # 寬容度搜尋 (前後 45 天)
-            mask = (df.index >= target_date - pd.Timedelta(days=45)) & \
-                   (df.index <= target_date + pd.Timedelta(days=45))
-            if any(mask):
-                valid_date = df[mask].index[0]
-                return self._get_value_smart(df, valid_date, key)
-            return None
-        except: return None
+        """長表 -> 標準欄位寬表 (抓取時已轉好的寬表原樣使用)"""
+        return pivot_statement(df)
+
+    def _row(self, df, date):
+        """取出某日期的所有標準欄位 (缺值為 0)；報表為空時全部為 0，日期不存在時拋出 KeyError"""
+        if df.empty: return pd.Series(0.0, index=df.columns)
+        return df.loc[date].fillna(0)
+
+    def _prior_of(self, name):
+        """name 報表每一列的去年同期列位置 (第一次用到時以 prior_year_positions 建立)"""
+        if name not in self._prior: self._prior[name] = prior_year_positions(getattr(self, name).index, STATEMENT_YOY_DAYS)
+        return self._prior[name]
+
+    def _prior_positions(self, name, dates):
+        """dates 在 name 報表中的去年同期列位置；報表沒有該日期或找不到去年同期時為 -1"""
+        own = self._prior_of(name)
+        if len(own) == 0: return np.full(len(dates), -1)
+        pos = getattr(self, name).index.get_indexer(dates)
+        return np.where(pos >= 0, own[np.clip(pos, 0, None)], -1)
+
+    def _prev_row(self, name, curr_date):
+        """取得去年同期數據 (YoY)；找不到時回傳 None"""
+        df = getattr(self, name)
+        if curr_date not in df.index: return None
+        i = self._prior_of(name)[df.index.get_loc(curr_date)]
+        return None if i < 0 else df.iloc[i].fillna(0)
 
     # ========================================================
     # 1. 融資籌碼分析 (Margin Analysis)
     # ========================================================
+    @memoized('margin')
     def calculate_margin_metrics(self):
         try:
-            if self.margin.empty: return {}
-            df = self.margin.copy()
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date', ascending=True)
-            
-            # 模糊搜尋欄位
-            col_name = None
-            possible_cols = ['MarginPurchaseBalance', 'MarginBalance', 'MarginPurchaseTodayBalance']
-            for c in df.columns:
-                if any(x in c for x in possible_cols): col_name = c; break
-            
-            if not col_name: return {}
+            flows = margin_flows(self.margin, windows=(5,))
+            if flows.empty: return {}
+            last = latest(flows).iloc[-1]
+            if last['days'] < 2: return {}
 
-            df_recent = df.tail(20)
-            if len(df_recent) < 2: return {}
-            
-            latest = df_recent.iloc[-1][col_name]
-            prev_idx = -6 if len(df_recent) >= 6 else 0
-            prev = df_recent.iloc[prev_idx][col_name]
-            
+            # 近 5 日變化 (不足 6 筆時與第一筆比較)
             return {
-                "Margin Increasing": latest > prev,
-                "Latest Balance": latest,
-                "Change": (latest - prev)
+                "Margin Increasing": last['margin_chg_5d'] > 0,
+                "Latest Balance": last['margin_balance'],
+                "Change": last['margin_chg_5d']
             }
-        except: return {}
+        except Exception as e:
+            telemetry.error('metrics.calculate_margin_metrics', e)
+            return {}
 
     # ========================================================
-    # 2. 籌碼分析 (Chip Analysis - 雙語模糊比對)
+    # 2. 籌碼分析 (Chip Analysis - 抓取時已正規化為法人類別)
     # ========================================================
+    @memoized('chip', info=('marketCap',))
     def calculate_chip_metrics(self):
         try:
-            if self.chip.empty: return {}
-            df = self.chip.copy()
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date', ascending=True)
-            
-            if 'name' not in df.columns: return {}
-            df['name'] = df['name'].astype(str)
+            flows = chip_flows(self.chip, windows=(3, 10))
+            if flows.empty: return {}
+            last = latest(flows).iloc[-1]
+
+            # 外資近 3 個交易日 (外資 + 外資自營商同日合併) / 投信近 10 個交易日買賣超；連買以每日合計判斷
+            foreign_net = last['foreign_net_3d']
+            foreign_consecutive = last['foreign_streak'] >= 3
+            trust_net = last['trust_net_10d']
 
-            # 外資 (包含 Foreign 或 外資)
-            foreign = df[df['name'].str.contains('Foreign|外資', case=False, regex=True)].tail(3)
-            foreign_net = 0; foreign_consecutive = False
-            
-            if not foreign.empty:
-                # 強制轉型防呆
-                for c in ['buy', 'sell']:
-                    foreign[c] = pd.to_numeric(foreign[c].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
-                
-                net = foreign['buy'] - foreign['sell']
-                foreign_net = net.sum()
-                if len(foreign) >= 3:
-                    foreign_consecutive = (net > 0).all()
-
-            # 投信 (包含 Trust 或 投信)
-            trust = df[df['name'].str.contains('Trust|投信', case=False, regex=True)].tail(10)
-            trust_net = 0
-            if not trust.empty:
-                for c in ['buy', 'sell']:
-                    trust[c] = pd.to_numeric(trust[c].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
-                trust_net = (trust['buy'] - trust['sell']).sum()
-            
             market_cap = self.info.get('marketCap', 0)
             is_small_cap = 0 < market_cap < (50 * 100000000) 
             trust_active = (trust_net > 0) and is_small_cap
@@ -122,78 +207,53 @@ class MetricCalculator:
                 "Trust Active Buy": trust_active,
                 "Is Small Cap": is_small_cap
             }
-        except: return {}
+        except Exception as e:
+            telemetry.error('metrics.calculate_chip_metrics', e)
+            return {}
 
     # ========================================================
     # 3. 大師指標 (Guru Metrics) - [TTM 修正版]
     # ========================================================
+    @memoized('bs', 'inc', 'rev', 'div', info=('marketCap', 'currentPrice', 'trailingPE'))
     def calculate_guru_metrics(self):
         try:
             if self.bs.empty or self.inc.empty: return {}
             curr_date = self.inc.index[0]
-            def get(df, key): return self._get_value_smart(df, curr_date, key)
+            b = self._row(self.bs, curr_date)
 
             # --- A. 葛拉漢數 (5年平均 EPS) ---
-            equity = get(self.bs, 'EQUITY'); common_stock = get(self.bs, 'COMMON_STOCK')
+            equity = b['EQUITY']; common_stock = b['COMMON_STOCK']
             shares = (common_stock / 10) if common_stock > 0 else 1
             bvps = equity / shares if shares > 0 else 0
 
-            avg_eps = 0; eps_values = []
-            for i in range(min(20, len(self.inc))):
-                d = self.inc.index[i]
-                q_eps = self._get_value_smart(self.inc, d, 'EPS')
-                if q_eps == 0 and shares > 0:
-                    ni = self._get_value_smart(self.inc, d, 'NET_INCOME')
-                    q_eps = ni / shares
-                if q_eps != 0: eps_values.append(q_eps)
+            avg_eps = 0
+            last20 = self.inc.iloc[:20].fillna(0)
+            eps = last20['EPS'].to_numpy()
+            if shares > 0: eps = np.where(eps == 0, last20['NET_INCOME'].to_numpy() / shares, eps)
+            eps_values = eps[eps != 0]
             
-            if eps_values: avg_eps = (sum(eps_values) / len(eps_values)) * 4
+            if len(eps_values): avg_eps = eps_values.mean() * 4
             graham_number = (22.5 * avg_eps * bvps) ** 0.5 if (avg_eps > 0 and bvps > 0) else 0
 
-            curr_assets = get(self.bs, 'CURRENT_ASSETS')
-            curr_liab = get(self.bs, 'CURRENT_LIABILITIES')
+            curr_assets = b['CURRENT_ASSETS']
+            curr_liab = b['CURRENT_LIABILITIES']
             current_ratio = (curr_assets / curr_liab) if curr_liab > 0 else 0
-            ncav = (curr_assets - get(self.bs, 'LIABILITIES')) / shares if shares > 0 else 0
+            ncav = (curr_assets - b['LIABILITIES']) / shares if shares > 0 else 0
 
             # --- B. 林區 PEG ---
-            _, yoy_rev = self.calculate_revenue_growth()
-            growth = yoy_rev if yoy_rev else 0
+            lynch = self._lynch()
             mcap = self.info.get('marketCap', 0)
-            
-            lynch_cat = "未分類"
-            if growth > 20: lynch_cat = "🚀 快速成長"
-            elif 10 < growth <= 20: lynch_cat = "🛡️ 穩定成長"
-            elif growth < 5 and mcap > 500*100000000: lynch_cat = "🐢 緩慢成長"
-            elif growth < 0: lynch_cat = "🔄 循環/轉機"
-
-            div_yield = 0
-            if not self.div.empty:
-                try:
-                    last_div = self.div.sort_values('date').iloc[-1]['CashEarningsDistribution']
-                    price = self.info.get('currentPrice', 1)
-                    if price > 0: div_yield = (last_div / price) * 100
-                except: pass
-            
-            pe = self.info.get('trailingPE', 0)
-            lynch_peg = pe / (growth + div_yield) if (growth + div_yield) > 0 and pe > 0 else None
 
             # --- C. 神奇公式 (TTM 修正版) [cite: 55-60] ---
             # 報告要求: 避免使用單一年度，需平滑波動。
             # 實作: 滾動加總過去 4 季 (TTM) 的 EBIT
             
-            ebit_ttm = 0
-            count = 0
-            # 往前抓 4 季
-            for i in range(min(4, len(self.inc))):
-                d = self.inc.index[i]
-                val = self._get_value_smart(self.inc, d, 'EBIT')
-                if val == 0: 
-                    val = self._get_value_smart(self.inc, d, 'PRE_TAX_INCOME') + \
-                          self._get_value_smart(self.inc, d, 'INTEREST_EXPENSE')
-                
-                if val != 0:
-                    ebit_ttm += val
-                    count += 1
+            last4 = self.inc.iloc[:4].fillna(0)
+            vals = last4['EBIT'].to_numpy()
+            vals = np.where(vals == 0, (last4['PRE_TAX_INCOME'] + last4['INTEREST_EXPENSE']).to_numpy(), vals)
+            vals = vals[vals != 0]
+            ebit_ttm = vals.sum()
+            count = len(vals)
             
             # 若資料不足 4 季，則用平均值年化
             if count > 0 and count < 4:
@@ -201,8 +261,7 @@ class MetricCalculator:
             elif count == 0:
                 ebit_ttm = 0
 
-            fixed_assets = get(self.bs, 'FIXED_ASSETS')
-            if fixed_assets == 0: fixed_assets = self._get_value_smart(self.bs, curr_date, 'NON_CURRENT_ASSETS')
+            fixed_assets = b['FIXED_ASSETS']
             
             wc = curr_assets - curr_liab
             ic = fixed_assets + wc
@@ -210,111 +269,205 @@ class MetricCalculator:
             # 使用 TTM EBIT 計算 ROC
             magic_roc = (ebit_ttm / ic * 100) if ic > 0 else 0
 
-            debt = get(self.bs, 'LIABILITIES'); cash = get(self.bs, 'CASH')
-            if cash==0: cash = self._get_value_smart(self.bs, curr_date, 'CashAndCashEquivalents')
+            debt = b['LIABILITIES']; cash = b['CASH']
             ev = mcap + debt - cash
             magic_ey = (ebit_ttm / ev * 100) if ev > 0 else 0
 
             return {
                 "Graham Number": graham_number, "NCAV": ncav,
-                "Lynch Category": lynch_cat, "Lynch PEG": lynch_peg,
+                **lynch,
                 "Magic ROC": magic_roc, "Magic EY": magic_ey,
                 "Avg EPS": avg_eps, "Current Ratio": current_ratio
             }
-        except Exception as e: 
+        except Exception as e:
+            telemetry.error('metrics.calculate_guru_metrics', e)
+            return {}
+
+    def _lynch(self):
+        growth = self.calculate_revenue_growth()[1] or 0
+        mcap = self.info.get('marketCap', 0)
+
+        lynch_cat = "未分類"
+        if growth > 20: lynch_cat = "🚀 快速成長"
+        elif 10 < growth <= 20: lynch_cat = "🛡️ 穩定成長"
+        elif growth < 5 and mcap > 500*100000000: lynch_cat = "🐢 緩慢成長"
+        elif growth < 0: lynch_cat = "🔄 循環/轉機"
+
+        div_yield = 0
+        if not self.div.empty:
+            try:
+                last_div = self.div.sort_values('date').iloc[-1]['CashEarningsDistribution']
+                price = self.info.get('currentPrice', 1)
+                if price > 0: div_yield = (last_div / price) * 100
+            except Exception as e: telemetry.error('metrics.dividend_yield', e)
+
+        pe = self.info.get('trailingPE', 0)
+        lynch_peg = pe / (growth + div_yield) if (growth + div_yield) > 0 and pe > 0 else None
+        return {"Lynch Category": lynch_cat, "Lynch PEG": lynch_peg}
+
+    @memoized('rev', 'div', info=('marketCap', 'currentPrice', 'trailingPE'))
+    def calculate_lynch_metrics(self):
+        """林區分類與 PEG (只依賴月營收、股利與 Yahoo 資料，營收更新時可單獨重算)"""
+        try:
+            return self._lynch()
+        except Exception as e:
+            telemetry.error('metrics.calculate_lynch_metrics', e)
             return {}
 
     # ========================================================
     # 4. 營收動能 (Revenue Growth)
     # ========================================================
+    @cached_property
+    def _revenue(self):
+        """月營收 (日期由新到舊) 與每一列的去年同期列位置 -> (日期, 營收, 位置)；無營收欄時為 None"""
+        val_col = 'revenue' if 'revenue' in self.rev.columns else ('value' if 'value' in self.rev.columns else None)
+        if self.rev.empty or not val_col: return None
+        df = self.rev.assign(date=pd.to_datetime(self.rev['date'])).sort_values('date', ascending=False)
+        dates = pd.DatetimeIndex(df['date'])
+        return dates, df[val_col].to_numpy(), prior_year_positions(dates, REVENUE_YOY_DAYS)
+
+    @memoized('rev')
     def calculate_revenue_growth(self):
         try:
-            if self.rev.empty: return None, None
-            df = self.rev.copy()
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date', ascending=False)
-            
-            val_col = 'revenue'
-            if val_col not in df.columns:
-                if 'value' in df.columns: val_col = 'value'
-                else: return None, None 
-
-            if len(df) < 2: return None, None
+            if self._revenue is None: return None, None
+            _, values, prior = self._revenue
+            if len(values) < 2: return None, None
 
-            curr_rev = df.iloc[0][val_col]
-            last_month_rev = df.iloc[1][val_col]
+            curr_rev = values[0]
+            last_month_rev = values[1]
             mom = ((curr_rev - last_month_rev) / last_month_rev * 100) if last_month_rev else 0
-            
-            target_date = df.iloc[0]['date'] - pd.DateOffset(years=1)
-            mask = (df['date'] >= target_date - pd.Timedelta(days=5)) & \
-                   (df['date'] <= target_date + pd.Timedelta(days=5))
-            prev_rows = df.loc[mask]
+
             yoy = 0
-            if not prev_rows.empty:
-                prev_rev = prev_rows.iloc[0][val_col]
+            if prior[0] >= 0:
+                prev_rev = values[prior[0]]
                 yoy = ((curr_rev - prev_rev) / prev_rev * 100) if prev_rev else 0
-                
+
             return mom, yoy
-        except: return None, None
+        except Exception as e:
+            telemetry.error('metrics.calculate_revenue_growth', e)
+            return None, None
 
     # ========================================================
     # 5. F-Score
     # ========================================================
+    @memoized('bs', 'inc', 'cf')
     def calculate_f_score(self):
         score = 0; details = []
         if self.inc.empty or self.bs.empty: return 0, ["❌ 數據缺失"]
         try:
             curr_date = self.inc.index[0]
-            def get(df, k): return self._get_value_smart(df, curr_date, k)
-            def get_p(df, k): return self._get_prev_value(df, curr_date, k)
+            inc = self._row(self.inc, curr_date); bs = self._row(self.bs, curr_date); cf = self._row(self.cf, curr_date)
+            p_inc = self._prev_row('inc', curr_date); p_bs = self._prev_row('bs', curr_date)
+            def get_p(row, k): return None if row is None else row[k]
 
-            ni = get(self.inc, 'NET_INCOME'); assets = get(self.bs, 'ASSETS'); cfo = get(self.cf, 'OPERATING_CASH_FLOW')
+            ni = inc['NET_INCOME']; assets = bs['ASSETS']; cfo = cf['OPERATING_CASH_FLOW']
             if assets>0 and ni/assets>0: score+=1; details.append("✅ ROA > 0")
             if cfo>0: score+=1; details.append("✅ CFO > 0")
             if cfo>ni: score+=1; details.append("✅ CFO > NI")
-            p_ni = get_p(self.inc, 'NET_INCOME'); p_assets = get_p(self.bs, 'ASSETS')
-            if p_ni and p_assets and (ni/assets)>(p_ni/p_assets): score+=1; details.append("✅ ROA YoY > 0")
+            p_ni = get_p(p_inc, 'NET_INCOME'); p_assets = get_p(p_bs, 'ASSETS')
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if p_ni and p_assets and (ni/assets)>(p_ni/p_assets): score+=1; details.append("✅ ROA YoY > 0")
             
-            lev = get(self.bs, 'LIABILITIES') - get(self.bs, 'CURRENT_LIABILITIES')
-            p_lev = get_p(self.bs, 'LIABILITIES')
+            lev = bs['LIABILITIES'] - bs['CURRENT_LIABILITIES']
+            p_lev = get_p(p_bs, 'LIABILITIES')
             if p_lev: 
-                p_lev_val = p_lev - get_p(self.bs, 'CURRENT_LIABILITIES')
+                p_lev_val = p_lev - get_p(p_bs, 'CURRENT_LIABILITIES')
                 if assets>0 and p_assets>0 and (lev/assets)<=(p_lev_val/p_assets): score+=1; details.append("✅ 負債比下降")
             
-            cur = get(self.bs, 'CURRENT_ASSETS'); cur_l = get(self.bs, 'CURRENT_LIABILITIES')
-            p_cur = get_p(self.bs, 'CURRENT_ASSETS'); p_cur_l = get_p(self.bs, 'CURRENT_LIABILITIES')
+            cur = bs['CURRENT_ASSETS']; cur_l = bs['CURRENT_LIABILITIES']
+            p_cur = get_p(p_bs, 'CURRENT_ASSETS'); p_cur_l = get_p(p_bs, 'CURRENT_LIABILITIES')
             if cur_l>0 and p_cur_l and (cur/cur_l)>(p_cur/p_cur_l): score+=1; details.append("✅ 流動比上升")
             
-            stk = get(self.bs, 'COMMON_STOCK'); p_stk = get_p(self.bs, 'COMMON_STOCK')
+            stk = bs['COMMON_STOCK']; p_stk = get_p(p_bs, 'COMMON_STOCK')
             if p_stk and stk<=p_stk*1.05: score+=1; details.append("✅ 無顯著增資")
             elif not p_stk: score+=1; details.append("⚠️ 無股本數據通過")
 
-            rev = get(self.inc, 'REVENUE'); cost = get(self.inc, 'OPERATING_COSTS')
-            p_rev = get_p(self.inc, 'REVENUE'); p_cost = get_p(self.inc, 'OPERATING_COSTS')
+            rev = inc['REVENUE']; cost = inc['OPERATING_COSTS']
+            p_rev = get_p(p_inc, 'REVENUE'); p_cost = get_p(p_inc, 'OPERATING_COSTS')
             if rev>0 and cost>0 and p_rev and p_cost:
                 if ((rev-cost)/rev) > ((p_rev-p_cost)/p_rev): score+=1; details.append("✅ 毛利率提升")
             if assets>0 and p_assets and (rev/assets)>(p_rev/p_assets): score+=1; details.append("✅ 週轉率提升")
-        except Exception as e: details.append(f"計算中斷: {e}")
+        except Exception as e:
+            telemetry.error('metrics.calculate_f_score', e)
+            details.append(f"計算中斷: {e}")
         return score, details
 
     # ========================================================
     # 6. Z-Score
     # ========================================================
+    @memoized('bs', 'inc', info=('marketCap', 'sector'))
     def calculate_z_score(self):
         try:
             if self.bs.empty: return None, "無數據"
             if any(x in self.info.get('sector','') for x in ['Financial', 'Bank', 'Insurance']): return None, "金融業不適用"
             curr_date = self.bs.index[0]
-            def get(df, k): return self._get_value_smart(df, curr_date, k)
-            ta = get(self.bs, 'ASSETS'); tl = get(self.bs, 'LIABILITIES')
+            bs = self._row(self.bs, curr_date); inc = self._row(self.inc, curr_date)
+            ta = bs['ASSETS']; tl = bs['LIABILITIES']
             if ta==0 or tl==0: return None, "資產/負債為0"
-            x1 = (get(self.bs, 'CURRENT_ASSETS') - get(self.bs, 'CURRENT_LIABILITIES')) / ta
-            x2 = get(self.bs, 'RETAINED_EARNINGS') / ta
-            ebit = get(self.inc, 'EBIT')
-            if ebit==0: ebit = get(self.inc, 'PRE_TAX_INCOME') + get(self.inc, 'INTEREST_EXPENSE')
+            x1 = (bs['CURRENT_ASSETS'] - bs['CURRENT_LIABILITIES']) / ta
+            x2 = bs['RETAINED_EARNINGS'] / ta
+            ebit = inc['EBIT']
+            if ebit==0: ebit = inc['PRE_TAX_INCOME'] + inc['INTEREST_EXPENSE']
             x3 = ebit / ta
             x4 = self.info.get('marketCap', 0) / tl
-            x5 = get(self.inc, 'REVENUE') / ta
+            x5 = inc['REVENUE'] / ta
             z = 1.2*x1 + 1.4*x2 + 3.3*x3 + 0.6*x4 + 1.0*x5
             return z, "計算完成"
-        except Exception as e: return None, str(e)
+        except Exception as e:
+            telemetry.error('metrics.calculate_z_score', e)
+            return None, str(e)
+
+    # ========================================================
+    # 7. 歷史序列 (每一季的 F-Score / Z-Score)
+    # ========================================================
+    def _aligned(self, df, dates):
+        """將報表對齊到指定日期 (缺日期為 NaN)；報表為空時全部為 0，與 _row 相同"""
+        if df.empty: return pd.DataFrame(0.0, index=dates, columns=list(MAPPING))
+        return df.reindex(dates)
+
+    def _prior_year(self, name, dates):
+        """每個日期的去年同期列 (報表沒有該日期或找不到時為 NaN)"""
+        return take_rows(getattr(self, name), self._prior_positions(name, dates), dates)
+
+    @memoized('bs', 'inc', 'cf')
+    def calculate_f_score_history(self):
+        """
+        每一季的 F-Score 與九項檢定 (日期由舊到新)。
+        以對齊後的欄位運算一次完成，該季缺資產負債表/現金流量表時記 0 分 (與 calculate_f_score 相同)。
+        """
+        cols = ['F-Score'] + F_COMPONENTS
+        if self.inc.empty or self.bs.empty: return pd.DataFrame(columns=cols)
+        dates = self.inc.index
+        bs = self._aligned(self.bs, dates); cf = self._aligned(self.cf, dates)
+        comp = f_score_components(self.inc.fillna(0), bs.fillna(0), cf.fillna(0),
+                                  self._prior_year('inc', dates).fillna(0), self._prior_year('bs', dates).fillna(0))
+        missing = ~dates.isin(self.bs.index) | (~dates.isin(self.cf.index) if not self.cf.empty else False)
+        comp.loc[missing] = False
+        comp['F-Score'] = comp[F_COMPONENTS].sum(axis=1)
+        return comp[cols].sort_index()
+
+    @memoized('bs', 'inc', info=('marketCap', 'sector'))
+    def calculate_z_score_history(self, price_df=None):
+        """
+        每一季的 Z-Score 與五項比率 (日期由舊到新)。
+        X4 的市值: 有股價時以當季收盤價 × 股數 (股本/10) 估算，否則沿用目前市值。
+        """
+        cols = Z_COMPONENTS + ['Z-Score']
+        if self.bs.empty: return pd.DataFrame(columns=cols)
+        if any(x in self.info.get('sector','') for x in ['Financial', 'Bank', 'Insurance']): return pd.DataFrame(columns=cols)
+        dates = self.bs.index
+        inc = self._aligned(self.inc, dates)
+
+        mcap = pd.Series(float(self.info.get('marketCap', 0) or 0), index=dates)
+        if price_df is not None and not price_df.empty:
+            close = price_df['Close'].copy()
+            close.index = pd.DatetimeIndex(close.index).tz_localize(None).normalize()
+            close = close.sort_index()
+            px = close.reindex(dates, method='ffill')
+            shares = self.bs['COMMON_STOCK'] / 10
+            mcap = (px * shares).where(px.notna() & (shares > 0), mcap)
+
+        comp = z_score_components(self.bs.fillna(0), inc.fillna(0), mcap)
+        # 損益表缺少該季 -> 無法計算
+        if not self.inc.empty: comp.loc[~dates.isin(self.inc.index)] = np.nan
+        return comp[cols].sort_index()
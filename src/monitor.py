@@ -0,0 +1,196 @@
+"""
+盤中監控 (asyncio，不需 Streamlit): 觀察清單的股價與籌碼 / 融資依固定間隔輪詢，
+每個來源每輪只發一次批次請求 (股價多檔合併下載、籌碼 / 融資全市場一次)，請求數不隨檔數增加；
+與上一輪比對後只重新評分輸入有變動的股票，generate_signals 的動作改變時發出警示。
+
+    python -m src.monitor                         # 觀察清單 (config.WATCHLIST)，依時段常駐輪詢
+    python -m src.monitor --watchlist 2330 2317 --once
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import pandas as pd
+from .config import (DATASETS, WATCHLIST, PREWARM_TIMEZONE, MONITOR_PRICE_INTERVAL, MONITOR_CHIP_INTERVAL,
+                     MONITOR_PRICE_HOURS, MONITOR_CHIP_HOURS, MONITOR_IDLE)
+from .metrics import MetricCalculator
+from .pipeline import load_snapshot, score, clean_id
+from .store import get_store
+from .scheduler import use_priority, BACKGROUND
+from . import prices, bulk, technicals, telemetry, worker
+
+TZ = ZoneInfo(PREWARM_TIMEZONE)
+
+
+# ========================================================
+# 1. 時段與重新評分
+# ========================================================
+def in_hours(now, hours):
+    """now 是否在交易日 (週一至週五) 的 hours = (開始, 結束) 之內"""
+    return now.weekday() < 5 and hours[0] <= f"{now:%H:%M}" <= hours[1]
+
+def with_bar(history, bar):
+    """日線換上 (或追加) 最新一根 K 棒"""
+    if history is None or history.empty: return bar
+    day = bar.index[-1].normalize()
+    return pd.concat([history[history.index.normalize() < day], bar.reindex(columns=history.columns)])
+
+def rescore(res, price=None, technical=None, chip=None, margin=None):
+    """
+    快照換上新的現價、技術指標或籌碼 / 融資後重新評分 -> 新的結果 dict (原 res 不變)。
+    籌碼 / 融資只重算對應的滾動指標，其餘指標沿用快照。
+    """
+    res = dict(res)
+    if price is not None: res['info'] = {**res['info'], 'currentPrice': price}
+    if technical is not None: res['technical'] = technical
+    if chip is not None or margin is not None:
+        empty = pd.DataFrame()
+        calc = MetricCalculator(empty, empty, empty, empty, empty,
+                                chip if chip is not None else empty, margin if margin is not None else empty, res['info'])
+        if chip is not None: res['chip_metrics'] = calc.calculate_chip_metrics()
+        if margin is not None: res['margin_metrics'] = calc.calculate_margin_metrics()
+    return score(res)
+
+def print_alert(alert):
+    print(f"[{alert['at']:%H:%M:%S}] 🔔 {alert['stock_id']} {alert['from']} → {alert['to']} "
+          f"(總分 {alert['score'][0]} → {alert['score'][1]}，{alert['source']})", flush=True)
+    for r in alert['reasons']: print(f"    {r}", flush=True)
+
+
+# ========================================================
+# 2. 監控器
+# ========================================================
+class Monitor:
+    """
+    單一事件迴圈上的輪詢: 股價與籌碼 / 融資各一個迴圈，阻塞的下載與寫回交給執行緒，
+    重新評分在迴圈上進行 (只處理有變動的股票，結果不會被兩個迴圈同時改寫)。
+    """
+    def __init__(self, stock_ids, token=None, on_alert=print_alert,
+                 price_interval=MONITOR_PRICE_INTERVAL, chip_interval=MONITOR_CHIP_INTERVAL):
+        self.ids = list(dict.fromkeys(map(clean_id, stock_ids)))
+        self.token = token
+        self.on_alert = on_alert
+        self.price_interval = price_interval
+        self.chip_interval = chip_interval
+        # stock_id -> {'res': 最新評分結果, 'history': 日線 (含盤中 K 棒), 'quote': 上一輪報價, 'flows': {資料集鍵: 指紋}}
+        self.state = {}
+
+    def _baseline(self):
+        """各檔的起始結果: 讀快照，沒有的先由背景預熱流程算一次"""
+        missing = [sid for sid in self.ids if load_snapshot(sid) is None]
+        if missing: worker.refresh(missing, token=self.token)
+        for sid in self.ids:
+            res = load_snapshot(sid)
+            if res is None: continue
+            self.state[sid] = {'res': res, 'history': res['price_df'], 'quote': None, 'flows': {}}
+
+    def _apply(self, sid, source, **inputs):
+        st = self.state[sid]
+        old = st['res']
+        new = st['res'] = rescore(old, **inputs)
+        if new['action'] != old['action'] and self.on_alert:
+            self.on_alert({'stock_id': sid, 'at': datetime.now(TZ), 'source': source,
+                           'from': old['action'], 'to': new['action'],
+                           'score': (old['total_score'], new['total_score']), 'reasons': new['reasons']})
+
+    async def poll_prices(self):
+        """一次下載全部報價；收盤價或成交量有變的股票重新評分 -> 變動的檔數"""
+        bars = await asyncio.to_thread(prices.latest_bars, list(self.state))
+        changed = []
+        for sid, bar in bars.items():
+            st = self.state[sid]
+            quote = (bar.index[-1], float(bar['Close'].iloc[-1]), float(bar['Volume'].iloc[-1]))
+            if quote == st['quote']: continue
+            st['quote'] = quote
+            st['history'] = with_bar(st['history'], bar)
+            changed.append(sid)
+        # 變動的股票一次整欄計算技術指標
+        tech = technicals.for_stocks({sid: self.state[sid]['history'] for sid in changed})
+        for sid in changed:
+            self._apply(sid, '股價', price=self.state[sid]['quote'][1], technical=tech.get(sid, {}))
+        return len(changed)
+
+    def _ingest(self, key):
+        # FinMind 額度經由排程器的共用狀態 (scheduler.sqlite) 與 Streamlit / 背景預熱合計；
+        # 背景優先度: UI 有互動請求在等時讓路。重抓最近一個交易日以取得剛公布 / 更正的資料
+        with use_priority(BACKGROUND):
+            return bulk.ingest(key, self.token, refetch_last=True)
+
+    def _changed_flows(self, key, market):
+        """全市場資料 -> 觀察清單中視窗內資料有變、且與快照所用不同的股票 {stock_id: 視窗內資料}；有變的寫回本地資料"""
+        store, start, dataset = get_store(), bulk.window_start(), DATASETS[key]
+        ids = market['stock_id'].astype(str)
+        mask = ids.isin(set(self.state))
+        watched = market[mask].reset_index(drop=True)
+        # 逐列雜湊 (與本地資料庫相同轉字串比對: 剛抓到的與 Parquet 讀回的型別不同也不誤判)
+        hashes = pd.util.hash_pandas_object(watched.astype(str), index=False).to_numpy()
+        changed = {}
+        for sid, pos in watched.groupby(ids[mask].to_numpy(), sort=False).indices.items():
+            fp = hash(hashes[pos].tobytes())
+            if self.state[sid]['flows'].get(key) == fp: continue
+            self.state[sid]['flows'][key] = fp
+            rows = watched.iloc[pos].reset_index(drop=True)
+            store.merge(dataset, sid, rows, first_date=start)
+            # 本地資料與快照計算時相同 (第一輪常見): 不必重新評分
+            if (store.status(dataset, sid) or {}).get('changed_at') == self.state[sid]['res']['versions'].get(key): continue
+            changed[sid] = rows
+        return changed
+
+    async def poll_chips(self):
+        """籌碼 / 融資各一次全市場請求 (比對與寫回在執行緒)；有變的股票重新評分 -> 變動的檔數"""
+        changed = {}
+        for key in bulk.BULK_KEYS:
+            market, complete = await asyncio.to_thread(self._ingest, key)
+            if market is None or market.empty or not complete: continue
+            name = 'chip' if key == 'INSTITUTIONAL' else 'margin'
+            for sid, rows in (await asyncio.to_thread(self._changed_flows, key, market)).items():
+                changed.setdefault(sid, {})[name] = rows
+        for sid, frames in changed.items():
+            self._apply(sid, '籌碼' if 'chip' in frames else '融資', **frames)
+        return len(changed)
+
+    async def _every(self, interval, hours, poll):
+        """hours 時段內每 interval 秒執行 poll (扣除本身耗時)；單輪失敗只記錄，下一輪照常"""
+        while True:
+            if not in_hours(datetime.now(TZ), hours):
+                await asyncio.sleep(MONITOR_IDLE)
+                continue
+            t = time.monotonic()
+            try:
+                await poll()
+            except Exception as e:
+                telemetry.error(f"monitor.{poll.__name__}", e)
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - t)))
+
+    async def run(self, once=False):
+        """建立起始結果後常駐輪詢 (once: 兩個來源各輪詢一次即結束，不看時段)"""
+        await asyncio.to_thread(self._baseline)
+        if once:
+            return await asyncio.gather(self.poll_prices(), self.poll_chips())
+        await asyncio.gather(self._every(self.price_interval, MONITOR_PRICE_HOURS, self.poll_prices),
+                             self._every(self.chip_interval, MONITOR_CHIP_HOURS, self.poll_chips))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台股量化系統盤中監控")
+    parser.add_argument('--watchlist', nargs='+', default=WATCHLIST, help="股票代號 (預設 config.WATCHLIST)")
+    parser.add_argument('--token', default=os.environ.get('FINMIND_TOKEN'), help="FinMind token (預設環境變數 FINMIND_TOKEN)")
+    parser.add_argument('--once', action='store_true', help="股價與籌碼各輪詢一次後結束")
+    args = parser.parse_args(argv)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)  # 非 Streamlit 環境下 st.cache_data 的警告
+
+    monitor = Monitor(args.watchlist, token=args.token)
+    try:
+        result = asyncio.run(monitor.run(once=args.once))
+    except KeyboardInterrupt:
+        return 0
+    if args.once: print(f"股價變動 {result[0]} 檔，籌碼 / 融資變動 {result[1]} 檔 (共 {len(monitor.state)} 檔)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
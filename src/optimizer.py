@@ -0,0 +1,211 @@
+"""
+評分卡門檻 / 分數的參數掃描:
+時點回測的評分輸入 (Backtester.inputs) 只算一次並存檔，之後每組參數只換門檻重新評分，
+以買進與避開兩組的未來報酬價差、買進勝率排序。各程序在 initializer 載入一次輸入，
+規則遮罩依規則實際讀取的門檻值快取，組合之間相同的門檻不重算。
+"""
+import os
+import math
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .config import (STORE_DIR, OPTIMIZER_SPACE, OPTIMIZER_SAMPLES, OPTIMIZER_WORKERS, OPTIMIZER_CHUNK,
+                     OPTIMIZER_MIN_SIGNALS)
+from .strategy import RULES, PARAMS, INPUTS, FLAGS, ACTIONS, rule_inputs, total_score
+from .backtest import Backtester
+from .memo import fingerprint, code_version
+
+OPTIMIZER_DIR = 'optimizer'
+# 回測用到的面板與影響評分輸入的原始碼: 任一變動即重建輸入
+PANELS = ['close', 'high', 'low', 'volume', 'bs', 'inc', 'cf', 'rev', 'div', 'info']
+CODE_FILES = ['backtest.py', 'screener.py', 'metrics.py', 'technicals.py', 'strategy.py', 'config.py']
+# 買進 = 總分達到「買進/持有」門檻；避開 = 未達「觀望」門檻
+BUY_FLOOR = ACTIONS[1][0]
+AVOID_FLOOR = ACTIONS[2][0]
+MASK_CACHE_ENTRIES = 4096
+RULE_POINTS = {rule.name: rule.points for rule in RULES}
+
+
+# ========================================================
+# 1. 時點評分輸入 (只算一次)
+# ========================================================
+def build_inputs(panels, freq='M', root=STORE_DIR):
+    """Screener.load 的面板 -> 可評分列的輸入與未來報酬 (Parquet 路徑)；面板與程式未變時直接沿用"""
+    parts = [code_version(CODE_FILES), freq, *(fingerprint(panels.get(k)) for k in PANELS)]
+    key = fingerprint(parts)[:16]
+    path = os.path.join(root, OPTIMIZER_DIR, f"inputs-{freq}-{key}.parquet")
+    if os.path.exists(path): return path
+
+    grid = Backtester(panels, freq=freq).inputs()
+    cols = ['date', 'stock_id', *(k for k in [*INPUTS, *FLAGS] if k in grid.columns),
+            *(c for c in grid.columns if c.startswith('fwd_'))]
+    df = grid.loc[grid['scorable'], cols].sort_values(['date', 'stock_id']).reset_index(drop=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)   # 原子替換: 同時建立的其他程序讀到的一定是完整檔
+    return path
+
+
+# ========================================================
+# 2. 參數組合
+# ========================================================
+def configs(space=OPTIMIZER_SPACE, samples=OPTIMIZER_SAMPLES, seed=0):
+    """
+    space: {門檻或規則代號: 候選值} -> 組合清單 (第一組為現行設定)。
+    samples 為 None 或不少於網格大小時列出完整網格，否則不重複隨機抽樣。
+    """
+    unknown = set(space) - set(PARAMS) - set(RULE_POINTS)
+    if unknown: raise ValueError(f"未知的掃描參數: {sorted(unknown)}")
+    keys = list(space)
+    default = tuple(PARAMS[k] if k in PARAMS else RULE_POINTS[k] for k in keys)
+    size = math.prod(len(v) for v in space.values())
+    if samples is None or samples >= size:
+        combos = [c for c in itertools.product(*space.values()) if c != default]
+    else:
+        rng = np.random.default_rng(seed)
+        seen = {default}
+        combos = []
+        while len(combos) < samples - 1:
+            c = tuple(v[rng.integers(len(v))] for v in space.values())
+            if c not in seen:
+                seen.add(c)
+                combos.append(c)
+    return [dict(zip(keys, c)) for c in [default, *combos]]
+
+
+# ========================================================
+# 3. 單組評估
+# ========================================================
+class _Recorder(dict):
+    """記錄規則讀取了哪些門檻"""
+    def __init__(self, base):
+        super().__init__(base)
+        self.used = set()
+
+    def __getitem__(self, key):
+        self.used.add(key)
+        return super().__getitem__(key)
+
+class Evaluator:
+    """
+    一份評分輸入上的組合評估: 組合 -> 價差、超額報酬、勝率與訊號數。
+    報酬先在每個調整日內平均，再對調整日平均 (每期等權)。
+    """
+    def __init__(self, inputs, ret='fwd_period'):
+        df = inputs[inputs[ret].notna()]
+        self.c = {k: s.to_numpy() for k, s in rule_inputs(df).items()}
+        self.codes, dates = pd.factorize(df['date'])
+        self.periods = len(dates)
+        self.ret = df[ret].to_numpy(dtype=float)
+        self.market = df.groupby(self.codes)[ret].mean().to_numpy()
+        self._labels = self.codes * 3   # 每期 3 格: 買進 / 避開 / 其他
+        self.deps = []
+        for rule in RULES:
+            rec = _Recorder(PARAMS)
+            rule.when(self.c, rec)   # & / | 不短路，每個門檻都會被讀到
+            self.deps.append(tuple(sorted(rec.used)))
+        self._masks = {}
+
+    def _mask(self, i, params):
+        key = (i, tuple(params[k] for k in self.deps[i]))
+        m = self._masks.get(key)
+        if m is None:
+            if len(self._masks) >= MASK_CACHE_ENTRIES: self._masks.clear()
+            m = self._masks[key] = np.asarray(RULES[i].when(self.c, params), dtype=bool)
+        return m
+
+    def _period_means(self, buy, avoid):
+        """每期買進與避開兩組的平均報酬 (該期沒有樣本為 NaN)；兩組以一次 bincount 一起加總"""
+        labels = self._labels + (2 - 2 * buy.view(np.int8) - avoid.view(np.int8))
+        n = np.bincount(labels, minlength=3 * self.periods).reshape(-1, 3)
+        s = np.bincount(labels, weights=self.ret, minlength=3 * self.periods).reshape(-1, 3)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s / n
+        return mean[:, 0], mean[:, 1]
+
+    def score(self, cfg):
+        """組合 -> 每列總分"""
+        params = {**PARAMS, **{k: v for k, v in cfg.items() if k in PARAMS}}
+        weights = {k: v for k, v in cfg.items() if k not in PARAMS}
+        return total_score([self._mask(i, params) for i in range(len(RULES))], weights)
+
+    def __call__(self, cfg):
+        total = self.score(cfg)
+        buy, avoid = total >= BUY_FLOOR, total < AVOID_FLOOR
+        mb, ma = self._period_means(buy, avoid)
+        both = ~np.isnan(mb) & ~np.isnan(ma)
+        has_buy = ~np.isnan(mb)
+        return {
+            **cfg,
+            'spread': (mb - ma)[both].mean() if both.any() else np.nan,
+            'excess': (mb - self.market)[has_buy].mean() if has_buy.any() else np.nan,
+            'hit_rate': (self.ret[buy] > 0).mean() if buy.any() else np.nan,
+            'buy': int(buy.sum()), 'avoid': int(avoid.sum()), 'periods': int(both.sum()),
+        }
+
+
+# ========================================================
+# 4. 程序池掃描
+# ========================================================
+_evaluator = None
+
+def _init_process(path, ret):
+    """每個程序只載入一次評分輸入"""
+    global _evaluator
+    _evaluator = Evaluator(pd.read_parquet(path), ret)
+
+def _evaluate_chunk(chunk):
+    return [_evaluator(cfg) for cfg in chunk]
+
+def rank(results, min_signals=OPTIMIZER_MIN_SIGNALS):
+    """依價差、勝率由高到低排序；買進訊號不足 min_signals 的組合排在最後"""
+    enough = results['buy'] >= min_signals
+    return (results.assign(_enough=enough)
+            .sort_values(['_enough', 'spread', 'hit_rate'], ascending=False, na_position='last')
+            .drop(columns='_enough').reset_index(drop=True))
+
+def sweep(path, space=OPTIMIZER_SPACE, samples=OPTIMIZER_SAMPLES, ret='fwd_period', seed=0,
+          workers=OPTIMIZER_WORKERS, chunk=OPTIMIZER_CHUNK):
+    """
+    build_inputs 的輸入檔 -> 各組合的績效 (已排序，default 欄標記現行設定)。
+    使用 spawn 程序池 (與 pipeline.process_pool 相同理由)；只有一個任務時在本程序評估。
+    """
+    cfgs = configs(space, samples, seed)
+    chunks = [cfgs[i:i + chunk] for i in range(0, len(cfgs), chunk)]
+    if workers <= 1 or len(chunks) == 1:
+        _init_process(path, ret)
+        rows = [row for part in map(_evaluate_chunk, chunks) for row in part]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_process, initargs=(path, ret)) as pool:
+            rows = [row for part in pool.map(_evaluate_chunk, chunks) for row in part]
+    results = pd.DataFrame(rows)
+    results['default'] = np.arange(len(results)) == 0
+    return rank(results)
+
+
+if __name__ == "__main__":
+    import argparse
+    from .screener import Screener
+    from .data_loader import DataEngine
+    parser = argparse.ArgumentParser(description="評分卡門檻 / 分數參數掃描")
+    parser.add_argument("--stocks", nargs="*", help="股票代號 (預設為全市場)")
+    parser.add_argument("--freq", default="M", choices=["M", "W"])
+    parser.add_argument("--ret", default="fwd_period", choices=["fwd_period", "fwd_21d", "fwd_63d"])
+    parser.add_argument("--samples", type=int, default=OPTIMIZER_SAMPLES, help="0 為完整網格")
+    parser.add_argument("--workers", type=int, default=OPTIMIZER_WORKERS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="optimizer.csv")
+    args = parser.parse_args()
+
+    screener = Screener(DataEngine(token=os.environ.get("FINMIND_TOKEN")))
+    stocks = args.stocks or screener.engine.get_stock_universe()['stock_id'].tolist()
+    path = build_inputs(screener.load(stocks), freq=args.freq)
+    results = sweep(path, samples=args.samples or None, ret=args.ret, seed=args.seed, workers=args.workers)
+    results.to_csv(args.out, index=False, encoding="utf-8-sig")
+    print(results.head(20).to_string())
+    print("\n現行設定:")
+    print(results[results['default']].to_string())
@@ -0,0 +1,165 @@
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .config import DATASETS, INFO_KEYS, COMPARE_WORKERS
+from .data_loader import DataEngine
+from .metrics import MetricCalculator
+from .strategy import generate_signals
+from .store import get_store
+from . import prices, technicals
+from .prices import clean_id, PRICE_DATASET
+from .telemetry import span
+
+RESULT_KIND = 'scorecard'
+# 存入結果庫的欄位 (股價由 prices 存在本地資料庫；籌碼/融資原始資料只在即時分析時保留)
+SNAPSHOT_FIELDS = ['versions', 'f_score', 'f_details', 'z_score', 'z_msg', 'mom', 'yoy', 'guru_metrics',
+                   'chip_metrics', 'margin_metrics', 'technical', 'total_score', 'action', 'color', 'reasons']
+# 比較表欄位 (名稱與 Screener 評分卡一致): 結果鍵 -> 指標名稱
+COMPARE_FIELDS = {'guru_metrics': ['Lynch Category', 'Lynch PEG', 'Magic ROC', 'Magic EY'],
+                  'chip_metrics': ['Foreign Net (3d)', 'Foreign Consecutive', 'Trust Net (10d)', 'Trust Active Buy'],
+                  'margin_metrics': ['Latest Balance', 'Change']}
+
+
+def info_subset(info):
+    """Yahoo 基本資料中評分用到的欄位 (存入快照、判斷是否變動)"""
+    return {k: v for k in INFO_KEYS if (v := (info or {}).get(k)) is not None}
+
+
+# ========================================================
+# 1. 單一股票完整流程 (main.py 與背景預熱共用)
+# ========================================================
+# 計算步驟 -> (MetricCalculator 方法, 結果欄位)
+STEPS = {
+    'f_score': ('calculate_f_score', ['f_score', 'f_details']),
+    'z_score': ('calculate_z_score', ['z_score', 'z_msg']),
+    'revenue_growth': ('calculate_revenue_growth', ['mom', 'yoy']),
+    'guru_metrics': ('calculate_guru_metrics', ['guru_metrics']),
+    'chip_metrics': ('calculate_chip_metrics', ['chip_metrics']),
+    'margin_metrics': ('calculate_margin_metrics', ['margin_metrics']),
+}
+# 各步驟依賴的輸入: 資料集鍵 (config.DATASETS)、'PRICE' (Yahoo 日線) 或 'info.<欄位>' (讀取的 Yahoo 基本資料欄位)
+# lynch 只更新 guru_metrics 中的林區分類 / PEG (月營收、股利、現價 / 本益比更新時不必重算整組大師指標)
+# technical 由日線算出 (technicals.for_stock)，不經 MetricCalculator；signals 只重算總分 (評分讀取的現價與均量)
+STEP_INPUTS = {
+    'f_score': {'BALANCE_SHEET', 'INCOME_STATEMENT', 'CASH_FLOW'},
+    'z_score': {'BALANCE_SHEET', 'INCOME_STATEMENT', 'info.marketCap', 'info.sector'},
+    'revenue_growth': {'REVENUE'},
+    'guru_metrics': {'BALANCE_SHEET', 'INCOME_STATEMENT', 'info.marketCap'},
+    'lynch': {'REVENUE', 'DIVIDEND', 'info.marketCap', 'info.currentPrice', 'info.trailingPE'},
+    'chip_metrics': {'INSTITUTIONAL', 'info.marketCap'},
+    'margin_metrics': {'MARGIN'},
+    'technical': {'PRICE'},
+    'signals': {'info.currentPrice', 'info.regularMarketPreviousClose', 'info.averageVolume'},
+}
+
+def input_versions(stock_id):
+    """各 FinMind 資料集與 Yahoo 日線在本地資料庫的內容變動時間 (changed_at)"""
+    store = get_store()
+    sources = {**DATASETS, 'PRICE': PRICE_DATASET}
+    return {key: (store.status(name, stock_id) or {}).get('changed_at') for key, name in sources.items()}
+
+def _fetch(engine, stock_id):
+    with span('pipeline', 'get_all_data'):
+        (price_df, info), frames = engine.get_all_data(stock_id)
+    sid = clean_id(stock_id)
+    res = {'stock_id': sid, 'computed_at': time.time(), 'versions': input_versions(sid),
+           'price_df': price_df, 'info': info, 'chip': frames[5], 'margin': frames[6]}
+    return res, frames
+
+def _compute(res, frames, steps):
+    """執行指定步驟並重算總分 (財報寬表只在用到時才轉置)"""
+    calculator = MetricCalculator(*frames, res['info'])
+    for step in steps:
+        if step not in STEPS: continue
+        method, fields = STEPS[step]
+        with span('metrics', method): out = getattr(calculator, method)()
+        res.update(zip(fields, out if len(fields) > 1 else (out,)))
+    if 'lynch' in steps and 'guru_metrics' not in steps and res['guru_metrics']:
+        with span('metrics', 'calculate_lynch_metrics'):
+            res['guru_metrics'] = {**res['guru_metrics'], **calculator.calculate_lynch_metrics()}
+    if 'technical' in steps:
+        with span('metrics', 'technicals'): res['technical'] = technicals.for_stock(res['price_df'])
+
+    with span('strategy', 'generate_signals'): return score(res)
+
+def score(res):
+    """依 res 中已算好的指標重算總分、動作與評分依據 (盤中監控換上新報價 / 籌碼後也用這個)"""
+    res['total_score'], res['action'], res['color'], res['reasons'] = generate_signals(
+        res['f_score'], res['z_score'], res['info'], res['mom'], res['yoy'],
+        res['guru_metrics'], res['chip_metrics'], res['margin_metrics'], res.get('technical'))
+    return res
+
+def analyze(engine, stock_id):
+    """抓取 -> 指標 -> 評分卡，回傳 UI 需要的所有欄位 (dict)"""
+    res, frames = _fetch(engine, stock_id)
+    res['recomputed'] = [*STEPS, 'technical']
+    return _compute(res, frames, res['recomputed'])
+
+def update(engine, stock_id):
+    """
+    增量更新: 與上次快照比對各輸入 (Yahoo 基本資料逐欄比對)，只重算受影響的步驟
+    (例如只有月營收更新時: 營收動能、林區分類 / PEG 與總分；只有均量變動時只重算總分)。沒有快照時等同 analyze。
+    """
+    prev = load_snapshot(stock_id)
+    if prev is None or 'versions' not in prev: return analyze(engine, stock_id)
+
+    res, frames = _fetch(engine, stock_id)
+    changed = {k for k, v in res['versions'].items() if prev['versions'].get(k) != v}
+    info, prev_info = info_subset(res['info']), prev['info']
+    changed |= {f'info.{k}' for k in INFO_KEYS if info.get(k) != prev_info.get(k)}
+    steps = [step for step, inputs in STEP_INPUTS.items() if inputs & changed]
+
+    res = {**prev, **res, 'recomputed': steps}
+    if not steps: return res
+    return _compute(res, frames, steps)
+
+
+# ========================================================
+# 2. 結果快照 (本地資料庫: 評分卡存 SQLite，股價讀 prices 的本地日線)
+# ========================================================
+def save_snapshot(res):
+    payload = {k: res[k] for k in SNAPSHOT_FIELDS}
+    payload['info'] = info_subset(res['info'])
+    get_store().save_result(RESULT_KIND, res['stock_id'], payload)
+
+def load_snapshot(stock_id, fresh_after=0):
+    """
+    讀取已存的分析結果 (與 analyze 同格式，chip / margin 為 None)。
+    計算時間早於 fresh_after (之後有新資料公布) 或沒有結果時回傳 None。
+    """
+    sid = clean_id(stock_id)
+    row = get_store().load_result(RESULT_KIND, sid)
+    if row is None or row[0] < fresh_after: return None
+    computed_at, res = row
+    res.update(stock_id=sid, computed_at=computed_at, chip=None, margin=None, price_df=prices.read(sid))
+    return res
+
+
+# ========================================================
+# 3. 多檔比較 (程序池: 指標計算為 CPU 密集，分散到多核心)
+# ========================================================
+def summary_row(res):
+    """分析結果 -> 比較表的一列 (只含純量，程序間傳輸量小)"""
+    row = {'stock_id': res['stock_id'], 'Score': res['total_score'], 'Action': res['action'],
+           'F-Score': res['f_score'], 'Z-Score': res['z_score'], 'MoM': res['mom'], 'YoY': res['yoy']}
+    for key, names in COMPARE_FIELDS.items():
+        row.update({n: res[key].get(n) for n in names})
+    row['computed_at'] = res['computed_at']
+    return row
+
+def analyze_row(stock_id, token=None, fresh_after=None):
+    """程序池的工作: 有新鮮快照就直接用，否則增量更新並寫回快照 (fresh_after=None 時完整重算)"""
+    res = load_snapshot(stock_id, fresh_after) if fresh_after is not None else None
+    if res is None:
+        engine = DataEngine(token=token)
+        res = analyze(engine, stock_id) if fresh_after is None else update(engine, stock_id)
+        save_snapshot(res)
+    return summary_row(res)
+
+def process_pool(workers=COMPARE_WORKERS):
+    """
+    比較用的程序池。使用 spawn: Streamlit 伺服器本身是多執行緒，fork 可能複製到被鎖住的鎖。
+    子程序共用本地資料庫 (Parquet / SQLite)，先完成的股票可讓其他程序直接讀取；
+    FinMind 額度與 Streamlit 及其他程序共用同一個排程器狀態 (scheduler.sqlite)，不必另外分配。
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
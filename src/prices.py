@@ -0,0 +1,207 @@
+"""
+Yahoo 日線與基本資料:
+多檔合併成一次 yf.download、交易所後綴 (.TW 上市 / .TWO 上櫃) 解析一次後存入本地資料庫，
+本地日線只追加最後日期之後的新 K 棒 (除權息造成還原價變動時整段重抓)。
+"""
+import time
+import pandas as pd
+import yfinance as yf
+from .config import PRICE_HISTORY, PRICE_TTL, PRICE_INFO_TTL, PRICE_BATCH, INFO_KEYS, HTTP_TIMEOUT
+from .store import get_store
+from . import telemetry, singleflight, health
+from .telemetry import annotate
+
+PRICE_DATASET = 'YahooPrice'
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+SUFFIXES = {'twse': '.TW', 'tpex': '.TWO'}   # FinMind TaiwanStockInfo 的 type -> Yahoo 後綴
+TZ = 'Asia/Taipei'
+
+
+def clean_id(stock_id):
+    """'2330.TW' / '6488.TWO' -> '2330' / '6488'"""
+    return stock_id.strip().upper().removesuffix('.TWO').removesuffix('.TW')
+
+
+# ========================================================
+# 1. 多檔下載
+# ========================================================
+def _download(symbols, **kwargs):
+    """
+    yf.download 多檔 (每批 PRICE_BATCH 檔) -> {symbol: 日線 (COLUMNS，台北時區)}；沒有資料的代號不在結果中。
+    Yahoo 斷路中 (src/health.py) 拋出 health.Unavailable；整批都沒有資料視為上游故障。
+    """
+    breaker = health.breaker('yahoo')
+    out = {}
+    for i in range(0, len(symbols), PRICE_BATCH):
+        batch = symbols[i:i + PRICE_BATCH]
+        if not breaker.allow(): raise health.Unavailable(f"Yahoo: {breaker.state()}")
+        try:
+            raw = yf.download(batch, group_by='ticker', actions=True, auto_adjust=True, progress=False,
+                              threads=True, timeout=HTTP_TIMEOUT, **kwargs)
+        except Exception as e:
+            telemetry.error(f"yahoo.download({len(batch)})", e)
+            breaker.failure()
+            continue
+        if raw is None or raw.empty:
+            breaker.failure()
+            continue
+        n = len(out)
+        for sym in batch:
+            if sym not in raw.columns.get_level_values(0): continue
+            df = raw[sym].dropna(subset=['Close'])
+            if df.empty: continue
+            idx = pd.DatetimeIndex(df.index)
+            idx = idx.tz_localize(TZ) if idx.tz is None else idx.tz_convert(TZ)
+            df = df.set_axis(idx.rename('Date')).reindex(columns=COLUMNS)
+            out[sym] = df.fillna({'Dividends': 0.0, 'Stock Splits': 0.0})
+        if len(out) > n: breaker.success()
+        else: breaker.failure()
+    return out
+
+def resolve_symbols(stock_ids, exchanges=None):
+    """
+    stock_id -> Yahoo 代號。依序使用: 本地資料庫、exchanges ({stock_id: 'twse' / 'tpex'})、
+    最後才對未知代號一次下載 .TW 與 .TWO 的近 5 日試探。解析結果存回本地資料庫。
+    """
+    store = get_store()
+    known = store.symbols()
+    found = {}
+    for sid in stock_ids:
+        if sid in known: continue
+        suffix = SUFFIXES.get((exchanges or {}).get(sid))
+        if suffix: found[sid] = sid + suffix
+    unknown = [sid for sid in stock_ids if sid not in known and sid not in found]
+    if unknown:
+        data = _download([sid + s for sid in unknown for s in ('.TW', '.TWO')], period='5d')
+        for sid in unknown:
+            sym = next((sid + s for s in ('.TW', '.TWO') if sid + s in data), None)
+            if sym: found[sid] = sym
+    if found: store.set_symbols(found)
+    # 查不到的 (停牌、新上市) 先當上市，不寫入以便下次再試
+    return {sid: known.get(sid) or found.get(sid) or sid + '.TW' for sid in stock_ids}
+
+
+# ========================================================
+# 2. 本地日線增量更新
+# ========================================================
+def _rebased(old, new):
+    """還原價是否整段變動: 重疊日的收盤價不同，或新 K 棒有除權息 / 分割"""
+    if new[['Dividends', 'Stock Splits']].to_numpy().any(): return True
+    overlap = old.index.intersection(new.index)
+    if overlap.empty: return False
+    a, b = old.loc[overlap, 'Close'], new.loc[overlap, 'Close']
+    return bool(((a - b).abs() > 1e-6 * a.abs().clip(lower=1)).any())
+
+def _to_store(df):
+    return df.rename_axis('date').reset_index()
+
+def read(stock_id):
+    """本地日線 (index=Date，台北時區)"""
+    df = get_store().read(PRICE_DATASET, clean_id(stock_id))
+    if df.empty: return pd.DataFrame(columns=COLUMNS)
+    return df.set_index('date').rename_axis('Date')
+
+def refresh(stock_ids, ttl=PRICE_TTL, exchanges=None):
+    """
+    更新多檔日線: ttl 內更新過的略過；沒有歷史的抓 PRICE_HISTORY，
+    其餘依最後日期分組，每組一次多檔下載 (重抓最後一天以偵測還原價變動)。回傳實際下載的檔數。
+    同一檔同時只有一個呼叫端下載 (singleflight)，其餘等待後沿用。
+    Yahoo 斷路中沿用本地日線 (不更新索引，恢復後照常增量)。
+    """
+    store = get_store()
+    ids = list(dict.fromkeys(map(clean_id, stock_ids)))
+    status = {sid: store.status(PRICE_DATASET, sid) for sid in ids}
+    stale = [sid for sid in ids if not status[sid] or time.time() - status[sid]['updated_at'] >= ttl]
+    if not stale: return 0
+    since_wait = time.time()
+    with singleflight.hold(*[(PRICE_DATASET, sid) for sid in stale], root=store.root):
+        try:
+            return _refresh(store, stale, exchanges, since_wait)
+        except health.Unavailable:
+            annotate(cache='stale'); health.served_stale()
+            return 0
+
+def _refresh(store, stale, exchanges, since_wait):
+    # 等待鎖期間其他呼叫端 (含其他程序) 已更新的檔不再下載
+    status = {sid: store.status(PRICE_DATASET, sid) for sid in stale}
+    stale = [sid for sid in stale if not status[sid] or status[sid]['updated_at'] < since_wait]
+    if not stale:
+        annotate(cache='shared')
+        return 0
+    annotate(cache='api')
+
+    symbols = resolve_symbols(stale, exchanges)
+    groups = {}
+    for sid in stale:
+        last = status[sid] and status[sid]['last_date']
+        groups.setdefault(str(pd.Timestamp(last).date()) if last else None, []).append(sid)
+
+    rebase = []
+    for start, sids in groups.items():
+        kwargs = {'start': start} if start else {'period': PRICE_HISTORY}
+        data = _download([symbols[s] for s in sids], **kwargs)
+        for sid in sids:
+            new = data.get(symbols[sid])
+            if new is not None and start and _rebased(read(sid), new):
+                rebase.append(sid); continue
+            # 沒有新資料也寫入索引 (更新 updated_at)，ttl 內不再重試
+            store.merge(PRICE_DATASET, sid, _to_store(new) if new is not None else None)
+
+    if rebase:
+        data = _download([symbols[s] for s in rebase], period=PRICE_HISTORY)
+        for sid in rebase:
+            new = data.get(symbols[sid])
+            if new is not None: store.merge(PRICE_DATASET, sid, _to_store(new), replace=True)
+    return len(stale)
+
+
+def latest_bars(stock_ids, exchanges=None):
+    """
+    多檔最近一個交易日的 K 棒 (盤中為至今的累計，Yahoo 台股報價延遲約 20 分鐘) -> {stock_id: 單列日線}。
+    全部代號合併下載 (每 PRICE_BATCH 檔一個請求)；盤中 K 棒尚未定案，不寫入本地日線。
+    """
+    ids = list(dict.fromkeys(map(clean_id, stock_ids)))
+    symbols = resolve_symbols(ids, exchanges)
+    data = _download([symbols[sid] for sid in ids], period='1d')
+    return {sid: data[symbols[sid]].iloc[-1:] for sid in ids if symbols[sid] in data}
+
+
+# ========================================================
+# 3. 基本資料 (.info 無多檔 API: 每檔每天最多一次)
+# ========================================================
+def get_info(stock_id, ttl=PRICE_INFO_TTL):
+    """評分用到的 Yahoo 基本資料 (INFO_KEYS)；快取 ttl 秒"""
+    store = get_store()
+    sid = clean_id(stock_id)
+    cached = store.load_result('yahoo_info', sid)
+    if cached and time.time() - cached[0] < ttl: return cached[1]
+    since_wait = time.time()
+    with singleflight.hold(('yahoo_info', sid), root=store.root):
+        cached = store.load_result('yahoo_info', sid)
+        if cached and cached[0] >= since_wait: return cached[1]  # 等待期間已有人抓好
+        breaker = health.breaker('yahoo')
+        try:
+            symbol = resolve_symbols([sid])[sid]
+            if not breaker.allow(): raise health.Unavailable(f"Yahoo: {breaker.state()}")
+            info = yf.Ticker(symbol).info or {}
+        except health.Unavailable:   # Yahoo 斷路中: 沿用舊資料
+            annotate(cache='stale'); health.served_stale()
+            return cached[1] if cached else {}
+        except Exception as e:
+            telemetry.error(f"yahoo.info({sid})", e)
+            breaker.failure()
+            return cached[1] if cached else {}
+        breaker.success()
+        info = {k: info[k] for k in INFO_KEYS if info.get(k) is not None}
+        store.save_result('yahoo_info', sid, info)
+        return info
+
+def load(stock_id):
+    """單檔 (日線, 基本資料)；現價以最新 K 棒為準"""
+    refresh([stock_id])
+    df = read(stock_id)
+    info = dict(get_info(stock_id))
+    if len(df):
+        info['currentPrice'] = float(df['Close'].iloc[-1])
+        if len(df) > 1: info['regularMarketPreviousClose'] = float(df['Close'].iloc[-2])
+    return df, info
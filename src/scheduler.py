@@ -0,0 +1,198 @@
+import os
+import time
+import heapq
+import random
+import sqlite3
+import hashlib
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager, closing
+from functools import lru_cache
+import requests
+from . import telemetry
+from .config import (FINMIND_QUOTA, QUOTA_BURST, HTTP_TIMEOUT, FINMIND_USER_INFO_URL, STORE_DIR, SCHEDULER_POLL,
+                     PRIORITY_HOLD)
+
+# 優先順序 (數字小者先): 介面上的即時分析 > 背景批次更新
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = contextvars.ContextVar('finmind_priority', default=INTERACTIVE)
+
+@contextmanager
+def use_priority(priority):
+    """在此區塊內 (含 copy_context 帶入的執行緒) 發出的 FinMind 請求使用指定優先順序"""
+    token = _priority.set(priority)
+    try: yield
+    finally: _priority.reset(token)
+
+def current_priority():
+    return _priority.get()
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """指數退避 + 全抖動 (full jitter)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RequestScheduler:
+    """
+    FinMind 請求排程器 (每個 token 一個)。令牌桶、暫停時間與近一小時請求紀錄存在本地資料庫旁的
+    SQLite (scheduler.sqlite)，同一台主機上的 Streamlit、背景預熱、盤中監控與程序池共用同一份額度。
+    - 令牌桶: 每小時額度的 (1 - QUOTA_BURST) 平均補充，QUOTA_BURST 作為突發容量，
+      所有程序合計在任一小時內的請求數不會超過額度。
+    - 優先佇列: 程序內等待中的請求依 (優先順序, 到達順序) 取得令牌；
+      跨程序時，有互動請求在等待 (PRIORITY_HOLD 秒內) 的期間背景請求不取令牌。
+    - 402/429 時呼叫 penalize() 暫停所有程序的請求；quota() 回報剩餘額度。
+    """
+    def __init__(self, per_hour, key='anonymous', root=STORE_DIR):
+        self.key = key
+        self._path = os.path.join(root, 'scheduler.sqlite')
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._local = threading.local()
+        os.makedirs(root, exist_ok=True)
+        with closing(sqlite3.connect(self._path, timeout=30)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")   # 每次取令牌都要寫入: 避免讀寫互鎖
+        with self._transaction() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS bucket (
+                key TEXT PRIMARY KEY, lim INTEGER, tokens REAL, stamp REAL, paused_until REAL, interactive_at REAL)""")
+            db.execute("CREATE TABLE IF NOT EXISTS requests (key TEXT, at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS requests_key_at ON requests (key, at)")
+            # 其他程序已建立的桶沿用 (令牌與紀錄不重置)
+            db.execute("INSERT OR IGNORE INTO bucket VALUES (?, ?, ?, ?, 0, 0)",
+                       (key, int(per_hour), _shape(per_hour)[0], time.time()))
+        self.set_limit(per_hour)
+
+    @contextmanager
+    def _transaction(self):
+        """跨程序互斥的讀改寫 (BEGIN IMMEDIATE 取得寫鎖)；每個執行緒重用一條連線"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=OFF")   # 短暫狀態，不需落盤保證
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _bucket(self, db, now):
+        """讀取並補充令牌 -> (額度, 令牌, 暫停至, 互動請求最近等待時間)"""
+        lim, tokens, stamp, paused, urgent = db.execute(
+            "SELECT lim, tokens, stamp, paused_until, interactive_at FROM bucket WHERE key=?", (self.key,)).fetchone()
+        capacity, rate = _shape(lim)
+        return lim, min(capacity, tokens + max(0.0, now - stamp) * rate), paused, urgent
+
+    def set_limit(self, per_hour):
+        with self._transaction() as db:
+            now = time.time()
+            _, tokens, _, _ = self._bucket(db, now)
+            db.execute("UPDATE bucket SET lim=?, tokens=?, stamp=? WHERE key=?",
+                       (int(per_hour), min(tokens, _shape(per_hour)[0]), now, self.key))
+        with self._cond: self._cond.notify_all()
+
+    @property
+    def limit(self):
+        with self._transaction() as db:
+            return self._bucket(db, time.time())[0]
+
+    def _take(self, priority):
+        """向共用令牌桶取一枚 -> 0 (已取得) 或建議等待的秒數"""
+        now = time.time()
+        with self._transaction() as db:
+            lim, tokens, paused, urgent = self._bucket(db, now)
+            if now < paused: wait = paused - now
+            elif tokens < 1: wait = (1 - tokens) / _shape(lim)[1]
+            elif priority > INTERACTIVE and now - urgent < PRIORITY_HOLD: wait = PRIORITY_HOLD - (now - urgent)
+            else: wait = 0.0
+            if wait == 0:
+                tokens -= 1
+                db.execute("INSERT INTO requests VALUES (?, ?)", (self.key, now))
+                db.execute("DELETE FROM requests WHERE key=? AND at < ?", (self.key, now - 3600))
+            elif priority == INTERACTIVE:
+                urgent = now   # 互動請求在等: 其他程序的背景請求先讓路
+            db.execute("UPDATE bucket SET tokens=?, stamp=?, interactive_at=? WHERE key=?", (tokens, now, urgent, self.key))
+            return wait
+
+    def acquire(self, priority=None, timeout=None):
+        """取得一次請求的額度；逾時回傳 False"""
+        priority = current_priority() if priority is None else priority
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait = self._take(priority) if self._waiters[0] == ticket else SCHEDULER_POLL
+                    if wait == 0:
+                        heapq.heappop(self._waiters)
+                        self._cond.notify_all()
+                        return True
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        self._waiters.remove(ticket); heapq.heapify(self._waiters)
+                        self._cond.notify_all()
+                        return False
+                    if deadline is not None: wait = min(wait, deadline - now)
+                    # 其他程序也在取令牌 / 暫停: 最多等 SCHEDULER_POLL 秒就重新檢查共用狀態
+                    self._cond.wait(min(max(wait, 0.001), SCHEDULER_POLL))
+            except BaseException:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket); heapq.heapify(self._waiters)
+                raise
+
+    def penalize(self, delay):
+        """伺服器回報超量 (402/429): 所有程序的請求暫停 delay 秒 (令牌照常累積，恢復後不必再等補充)"""
+        with self._transaction() as db:
+            db.execute("UPDATE bucket SET paused_until=MAX(paused_until, ?) WHERE key=?", (time.time() + delay, self.key))
+        with self._cond: self._cond.notify_all()
+
+    def sync_usage(self, used, limit=None):
+        """以伺服器回報的已用次數 (含其他程序) 校正共用估計"""
+        now = time.time()
+        with self._transaction() as db:
+            lim, tokens, _, _ = self._bucket(db, now)
+            if limit: lim = int(limit)
+            db.execute("DELETE FROM requests WHERE key=?", (self.key,))
+            db.executemany("INSERT INTO requests VALUES (?, ?)", [(self.key, now)] * int(used))
+            db.execute("UPDATE bucket SET lim=?, tokens=?, stamp=? WHERE key=?",
+                       (lim, min(tokens, max(0.0, lim - used)), now, self.key))
+
+    def quota(self):
+        """{'limit', 'used', 'remaining', 'waiting'} (近一小時，所有程序合計的本地估計；waiting 為本程序)"""
+        now = time.time()
+        with self._transaction() as db:
+            lim = self._bucket(db, now)[0]
+            used = db.execute("SELECT COUNT(*) FROM requests WHERE key=? AND at > ?", (self.key, now - 3600)).fetchone()[0]
+        with self._cond: waiting = len(self._waiters)
+        return {'limit': lim, 'used': used, 'remaining': max(0, lim - used), 'waiting': waiting}
+
+
+def _shape(per_hour):
+    """每小時額度 -> (突發容量, 每秒補充數)"""
+    return max(1.0, per_hour * QUOTA_BURST), max(1e-6, per_hour * (1 - QUOTA_BURST) / 3600.0)
+
+def fetch_user_info(token):
+    """FinMind 帳號狀態: user_count (本小時已用) 與 api_request_limit (每小時額度)"""
+    try:
+        r = requests.get(FINMIND_USER_INFO_URL,
+                         headers={"Authorization": f"Bearer {token}"}, timeout=HTTP_TIMEOUT)
+        if r.status_code == 200: return r.json()
+    except Exception as e:
+        telemetry.error("scheduler.user_info", e)
+    return {}
+
+@lru_cache(maxsize=8)
+def get_scheduler(token=None, root=STORE_DIR):
+    """每個 token 共用一個排程器 (跨程序共用狀態，以 token 雜湊為鍵)；額度依帳號等級 (查不到時用預設值)"""
+    token = str(token).strip() if token else ""
+    if not token: return RequestScheduler(FINMIND_QUOTA['anonymous'], root=root)
+    info = fetch_user_info(token)
+    key = hashlib.sha256(token.encode()).hexdigest()[:16]
+    sched = RequestScheduler(info.get('api_request_limit') or FINMIND_QUOTA['registered'], key=key, root=root)
+    if info.get('user_count'): sched.sync_usage(info['user_count'])
+    return sched
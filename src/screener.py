@@ -0,0 +1,360 @@
+import os
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .config import MAPPING, INFO_KEYS, STATEMENT_YOY_DAYS, REVENUE_YOY_DAYS
+from .metrics import to_canonical, f_score_components, z_score_components, F_COMPONENTS
+from .flows import chip_flows, margin_flows, latest
+from .data_loader import DataEngine
+from .scheduler import use_priority, BACKGROUND
+from .strategy import score_frame
+from . import prices, bulk, technicals, telemetry
+
+FRAME_NAMES = ['bs', 'inc', 'cf', 'rev', 'div', 'chip', 'margin']
+
+GURU_KEYS = ['Graham Number', 'NCAV', 'Lynch Category', 'Lynch PEG', 'Magic ROC', 'Magic EY', 'Avg EPS', 'Current Ratio']
+CHIP_KEYS = ["Foreign Net (3d)", "Foreign Consecutive", "Trust Net (10d)", "Trust Active Buy", "Is Small Cap"]
+MARGIN_KEYS = ["Margin Increasing", "Latest Balance", "Change"]
+
+
+# ========================================================
+# 0. 面板工具 (Panel Helpers)
+# ========================================================
+def statement_panel(long_df):
+    """
+    長表 (stock_id/date/type/value) 或已轉好的標準欄位寬表 (stock_id/date/ASSETS...)
+    -> 以 (stock_id, date) 為索引的標準欄位面板，日期由新到舊
+    """
+    if long_df.empty: return pd.DataFrame(columns=list(MAPPING), index=pd.MultiIndex.from_arrays([[], []], names=['stock_id', 'date']))
+    if 'type' not in long_df.columns:
+        wide = long_df.set_index(['stock_id', 'date'])[list(MAPPING)].astype(float)
+        return wide.sort_index(level=[0, 1], ascending=[True, False])
+    wide = long_df.pivot_table(index=['stock_id', 'date'], columns='type', values='value')
+    wide.index = wide.index.set_levels(pd.to_datetime(wide.index.levels[1]), level=1)
+    return to_canonical(wide).sort_index(level=[0, 1], ascending=[True, False])
+
+def price_matrix(price_dfs, field):
+    """{stock_id: Yahoo 日線} -> 日期 × 股票 的矩陣 (去除時區)"""
+    cols = {}
+    for sid, df in price_dfs.items():
+        if df is None or df.empty or field not in df.columns: continue
+        s = df[field].copy()
+        s.index = pd.DatetimeIndex(s.index).tz_localize(None).normalize()
+        cols[sid] = s[~s.index.duplicated(keep='last')]
+    return pd.DataFrame(cols).sort_index() if cols else pd.DataFrame()
+
+def _latest(panel, n=1):
+    """每檔股票最新的 n 筆"""
+    return panel.groupby(level=0, sort=False).head(n)
+
+def _rows_at(panel, stock_dates):
+    """取出指定 (stock_id, date) 的列；不存在的列為 NaN"""
+    idx = pd.MultiIndex.from_arrays([stock_dates.index, stock_dates.values], names=['stock_id', 'date'])
+    out = panel.reindex(idx)
+    out.index = stock_dates.index
+    return out
+
+def _asof_dates(panel, targets, days):
+    """在 targets ± days 範圍內找每檔最接近且最新的日期 (等同 _get_prev_value 的寬容度搜尋)"""
+    targets = targets.dropna()
+    if targets.empty or panel.empty: return pd.Series(pd.NaT, index=targets.index, dtype='datetime64[ns]')
+    left = pd.DataFrame({'stock_id': targets.index, 'key': (targets + pd.Timedelta(days=days)).values}).sort_values('key')
+    right = panel.index.to_frame(index=False).sort_values('date')
+    m = pd.merge_asof(left, right, left_on='key', right_on='date', by='stock_id',
+                      direction='backward', tolerance=pd.Timedelta(days=2 * days))
+    return m.set_index('stock_id')['date'].reindex(targets.index)
+
+def _prior_year(panel, curr_dates, days=STATEMENT_YOY_DAYS):
+    """去年同期數值 (YoY)；找不到時為 NaN"""
+    targets = curr_dates - pd.DateOffset(years=1)
+    return _rows_at(panel, _asof_dates(panel, targets, days))
+
+
+# ========================================================
+# 1. 全市場篩選引擎 (Market-wide Screener)
+# ========================================================
+class Screener:
+    """
+    以截面面板 (cross-sectional panel) 一次計算全市場的 F-Score、Z-Score、
+    大師指標、營收動能、籌碼與評分卡，邏輯與 MetricCalculator 一致。
+    """
+    def __init__(self, engine=None, max_workers=None, priority=BACKGROUND):
+        self.engine = engine or DataEngine()
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 4) * 4)
+        self.priority = priority  # 批次下載預設讓位給介面上的即時請求
+
+    # --- A. 批次下載 (I/O 密集 -> 執行緒池) ---
+    def _fetch_one(self, stock_id):
+        try:
+            with use_priority(self.priority):
+                (price_df, info), frames = self.engine.get_all_data(stock_id)
+            return stock_id, frames, info or {}, price_df
+        except Exception as e:
+            telemetry.error(f"screener.fetch({stock_id})", e)
+            return stock_id, tuple(pd.DataFrame() for _ in FRAME_NAMES), {}, pd.DataFrame()
+
+    def load(self, stock_ids, exchanges=None):
+        """
+        下載所有股票並合併為長表面板: {'bs': df, ..., 'info': df, 'close' / 'high' / 'low' / 'volume': 日期×股票,
+        'technical': 最新技術指標 (technicals 矩陣)}。
+        日線先以多檔批次更新 (exchanges: {stock_id: 'twse' / 'tpex'} 可省去代號試探)、籌碼 / 融資以全市場逐日下載，
+        之後逐檔只讀本地資料。
+        """
+        prices.refresh(stock_ids, exchanges=exchanges)
+        technicals.update(stock_ids)
+        with use_priority(self.priority):
+            bulk.refresh(stock_ids, token=self.engine.token)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self._fetch_one, stock_ids))
+
+        panels = {}
+        for i, name in enumerate(FRAME_NAMES):
+            parts = []
+            for sid, frames, _, _ in results:
+                df = frames[i]
+                if df is None or df.empty: continue
+                if isinstance(df.index, pd.DatetimeIndex): df = df.rename_axis('date').reset_index()  # 財報寬表
+                parts.append(df.assign(stock_id=sid))
+            panels[name] = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+        info = pd.DataFrame([{'stock_id': sid, **{k: info.get(k) for k in INFO_KEYS}} for sid, _, info, _ in results])
+        panels['info'] = info.set_index('stock_id')
+        price_dfs = {sid: price_df for sid, _, _, price_df in results}
+        for field in ['Close', 'High', 'Low', 'Volume']: panels[field.lower()] = price_matrix(price_dfs, field)
+        panels['technical'] = technicals.snapshot(stock_ids)
+        return panels
+
+    # --- B. 截面計算 (向量化) ---
+    def compute(self, panels):
+        info = panels['info']
+        ids = info.index
+        bs = statement_panel(panels['bs']); inc = statement_panel(panels['inc']); cf = statement_panel(panels['cf'])
+
+        mom, yoy = revenue_growth(panels['rev'], ids)
+        f = f_score(bs, inc, cf, ids)
+        z = z_score(bs, inc, info)
+        guru = guru_metrics(bs, inc, panels['div'], info, yoy)
+        chip = chip_metrics(panels['chip'], info)
+        margin = margin_metrics(panels['margin'], ids)
+
+        tech = panels.get('technical', pd.DataFrame(columns=technicals.COLUMNS))
+        card = pd.concat([f, z, guru, chip, margin, tech], axis=1).reindex(ids)
+        card['MoM'] = mom; card['YoY'] = yoy
+        return score_card(card, info)
+
+    def run(self, stock_ids=None):
+        exchanges = None
+        if stock_ids is None:
+            universe = self.engine.get_stock_universe()
+            stock_ids = universe['stock_id'].tolist()
+            if 'type' in universe.columns: exchanges = dict(zip(universe['stock_id'], universe['type']))
+        return self.compute(self.load(stock_ids, exchanges))
+
+
+# ========================================================
+# 2. 營收動能 (向量化)
+# ========================================================
+def revenue_growth(rev, ids):
+    mom = pd.Series(np.nan, index=ids); yoy = pd.Series(np.nan, index=ids)
+    if rev.empty: return mom, yoy
+    val_col = 'revenue' if 'revenue' in rev.columns else ('value' if 'value' in rev.columns else None)
+    if not val_col: return mom, yoy
+
+    df = rev[['stock_id', 'date', val_col]].copy()
+    df['date'] = pd.to_datetime(df['date'])
+    df = df.drop_duplicates(['stock_id', 'date'])
+    panel = df.set_index(['stock_id', 'date'])[val_col].sort_index(level=[0, 1], ascending=[True, False]).to_frame('rev')
+    top2 = _latest(panel, 2)
+    n = top2.groupby(level=0).size()
+    curr = top2.groupby(level=0).nth(0).droplevel(1)['rev']
+    last = top2.groupby(level=0).nth(1).droplevel(1)['rev']
+    curr_date = top2.groupby(level=0).nth(0).index.to_frame(index=False).set_index('stock_id')['date']
+
+    ok = n[n >= 2].index
+    curr = curr.reindex(ok); last = last.reindex(ok)
+    m = ((curr - last) / last * 100).where(last.fillna(0) != 0, 0)
+
+    prev = _prior_year(panel, curr_date.reindex(ok), days=REVENUE_YOY_DAYS)['rev']
+    y = ((curr - prev) / prev * 100).where(prev.fillna(0) != 0, 0)
+    return m.reindex(ids), y.reindex(ids)
+
+
+# ========================================================
+# 3. F-Score (向量化)
+# ========================================================
+def f_score(bs, inc, cf, ids):
+    if inc.empty or bs.empty: return pd.DataFrame(0, index=ids, columns=['F-Score'] + F_COMPONENTS)
+
+    curr_date = _latest(inc).index.to_frame(index=False).set_index('stock_id')['date']
+    c_inc = _rows_at(inc, curr_date).fillna(0)
+    c_bs = _rows_at(bs, curr_date).fillna(0)
+    c_cf = _rows_at(cf, curr_date).fillna(0)
+    p_inc = _prior_year(inc, curr_date).fillna(0)
+    p_bs = _prior_year(bs, curr_date).fillna(0)
+
+    # 原版在該日期無資產負債表 (或現金流量表) 時會中斷並得 0 分
+    keys = pd.MultiIndex.from_arrays([curr_date.index, curr_date.values])
+    has_cf = keys.isin(cf.index) | ~curr_date.index.isin(cf.index.get_level_values(0))
+    valid = pd.Series(keys.isin(bs.index) & has_cf, index=curr_date.index)
+
+    comp = f_score_components(c_inc, c_bs, c_cf, p_inc, p_bs)
+    comp.loc[~valid] = False
+    comp['F-Score'] = comp[F_COMPONENTS].sum(axis=1)
+    return comp.reindex(ids).fillna({'F-Score': 0}).reindex(columns=['F-Score'] + F_COMPONENTS)
+
+
+# ========================================================
+# 4. Z-Score (向量化)
+# ========================================================
+def z_score(bs, inc, info):
+    if bs.empty: return pd.DataFrame(index=info.index, columns=['Z-Score'], dtype=float)
+
+    curr_date = _latest(bs).index.to_frame(index=False).set_index('stock_id')['date']
+    b = _rows_at(bs, curr_date).fillna(0)
+    i = _rows_at(inc, curr_date).fillna(0)
+
+    mcap = pd.to_numeric(info['marketCap'], errors='coerce').reindex(curr_date.index).fillna(0)
+    val = z_score_components(b, i, mcap)['Z-Score']
+
+    sector = info['sector'].fillna('').astype(str).reindex(curr_date.index).fillna('')
+    financial = sector.str.contains('Financial|Bank|Insurance', regex=True)
+    # 損益表缺少該日期時原版會拋出例外 -> None
+    has_inc = pd.MultiIndex.from_arrays([curr_date.index, curr_date.values]).isin(inc.index) | inc.empty
+    ok = ~financial & has_inc
+    return val.where(ok).rename('Z-Score').reindex(info.index).to_frame()
+
+
+# ========================================================
+# 5. 大師指標 (向量化)
+# ========================================================
+def guru_metrics(bs, inc, div, info, yoy):
+    if bs.empty or inc.empty: return pd.DataFrame(index=info.index, columns=GURU_KEYS)
+
+    curr_date = _latest(inc).index.to_frame(index=False).set_index('stock_id')['date']
+    ids = curr_date.index
+    b = _rows_at(bs, curr_date).fillna(0)
+    def num(k): return pd.to_numeric(info[k], errors='coerce').reindex(ids)
+
+    # --- A. 葛拉漢數 (5年平均 EPS) ---
+    cs = b['COMMON_STOCK']
+    shares = (cs / 10).where(cs > 0, 1)
+    bvps = b['EQUITY'] / shares
+
+    last20 = _latest(inc, 20)
+    sh = shares.reindex(last20.index.get_level_values(0)).values
+    eps = last20['EPS'].fillna(0)
+    q_eps = eps.where(eps != 0, last20['NET_INCOME'].fillna(0) / sh)
+    avg_eps = q_eps.where(q_eps != 0).groupby(level=0).mean().reindex(ids).fillna(0) * 4
+    graham = np.sqrt((22.5 * avg_eps * bvps).where((avg_eps > 0) & (bvps > 0), 0))
+
+    curr_assets = b['CURRENT_ASSETS']; curr_liab = b['CURRENT_LIABILITIES']
+    current_ratio = (curr_assets / curr_liab).where(curr_liab > 0, 0)
+    ncav = (curr_assets - b['LIABILITIES']) / shares
+
+    # --- B. 林區 PEG ---
+    growth = yoy.reindex(ids).fillna(0)
+    mcap = num('marketCap').fillna(0)
+    cat = pd.Series("未分類", index=ids)
+    cat[growth < 0] = "🔄 循環/轉機"
+    cat[(growth < 5) & (mcap > 500 * 100000000)] = "🐢 緩慢成長"
+    cat[(growth > 10) & (growth <= 20)] = "🛡️ 穩定成長"
+    cat[growth > 20] = "🚀 快速成長"
+
+    div_yield = pd.Series(0.0, index=ids)
+    if not div.empty and 'CashEarningsDistribution' in div.columns:
+        last_div = div.sort_values('date').groupby('stock_id').tail(1).set_index('stock_id')['CashEarningsDistribution']
+        last_div = pd.to_numeric(last_div, errors='coerce').reindex(ids)
+        price = num('currentPrice').fillna(1)
+        div_yield = (last_div / price * 100).where(price > 0).fillna(0)
+
+    pe = num('trailingPE').fillna(0)
+    denom = growth + div_yield
+    peg = (pe / denom).where((denom > 0) & (pe > 0))
+
+    # --- C. 神奇公式 (TTM EBIT) ---
+    last4 = _latest(inc, 4).fillna(0)
+    val = last4['EBIT'].where(last4['EBIT'] != 0, last4['PRE_TAX_INCOME'] + last4['INTEREST_EXPENSE'])
+    nz = val.where(val != 0)
+    total = nz.groupby(level=0).sum().reindex(ids).fillna(0)
+    count = nz.groupby(level=0).count().reindex(ids).fillna(0)
+    ebit_ttm = (total / count * 4).where((count > 0) & (count < 4), total)
+
+    ic = b['FIXED_ASSETS'] + (curr_assets - curr_liab)
+    roc = (ebit_ttm / ic * 100).where(ic > 0, 0)
+    ev = mcap + b['LIABILITIES'] - b['CASH']
+    ey = (ebit_ttm / ev * 100).where(ev > 0, 0)
+
+    res = pd.DataFrame({
+        "Graham Number": graham, "NCAV": ncav,
+        "Lynch Category": cat, "Lynch PEG": peg,
+        "Magic ROC": roc, "Magic EY": ey,
+        "Avg EPS": avg_eps, "Current Ratio": current_ratio
+    })
+    return res.reindex(info.index)
+
+
+# ========================================================
+# 6. 籌碼 / 融資 (向量化)
+# ========================================================
+def chip_metrics(chip, info):
+    ids = info.index
+    mcap = pd.to_numeric(info['marketCap'], errors='coerce').fillna(0)
+    small = (mcap > 0) & (mcap < 50 * 100000000)
+    last = latest(chip_flows(chip, windows=(3, 10)))
+    if last.empty: return pd.DataFrame(index=ids, columns=CHIP_KEYS)
+
+    has = last.index
+    is_small = small.reindex(has).fillna(False).astype(bool)
+    t_net = last['trust_net_10d']
+    res = pd.DataFrame({
+        "Foreign Net (3d)": last['foreign_net_3d'],
+        "Foreign Consecutive": last['foreign_streak'] >= 3,
+        "Trust Net (10d)": t_net,
+        "Trust Active Buy": (t_net > 0) & is_small,
+        "Is Small Cap": is_small
+    }, index=has)
+    return res.reindex(ids)
+
+def margin_metrics(margin, ids):
+    last = latest(margin_flows(margin, windows=(5,)))
+    last = last[last['days'] >= 2] if not last.empty else last
+    if last.empty: return pd.DataFrame(index=ids, columns=MARGIN_KEYS)
+
+    # 近 5 日變化 (不足 6 筆時與第一筆比較)
+    res = pd.DataFrame({
+        "Margin Increasing": last['margin_chg_5d'] > 0,
+        "Latest Balance": last['margin_balance'],
+        "Change": last['margin_chg_5d']
+    }, index=last.index)
+    return res.reindex(ids)
+
+
+# ========================================================
+# 7. 評分卡 (strategy.RULES 整欄計算)
+# ========================================================
+def score_card(card, info):
+    """截面指標 + info -> 依 strategy.RULES 評分 (每條規則一次整欄運算)，依總分排序"""
+    num = lambda k: pd.to_numeric(info[k], errors='coerce').reindex(card.index)
+    inputs = card.assign(**{
+        'Price': num('currentPrice').fillna(num('regularMarketPreviousClose')),
+        'Average Volume': card['Average Volume'].fillna(num('averageVolume')) if 'Average Volume' in card else num('averageVolume'),
+        'Has Margin': card[MARGIN_KEYS].notna().any(axis=1),  # 融資整列皆空 = 原版計算失敗 ({})
+    })
+    card = card.copy()
+    scored = score_frame(inputs)
+    card.insert(0, 'Action', scored['Action'])
+    card.insert(0, 'Score', scored['Score'])
+    return card.sort_values('Score', ascending=False)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="全市場評分卡")
+    parser.add_argument("--stocks", nargs="*", help="股票代號 (預設為全市場)")
+    parser.add_argument("--out", default="scorecard.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    screener = Screener(DataEngine(token=os.environ.get("FINMIND_TOKEN")), max_workers=args.workers)
+    result = screener.run(args.stocks or None)
+    result.to_csv(args.out, encoding="utf-8-sig")
+    print(f"{len(result)} 檔完成 -> {args.out}")
@@ -0,0 +1,57 @@
+"""
+同一台主機上的請求合併 (single-flight): 多個 Streamlit 工作階段、背景預熱程序同時要抓同一份資料時，
+第一個取得鍵鎖的呼叫端向 API 抓取，其餘等待後直接讀它寫入本地資料庫的結果。
+鎖 = 行程內執行緒鎖 + 鎖檔 (fcntl.flock，跨程序)；鍵依雜湊分到 SINGLEFLIGHT_STRIPES 個鎖檔。
+"""
+import os
+import zlib
+import threading
+from contextlib import contextmanager, ExitStack
+from .config import STORE_DIR, SINGLEFLIGHT_STRIPES
+
+try:
+    import fcntl
+except ImportError:  # Windows: 只合併同一程序內的請求
+    fcntl = None
+
+_locks = [threading.Lock() for _ in range(SINGLEFLIGHT_STRIPES)]
+_held = threading.local()   # 目前執行緒持有的鎖號 (同一執行緒重入時不再上鎖)
+
+
+def stripe(key):
+    """鍵 (tuple / str) -> 鎖號"""
+    return zlib.crc32(repr(key).encode()) % SINGLEFLIGHT_STRIPES
+
+@contextmanager
+def _acquire(n, root):
+    with _locks[n]:
+        fd = None
+        if fcntl is not None:
+            path = os.path.join(root, 'locks', f"{n:04d}.lock")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+@contextmanager
+def hold(*keys, root=STORE_DIR):
+    """
+    持有 keys 的鎖 (依鎖號排序取得，多鍵同時持有也不會死結)。
+    區塊內應先重新檢查本地資料 (等待期間其他呼叫端可能已抓好)，再決定是否抓取。
+    """
+    held = getattr(_held, 'stripes', None)
+    if held is None: held = _held.stripes = set()
+    todo = sorted({stripe(k) for k in keys} - held)
+    with ExitStack() as stack:
+        for n in todo:
+            stack.enter_context(_acquire(n, root))
+            held.add(n)
+        try:
+            yield
+        finally:
+            held.difference_update(todo)
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+from functools import lru_cache
+import pandas as pd
+from .config import STORE_DIR, STORE_KEYS
+from .telemetry import annotate
+from .health import Unavailable, served_stale
+from . import telemetry, singleflight
+
+
+class DataStore:
+    """
+    本地增量資料庫：每個 (dataset, stock_id) 存成一個 Parquet 檔，
+    SQLite 索引記錄已涵蓋的日期範圍、最後更新時間 (updated_at) 與內容最後變動時間 (changed_at)。
+    重新整理時只向 API 抓取最後日期之後的資料並合併。
+    """
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._execute("""CREATE TABLE IF NOT EXISTS manifest (
+            dataset TEXT, stock_id TEXT, first_date TEXT, last_date TEXT,
+            rows INTEGER, updated_at REAL, PRIMARY KEY (dataset, stock_id))""")
+        # 舊版索引沒有 changed_at: 補上欄位 (視為未知，下次合併時填入)；其他執行緒 / 程序可能同時補上
+        if 'changed_at' not in [r[1] for r in self._execute("PRAGMA table_info(manifest)")]:
+            try:
+                self._execute("ALTER TABLE manifest ADD COLUMN changed_at REAL")
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e): raise
+        self._execute("""CREATE TABLE IF NOT EXISTS symbols (
+            stock_id TEXT PRIMARY KEY, symbol TEXT, updated_at REAL)""")
+        self._execute("""CREATE TABLE IF NOT EXISTS results (
+            kind TEXT, stock_id TEXT, computed_at REAL, payload TEXT, PRIMARY KEY (kind, stock_id))""")
+
+    def _execute(self, sql, params=()):
+        with closing(sqlite3.connect(os.path.join(self.root, 'manifest.sqlite'), timeout=30)) as conn:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+
+    def _path(self, dataset, stock_id):
+        return os.path.join(self.root, dataset, f"{stock_id or '_all'}.parquet")
+
+    # --- 讀取 ---
+    def status(self, dataset, stock_id):
+        """回傳 {'first_date', 'last_date', 'rows', 'updated_at', 'changed_at'}，未儲存過則為 None"""
+        rows = self._execute("SELECT first_date, last_date, rows, updated_at, changed_at FROM manifest WHERE dataset=? AND stock_id=?",
+                             (dataset, stock_id))
+        if not rows: return None
+        return dict(zip(['first_date', 'last_date', 'rows', 'updated_at', 'changed_at'], rows[0]))
+
+    def changed_since(self, dataset, since):
+        """since (timestamp) 之後有新增或更正資料的 stock_id"""
+        rows = self._execute("SELECT stock_id FROM manifest WHERE dataset=? AND changed_at > ?", (dataset, since))
+        return [r[0] for r in rows]
+
+    def read(self, dataset, stock_id, start_date=None):
+        path = self._path(dataset, stock_id)
+        if not os.path.exists(path): return pd.DataFrame()
+        try:
+            df = pd.read_parquet(path)
+        except Exception as e:
+            telemetry.error(f"store.read({dataset}/{stock_id})", e)
+            return pd.DataFrame()
+        if start_date and 'date' in df.columns:
+            df = df[df['date'] >= start_date]
+        return df.reset_index(drop=True)
+
+    # --- 寫入 ---
+    def merge(self, dataset, stock_id, new_df, first_date=None, replace=False):
+        """
+        合併新資料 (同鍵以新資料為準)，寫回磁碟並更新索引；內容有變才更新 changed_at。
+        replace=True 時以新資料整批取代 (例如還原權值後的股價需整段重寫)。
+        """
+        with self._lock:
+            old = self.read(dataset, stock_id)
+            frames = [f for f in (None if replace else old, new_df) if f is not None and not f.empty]
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            changed = False
+            if not df.empty:
+                keys = [k for k in STORE_KEYS.get(dataset, []) if k in df.columns] or None
+                df = df.drop_duplicates(subset=keys, keep='last')
+                if 'date' in df.columns: df = df.sort_values('date', kind='stable')
+                df = df.reset_index(drop=True)
+                # 增量抓取會重抓最後一天: 筆數相同時逐格比對 (轉字串避免 API 與 Parquet 型別不同)
+                changed = len(df) != len(old) or list(df.columns) != list(old.columns) or not df.astype(str).equals(old.astype(str))
+
+            if changed:
+                path = self._path(dataset, stock_id)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                df.to_parquet(tmp, index=False)
+                os.replace(tmp, path)
+
+            prev = self.status(dataset, stock_id) or {}
+            firsts = [d for d in (prev.get('first_date'), first_date) if d]
+            first = min(firsts) if firsts else None
+            last = str(df['date'].max()) if not df.empty and 'date' in df.columns else prev.get('last_date')
+            now = time.time()
+            self._execute("INSERT OR REPLACE INTO manifest (dataset, stock_id, first_date, last_date, rows, updated_at, changed_at) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (dataset, stock_id, first, last, len(df), now, now if changed else prev.get('changed_at')))
+            return df
+
+    def invalidate(self, dataset, stock_id):
+        """標為過期 (已知有新資料公布)：下次 sync 不論 ttl 都會抓增量"""
+        self._execute("UPDATE manifest SET updated_at=0 WHERE dataset=? AND stock_id=?", (dataset, stock_id))
+
+    # --- Yahoo 代號 (stock_id -> 2330.TW / 6488.TWO，解析一次後沿用) ---
+    def symbols(self):
+        return dict(self._execute("SELECT stock_id, symbol FROM symbols"))
+
+    def set_symbols(self, mapping):
+        now = time.time()
+        with closing(sqlite3.connect(os.path.join(self.root, 'manifest.sqlite'), timeout=30)) as conn:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO symbols VALUES (?, ?, ?)", [(k, v, now) for k, v in mapping.items()])
+
+    # --- 計算結果 (背景預熱寫入，UI 直接讀取) ---
+    def save_result(self, kind, stock_id, payload):
+        """payload 為可轉成 JSON 的 dict (numpy 數值轉為 Python 型別)"""
+        text = json.dumps(payload, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, 'item') else str(o))
+        self._execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (kind, stock_id, time.time(), text))
+
+    def load_result(self, kind, stock_id):
+        """回傳 (computed_at, payload)，沒有結果則為 None"""
+        rows = self._execute("SELECT computed_at, payload FROM results WHERE kind=? AND stock_id=?", (kind, stock_id))
+        if not rows: return None
+        return rows[0][0], json.loads(rows[0][1])
+
+    # --- 增量同步 ---
+    def sync(self, dataset, stock_id, start_date, fetch, ttl):
+        """
+        取得 start_date 之後的資料。
+        本地資料在 ttl 秒內更新過 -> 直接讀檔；否則只抓最後日期之後的增量。
+        fetch(since) 需回傳 since (含) 之後的 DataFrame；同鍵同時抓取時只呼叫一次 (singleflight)。
+        fetch 拋出 Unavailable (上游斷路中) 時改回傳本地舊資料，不更新索引 (恢復後照常抓增量)；
+        其他例外照常往外拋，同樣不寫入。回傳空表 (查無資料) 視為成功，首次抓取也會記錄。
+        """
+        st = self.status(dataset, stock_id)
+        if self._fresh(st, start_date, ttl):
+            return self.read(dataset, stock_id, start_date)
+
+        # 同鍵只有一個呼叫端 (含其他程序) 向 API 抓取；等到鎖時若已有人在等待期間抓好，直接讀
+        since_wait = time.time()
+        with singleflight.hold((dataset, stock_id), root=self.root):
+            st = self.status(dataset, stock_id)
+            if self._fresh(st, start_date, ttl, since_wait):
+                annotate(cache='shared')
+                return self.read(dataset, stock_id, start_date)
+            covered = self._fresh(st, start_date, float('inf'))
+
+            # 重抓最後一天 (盤中/更正資料以新值覆蓋)
+            since = st['last_date'] if covered and st['last_date'] else start_date
+            try:
+                new = fetch(since)
+            except Unavailable:
+                annotate(cache='stale'); served_stale()
+                return self.read(dataset, stock_id, start_date) if st else pd.DataFrame()
+            if new is None: new = pd.DataFrame()
+            # 首次抓取查無資料 (新上市、無股利...) 也寫入索引 (last_date 為空)，ttl 內不再重抓
+            df = self.merge(dataset, stock_id, new, first_date=start_date if covered or st is None or not new.empty else None)
+        if 'date' in df.columns: df = df[df['date'] >= start_date]
+        return df.reset_index(drop=True)
+
+    @staticmethod
+    def _fresh(st, start_date, ttl, since=None):
+        """已涵蓋 start_date，且在 ttl 內 (或 since 之後) 更新過"""
+        if st is None or st['first_date'] is None or st['first_date'] > start_date: return False
+        return time.time() - st['updated_at'] < ttl or (since is not None and st['updated_at'] >= since)
+
+
+@lru_cache(maxsize=None)
+def get_store(root=STORE_DIR):
+    return DataStore(root)
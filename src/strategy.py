@@ -1,86 +1,194 @@
+from typing import Callable, NamedTuple
+import numpy as np
 import pandas as pd
 
-def generate_signals(f_score, z_score, info, mom, yoy, guru_metrics, chip_metrics, margin_metrics):
+# ========================================================
+# 1. 評分規則表 (單檔、全市場與說明書共用)
+# ========================================================
+class Rule(NamedTuple):
+    name: str               # 規則代號 (參數掃描以此覆寫分數)
+    dimension: str          # 說明書的「維度」
+    logic: str              # 說明書的「判斷邏輯」(以 PARAMS 代入門檻)
+    points: int             # 0 為僅提示、不計分
+    when: Callable          # (輸入欄位, 門檻) -> 是否成立；只用比較與 & / |，單檔 (純量) 與整欄 (Series) 皆適用
+    message: Callable       # (輸入欄位, 門檻) -> 單檔評分依據文字
+    group: str = None       # 同組規則依序只取第一個成立者 (if / elif)
+
+# 輸入欄位: 缺值時的預設 (None 表示保留 NaN，比較結果一律不成立)
+INPUTS = {
+    'F-Score': 0, 'Z-Score': None, 'Price': 0,
+    'Graham Number': 0, 'NCAV': 0, 'Current Ratio': 0, 'Lynch PEG': None, 'Magic ROC': 0, 'Magic EY': 0,
+    'MoM': None, 'YoY': None, 'Foreign Net (3d)': 0, 'Average Volume': 0,
+    'MA60': None, 'RSI': None, 'Volume Z': None, '52W High Dist': None,   # 技術指標 (src/technicals.py)
+}
+FLAGS = ['Foreign Consecutive', 'Trust Active Buy', 'Has Margin', 'Margin Increasing']
+
+# 規則門檻 (參數掃描 src/optimizer.py 可覆寫)；張數門檻換算為股數 (× 1000) 比較
+PARAMS = {
+    'f_high': 8, 'f_low': 3, 'z_distress': 1.81, 'ncav_discount': 0.66, 'graham_current_ratio': 1.5,
+    'peg_low': 0.5, 'peg_mid': 1.0, 'peg_high': 2.0, 'roc_min': 20, 'ey_min': 5, 'yoy_min': 20,
+    'foreign_sell_lots': 5000, 'high_dist_max': 10, 'rsi_high': 80, 'rsi_low': 30, 'volume_z': 3, 'min_volume_lots': 500,
+}
+
+def _below_graham(c):
+    return (c['Price'] > 0) & (c['Graham Number'] > 0) & (c['Price'] < c['Graham Number'])
+
+RULES = [
+    Rule('f_strong', "基本面 (F-Score)", "F-Score ≥ {f_high} 分", 2, lambda c, p: c['F-Score'] >= p['f_high'],
+         lambda c, p: f"✅ F-Score {c['F-Score']} (體質強健 +2)", 'f_score'),
+    Rule('f_weak', "基本面 (F-Score)", "F-Score ≤ {f_low} 分", -2, lambda c, p: c['F-Score'] <= p['f_low'],
+         lambda c, p: f"⚠️ F-Score {c['F-Score']} (體質衰退 -2)", 'f_score'),
+    Rule('z_risk', "風險 (Z-Score)", "Z-Score < {z_distress}", -3, lambda c, p: c['Z-Score'] < p['z_distress'],
+         lambda c, p: f"💀 Z-Score {c['Z-Score']:.2f} (破產風險 -3)"),
+    Rule('ncav', "價值 (NCAV)", "現價 < {ncav_discount} × NCAV (深度價值)", 3,
+         lambda c, p: (c['Price'] > 0) & (c['NCAV'] > 0) & (c['Price'] < c['NCAV'] * p['ncav_discount']),
+         lambda c, p: f"💎 股價 < {p['ncav_discount']} * NCAV (深度價值) (+3)", 'value'),
+    Rule('graham_quality', "價值 (Graham)", "現價 < 葛拉漢數 (且流動比>{graham_current_ratio})", 2,
+         lambda c, p: _below_graham(c) & (c['Current Ratio'] > p['graham_current_ratio']),
+         lambda c, p: "💎 價格低於葛拉漢數且體質佳 (+2)", 'value'),
+    Rule('graham', "價值 (Graham)", "現價 < 葛拉漢數 (流動比不足)", 1, lambda c, p: _below_graham(c),
+         lambda c, p: "🔹 價格低於葛拉漢數 (+1)", 'value'),
+    Rule('peg_very_cheap', "成長 (Lynch)", "PEG < {peg_low} (極度低估)", 2, lambda c, p: c['Lynch PEG'] < p['peg_low'],
+         lambda c, p: f"🚀 PEG {c['Lynch PEG']:.2f} < {p['peg_low']} (極低估 +2)", 'peg'),
+    Rule('peg_cheap', "成長 (Lynch)", "PEG < {peg_mid} (合理)", 1, lambda c, p: c['Lynch PEG'] < p['peg_mid'],
+         lambda c, p: f"🔹 PEG {c['Lynch PEG']:.2f} < {p['peg_mid']} (合理 +1)", 'peg'),
+    Rule('peg_hot', "成長 (Lynch)", "PEG > {peg_high} (過熱)", -1, lambda c, p: c['Lynch PEG'] > p['peg_high'],
+         lambda c, p: f"⚠️ PEG {c['Lynch PEG']:.2f} > {p['peg_high']} (過熱 -1)", 'peg'),
+    Rule('magic', "品質 (Magic)", "ROC > {roc_min}% 且 盈餘殖利率 > {ey_min}%", 2,
+         lambda c, p: (c['Magic ROC'] > p['roc_min']) & (c['Magic EY'] > p['ey_min']),
+         lambda c, p: f"✨ 神奇公式 (ROC>{p['roc_min']}, EY>{p['ey_min']}) (+2)"),
+    Rule('revenue_both', "在地化 (Revenue)", "營收 YoY > {yoy_min}% & MoM > 0", 2,
+         lambda c, p: (c['YoY'] > p['yoy_min']) & (c['MoM'] > 0),
+         lambda c, p: f"🔥 營收雙強 (YoY>{p['yoy_min']}% & MoM>0) (+2)", 'revenue'),
+    Rule('revenue_yoy', "在地化 (Revenue)", "營收 YoY > {yoy_min}%", 1,
+         lambda c, p: (c['YoY'] > p['yoy_min']) & (c['MoM'] == c['MoM']),  # MoM 非 NaN
+         lambda c, p: f"📈 營收年增 {c['YoY']:.1f}% (+1)", 'revenue'),
+    Rule('foreign_streak', "在地化 (Chips)", "外資連續 3 日買超", 1, lambda c, p: c['Foreign Consecutive'],
+         lambda c, p: "💰 外資連續 3 日買超 (+1)"),
+    Rule('trust_buy', "在地化 (Chips)", "投信積極認養 (中小型股)", 2, lambda c, p: c['Trust Active Buy'],
+         lambda c, p: "🚀 投信積極認養 (+2)"),
+    Rule('foreign_sell', "在地化 (Chips)", "外資近 3 日賣超 > {foreign_sell_lots:,} 張", 0,
+         lambda c, p: c['Foreign Net (3d)'] < -p['foreign_sell_lots'] * 1000,
+         lambda c, p: f"⚠️ 外資近3日大賣 {int(abs(c['Foreign Net (3d)'])//1000)} 張"),
+    Rule('margin_up', "在地化 (Margin)", "融資餘額近 5 日增加 (散戶進場)", 0, lambda c, p: c['Has Margin'] & c['Margin Increasing'],
+         lambda c, p: "⚠️ 融資餘額增加 (散戶進場)", 'margin'),
+    Rule('margin_down', "在地化 (Margin)", "融資餘額近 5 日減少 (籌碼安定)", 0, lambda c, p: c['Has Margin'],
+         lambda c, p: "🛡️ 融資餘額減少 (籌碼安定)", 'margin'),
+    Rule('trend', "動能 (Trend)", "現價 > 60 日均線且距 52 週高點 {high_dist_max}% 內", 1,
+         lambda c, p: (c['Price'] > c['MA60']) & (c['52W High Dist'] > -p['high_dist_max']),
+         lambda c, p: f"📈 站上季線、距 52 週高點 {c['52W High Dist']:.1f}% (+1)"),
+    Rule('rsi_hot', "動能 (RSI)", "RSI(14) > {rsi_high} (過熱)", 0, lambda c, p: c['RSI'] > p['rsi_high'],
+         lambda c, p: f"⚠️ RSI {c['RSI']:.0f} (短線過熱)", 'rsi'),
+    Rule('rsi_cold', "動能 (RSI)", "RSI(14) < {rsi_low} (超賣)", 0, lambda c, p: c['RSI'] < p['rsi_low'],
+         lambda c, p: f"🔹 RSI {c['RSI']:.0f} (短線超賣)", 'rsi'),
+    Rule('volume_spike', "動能 (Volume)", "成交量 z 分數 > {volume_z} (爆量)", 0, lambda c, p: c['Volume Z'] > p['volume_z'],
+         lambda c, p: f"⚠️ 爆量 (z = {c['Volume Z']:.1f})"),
+    Rule('illiquid', "風險 (Liquidity)", "日均量 < {min_volume_lots:,} 張", -2,
+         lambda c, p: (c['Average Volume'] > 0) & (c['Average Volume'] < p['min_volume_lots'] * 1000),
+         lambda c, p: "⚠️ 低流動性 (-2)"),
+]
+
+# 總分 -> 動作 (由高到低，取第一個達到門檻者)
+ACTIONS = [
+    (5, "強力買進 (Strong Buy)", "green"),
+    (3, "買進/持有 (Buy/Hold)", "blue"),
+    (0, "觀望 (Watch)", "orange"),
+    (-np.inf, "賣出/避開 (Sell/Avoid)", "red"),
+]
+
+def action_for(total_score):
+    return next((action, color) for floor, action, color in ACTIONS if total_score >= floor)
+
+def rule_table():
+    """說明書用的評分表 (維度 / 判斷邏輯 / 分數)"""
+    return pd.DataFrame({
+        "維度": [r.dimension for r in RULES],
+        "判斷邏輯": [r.logic.format(**PARAMS) for r in RULES],
+        "分數": [f"{r.points:+d}" if r.points else "0 (提示)" for r in RULES],
+    })
+
+
+# ========================================================
+# 2. 單檔評分
+# ========================================================
+def signal_inputs(f_score, z_score, info, mom, yoy, guru_metrics, chip_metrics, margin_metrics, technical=None):
+    """generate_signals 的參數 -> 規則輸入 (純量 dict)；均量優先用日線算出的值，沒有時用 Yahoo averageVolume"""
+    technical = technical or {}
+    c = {**technical, **(guru_metrics or {}), **(chip_metrics or {}), **(margin_metrics or {}),
+         'F-Score': f_score, 'Z-Score': z_score, 'MoM': mom, 'YoY': yoy,
+         'Price': info.get('currentPrice', info.get('regularMarketPreviousClose', 0)),
+         'Average Volume': technical.get('Average Volume') or info.get('averageVolume', 0), 'Has Margin': bool(margin_metrics)}
+    out = {}
+    for k, default in INPUTS.items():
+        v = c.get(k)
+        out[k] = v if v is not None and v == v else (np.nan if default is None else default)  # v != v 即 NaN
+    for k in FLAGS:
+        v = c.get(k)
+        out[k] = v is not None and v == v and bool(v)
+    return out
+
+def generate_signals(f_score, z_score, info, mom, yoy, guru_metrics, chip_metrics, margin_metrics, technical=None):
     """
-    台股在地化綜合評分 (透明化顯示版)
+    台股在地化綜合評分 (透明化顯示版)；technical 為 technicals.for_stock 的最新技術指標
     """
-    total_score = 0
-    signal_reasons = []
-
-    # 1. F-Score
-    if f_score >= 8: total_score += 2; signal_reasons.append(f"✅ F-Score {f_score} (體質強健 +2)")
-    elif f_score <= 3: total_score -= 2; signal_reasons.append(f"⚠️ F-Score {f_score} (體質衰退 -2)")
-
-    # 2. Z-Score
-    if z_score is not None and z_score < 1.81: total_score -= 3; signal_reasons.append(f"💀 Z-Score {z_score:.2f} (破產風險 -3)")
-
-    # 3. 葛拉漢 & NCAV
-    price = info.get('currentPrice', info.get('regularMarketPreviousClose', 0))
-    graham_num = guru_metrics.get('Graham Number', 0)
-    ncav = guru_metrics.get('NCAV', 0)
-    
-    if price > 0:
-        if ncav > 0 and price < ncav * 0.66:
-            total_score += 3
-            signal_reasons.append(f"💎 股價 < 0.66 * NCAV (深度價值) (+3)")
-        elif graham_num > 0 and price < graham_num:
-            if guru_metrics.get('Current Ratio', 0) > 1.5:
-                total_score += 2; signal_reasons.append(f"💎 價格低於葛拉漢數且體質佳 (+2)")
-            else:
-                total_score += 1; signal_reasons.append(f"🔹 價格低於葛拉漢數 (+1)")
-
-    # 4. 林區 PEG
-    peg = guru_metrics.get('Lynch PEG')
-    if peg is not None:
-        if peg < 0.5: total_score += 2; signal_reasons.append(f"🚀 PEG {peg:.2f} < 0.5 (極低估 +2)")
-        elif peg < 1.0: total_score += 1; signal_reasons.append(f"🔹 PEG {peg:.2f} < 1.0 (合理 +1)")
-        elif peg > 2.0: total_score -= 1; signal_reasons.append(f"⚠️ PEG {peg:.2f} > 2.0 (過熱 -1)")
-
-    # 5. 神奇公式
-    roc = guru_metrics.get('Magic ROC', 0)
-    ey = guru_metrics.get('Magic EY', 0)
-    if roc > 20 and ey > 5:
-        total_score += 2; signal_reasons.append(f"✨ 神奇公式 (ROC>20, EY>5) (+2)")
-
-    # 6. 營收動能
-    if yoy is not None and mom is not None:
-        if yoy > 20 and mom > 0: total_score += 2; signal_reasons.append(f"🔥 營收雙強 (YoY>20% & MoM>0) (+2)")
-        elif yoy > 20: total_score += 1; signal_reasons.append(f"📈 營收年增 {yoy:.1f}% (+1)")
-
-    # 7. 籌碼面 (更新邏輯)
-    if chip_metrics:
-        # 外資連買 (策略加分)
-        if chip_metrics.get("Foreign Consecutive"): 
-            total_score += 1
-            signal_reasons.append("💰 外資連續 3 日買超 (+1)")
-        
-        # 投信認養 (策略加分)
-        if chip_metrics.get("Trust Active Buy"): 
-            total_score += 2
-            signal_reasons.append("🚀 投信積極認養 (+2)")
-        
-        # [新增] 若外資賣超太多，給予警示 (但不一定要扣分，視策略而定)
-        f_net = chip_metrics.get("Foreign Net (3d)", 0)
-        if f_net < -5000000: # 賣超 5000 張
-             signal_reasons.append(f"⚠️ 外資近3日大賣 {int(abs(f_net)//1000)} 張")
-
-    # 8. 融資
-    if margin_metrics:
-        margin_up = margin_metrics.get("Margin Increasing")
-        if margin_up: signal_reasons.append("⚠️ 融資餘額增加 (散戶進場)")
-        else: signal_reasons.append("🛡️ 融資餘額減少 (籌碼安定)")
-
-    # 9. 流動性
-    avg_vol = info.get('averageVolume', 0)
-    if avg_vol > 0 and avg_vol < 500000: total_score -= 2; signal_reasons.append("⚠️ 低流動性 (-2)")
-
-    action = "觀望 (Watch)"; color = "orange"
-    if total_score >= 5: action = "強力買進 (Strong Buy)"; color = "green"
-    elif 3 <= total_score <= 4: action = "買進/持有 (Buy/Hold)"; color = "blue"
-    elif total_score < 0: action = "賣出/避開 (Sell/Avoid)"; color = "red"
-        
+    c = signal_inputs(f_score, z_score, info, mom, yoy, guru_metrics, chip_metrics, margin_metrics, technical)
+    total_score, signal_reasons, taken = 0, [], set()
+    for rule in RULES:
+        if rule.group in taken or not rule.when(c, PARAMS): continue
+        total_score += rule.points
+        signal_reasons.append(rule.message(c, PARAMS))
+        if rule.group: taken.add(rule.group)
+
+    action, color = action_for(total_score)
     return total_score, action, color, signal_reasons
 
+
+# ========================================================
+# 3. 全市場評分 (向量化)
+# ========================================================
+def rule_inputs(df):
+    """每列一檔的規則輸入 (欄位見 INPUTS / FLAGS，缺欄以預設補) -> {欄位: Series}"""
+    c = {}
+    for k, default in INPUTS.items():
+        s = pd.to_numeric(df[k], errors='coerce') if k in df else pd.Series(np.nan, index=df.index)
+        c[k] = s if default is None else s.fillna(default)
+    for k in FLAGS:
+        c[k] = df[k].eq(True) if k in df else pd.Series(False, index=df.index)
+    return c
+
+def total_score(hits, weights=None):
+    """
+    各規則 (RULES 順序) 的成立遮罩 -> 每列總分；同組只計第一個成立者。
+    weights: {規則代號: 分數} 覆寫規則分數 (0 分規則仍佔住所屬組)。
+    """
+    weights = weights or {}
+    # 總分範圍小: int16 累加 (遮罩視為 int8) 比 int64 快數倍，參數掃描每組都要算
+    total = np.zeros(len(hits[0]) if hits else 0, dtype=np.int16)
+    taken = {}
+    for rule, hit in zip(RULES, hits):
+        if rule.group:
+            prev = taken.get(rule.group)
+            if prev is not None: hit = hit & ~prev
+            taken[rule.group] = hit if prev is None else prev | hit
+        points = weights.get(rule.name, rule.points)
+        if points: total += hit.view(np.int8) * np.int16(points)
+    return total.astype(int)
+
+def score_frame(df, params=None, weights=None):
+    """
+    每列一檔的規則輸入 -> DataFrame[Score, Action]。
+    每條規則只做一次整欄運算，與逐檔 generate_signals 的總分一致；params / weights 覆寫門檻與分數 (參數掃描用)。
+    """
+    c = rule_inputs(df)
+    p = {**PARAMS, **(params or {})}
+    total = total_score([np.asarray(rule.when(c, p), dtype=bool) for rule in RULES], weights)
+
+    # 每列取第一個達到的門檻 (最後一級為 -inf，必定成立)
+    floors = np.array([floor for floor, _, _ in ACTIONS])
+    actions = np.array([action for _, action, _ in ACTIONS], dtype=object)[np.argmax(total[:, None] >= floors, axis=1)]
+    return pd.DataFrame({'Score': total, 'Action': actions}, index=df.index)
+
+
 def suggest_order_type(action):
     if "Buy" in action or "Hold" in action:
         return "**在地化建議:** 盤後掛單或尾盤 ROD，避開開盤波動。注意成交量。"
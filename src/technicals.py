@@ -0,0 +1,259 @@
+"""
+技術指標: 全市場日線存成 日期 × 股票 的記憶體映射矩陣 (np.memmap，float32)，
+Streamlit、背景預熱與比較程序池以唯讀方式開啟同一份檔案 (共用作業系統的分頁快取)。
+MA / RSI / ATR / 量能 z 分數 / 距 52 週高點 一次對所有股票整欄計算；新 K 棒只追加列。
+"""
+import os
+import json
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from .config import (STORE_DIR, TECH_MA, TECH_RSI, TECH_ATR, TECH_VOLUME_Z, TECH_HIGH_DAYS,
+                     TECH_AVG_VOLUME_DAYS, TECH_LOOKBACK)
+from .store import get_store
+from .prices import PRICE_DATASET, clean_id
+from . import prices, singleflight
+
+FIELDS = ['Close', 'High', 'Low', 'Volume']
+COLUMNS = [f'MA{n}' for n in TECH_MA] + ['RSI', 'ATR %', 'Volume Z', '52W High Dist', 'Average Volume']
+MATRIX_DIR = 'matrix'
+
+
+# ========================================================
+# 1. 指標 (整欄計算)
+# ========================================================
+# pandas 的 rolling / ewm 逐欄計算，上千檔時每項約 0.1 秒；以下對整個矩陣一次運算 (語意同 pandas)
+def _wilder(a, n):
+    """Wilder 平滑 (RSI / ATR 用，同 ewm(alpha=1/n, adjust=False, min_periods=n))；逐列遞迴、整列運算"""
+    out, y = np.empty_like(a), np.full(a.shape[1], np.nan)
+    for i, x in enumerate(a):
+        y = np.where(np.isnan(y), x, np.where(np.isnan(x), y, y + (x - y) / n))
+        out[i] = y
+    out[np.cumsum(~np.isnan(a), axis=0) < n] = np.nan
+    return out
+
+def _rolling_mean(a, n, min_periods):
+    """每欄最近 n 列 (含當列) 的平均，非 NaN 筆數不足 min_periods 時為 NaN (累加和相減)"""
+    valid = ~np.isnan(a)
+    total, count = np.cumsum(np.where(valid, a, 0.0), axis=0), np.cumsum(valid, axis=0)
+    total[n:] -= total[:-n].copy(); count[n:] -= count[:-n].copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count >= min_periods, total / count, np.nan)
+
+def _rolling_std(a, n):
+    """每欄最近 n 列的樣本標準差 (ddof=1)，視窗內有 NaN 或不足 n 列時為 NaN"""
+    out = np.full_like(a, np.nan)
+    if len(a) >= n: out[n - 1:] = np.lib.stride_tricks.sliding_window_view(a, n, axis=0).std(axis=-1, ddof=1)
+    return out
+
+def _rolling_max(a, n):
+    """每欄最近 n 列 (含當列) 的最大值，忽略 NaN (min_periods=1)；倍增法只需 O(log n) 次整欄運算"""
+    shift = lambda x, k: np.vstack([np.full((min(k, len(x)), x.shape[1]), -np.inf), x[:-k]]) if k else x
+    block, width = np.where(np.isnan(a), -np.inf, a), 1   # block[i] = max(a[i-width+1 .. i])
+    out, offset = np.full_like(a, -np.inf), 0
+    while n:
+        if n & 1:
+            out = np.maximum(out, shift(block, offset)); offset += width
+        n >>= 1
+        if n: block, width = np.maximum(block, shift(block, width)), width * 2
+    return np.where(np.isneginf(out), np.nan, out)
+
+def indicators(close, high=None, low=None, volume=None):
+    """
+    日期 × 股票 的日線 -> {指標名稱: 日期 × 股票}。
+    停牌日 (NaN) 的價格沿用前一日；沒有高低價時以收盤價代替，沒有成交量時不算量能指標。
+    """
+    frame = lambda a: pd.DataFrame(a, index=close.index, columns=close.columns)
+    c = close.ffill().to_numpy(dtype=float)
+    h = c if high is None else high.ffill().to_numpy(dtype=float)
+    l = c if low is None else low.ffill().to_numpy(dtype=float)
+    out = {f'MA{n}': frame(_rolling_mean(c, n, n)) for n in TECH_MA}
+
+    prev = np.vstack([np.full((min(1, len(c)), c.shape[1]), np.nan), c[:-1]])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = c - prev
+        up, down = _wilder(np.clip(delta, 0, None), TECH_RSI), _wilder(np.clip(-delta, 0, None), TECH_RSI)
+        out['RSI'] = frame(100 - 100 / (1 + up / down))  # 只漲不跌: up/down = inf -> 100
+
+        true_range = np.fmax(h - l, np.fmax(np.abs(h - prev), np.abs(l - prev)))
+        out['ATR %'] = frame(_wilder(true_range, TECH_ATR) / c * 100)
+
+        if volume is not None:
+            v = volume.to_numpy(dtype=float)
+            mean, std = _rolling_mean(v, TECH_VOLUME_Z, TECH_VOLUME_Z), _rolling_std(v, TECH_VOLUME_Z)
+            out['Volume Z'] = frame(np.where(std > 0, (v - mean) / std, np.nan))
+            out['Average Volume'] = frame(_rolling_mean(v, TECH_AVG_VOLUME_DAYS, 1))
+        out['52W High Dist'] = frame((c / _rolling_max(h, TECH_HIGH_DAYS) - 1) * 100)
+    return out
+
+def latest(close, high=None, low=None, volume=None):
+    """每檔最新一天的指標 (index=股票，欄位 COLUMNS)；只用最後 TECH_LOOKBACK 列計算"""
+    if close.empty: return pd.DataFrame(columns=COLUMNS, dtype=float)
+    tail = lambda df: None if df is None else df.iloc[-TECH_LOOKBACK:]
+    ind = indicators(tail(close), tail(high), tail(low), tail(volume))
+    return pd.DataFrame({name: df.iloc[-1] for name, df in ind.items()}, index=close.columns).reindex(columns=COLUMNS)
+
+def for_stock(price_df):
+    """單檔 Yahoo 日線 -> 最新技術指標 dict (與全市場矩陣同一套計算，缺值的指標不列入)"""
+    if price_df is None or price_df.empty or 'Close' not in price_df.columns: return {}
+    col = lambda f: price_df[[f]].astype(float).set_axis(['stock'], axis=1) if f in price_df.columns else None  # 同欄名才能逐格運算
+    row = latest(*(col(f) for f in FIELDS)).iloc[0]
+    return {k: float(v) for k, v in row.items() if v == v}
+
+def for_stocks(price_dfs):
+    """
+    多檔日線 {stock_id: df} -> {stock_id: 最新技術指標 dict}；對齊日期後一次整欄計算 (盤中監控每輪數百檔)。
+    與全市場矩陣相同，某檔缺的交易日 (停牌) 以前一日價格補。
+    """
+    tails = {sid: df.iloc[-TECH_LOOKBACK:] for sid, df in price_dfs.items()
+             if df is not None and not df.empty and 'Close' in df.columns}
+    if not tails: return {}
+    wide = lambda f: (pd.DataFrame({sid: df[f].astype(float) for sid, df in tails.items() if f in df.columns})
+                      .reindex(columns=list(tails)) if any(f in df.columns for df in tails.values()) else None)
+    out = latest(*(wide(f) for f in FIELDS))
+    return {sid: {k: float(v) for k, v in row.items() if v == v} for sid, row in out.iterrows()}
+
+
+# ========================================================
+# 2. 記憶體映射矩陣 (唯讀)
+# ========================================================
+def _dir(root):
+    return os.path.join(root, MATRIX_DIR)
+
+def _read_meta(root):
+    try:
+        with open(os.path.join(_dir(root), 'meta.json')) as f: return json.load(f)
+    except FileNotFoundError:
+        return {'version': 0, 'generation': 0, 'dates': [], 'tickers': [], 'stamps': {}}
+
+def _file(root, field, generation):
+    return os.path.join(_dir(root), f"{field}.{generation}.f4")
+
+class PriceMatrix:
+    """
+    矩陣的唯讀檢視: 每個欄位一個 float32 檔 (列 = 日期，行 = 股票，C 順序)，
+    新日期追加在檔尾；新增股票時整份重寫成新一代 (generation) 的檔案，舊檔在已開啟的映射關閉前仍有效。
+    """
+    def __init__(self, root=STORE_DIR):
+        for _ in range(3):  # 讀到 meta 後舊一代檔案剛好被刪除: 重讀 meta
+            meta = _read_meta(root)
+            try:
+                self._open(root, meta)
+                return
+            except FileNotFoundError:
+                continue
+        raise RuntimeError(f"price matrix under {_dir(root)} keeps changing")
+
+    def _open(self, root, meta):
+        self.version = meta['version']
+        self.dates = pd.DatetimeIndex(meta['dates'])
+        self.tickers = pd.Index(meta['tickers'], dtype=object)
+        shape = (len(self.dates), len(self.tickers))
+        self._arrays = {f: np.memmap(_file(root, f, meta['generation']), dtype=np.float32, mode='r', shape=shape)
+                        if all(shape) else np.empty(shape, dtype=np.float32) for f in FIELDS}
+
+    def frame(self, field, stock_ids=None, rows=None):
+        """日期 × 股票 的 DataFrame (float64 副本)；rows 為只取最後幾列，不在矩陣中的股票為 NaN"""
+        ids = self.tickers if stock_ids is None else pd.Index(list(map(clean_id, stock_ids)), dtype=object)
+        pos = self.tickers.get_indexer(ids)
+        start = 0 if rows is None else max(0, len(self.dates) - rows)
+        arr = np.full((len(self.dates) - start, len(ids)), np.nan)
+        found = pos >= 0
+        arr[:, found] = self._arrays[field][start:, pos[found]]
+        return pd.DataFrame(arr, index=self.dates[start:], columns=ids)
+
+def snapshot(stock_ids=None, root=STORE_DIR):
+    """矩陣內股票的最新技術指標 (index=stock_id，欄位 COLUMNS)；依矩陣版本快取"""
+    df = _snapshot(root, _read_meta(root)['version'])
+    return df if stock_ids is None else df.reindex(list(map(clean_id, stock_ids)))
+
+@lru_cache(maxsize=4)
+def _snapshot(root, version):
+    m = PriceMatrix(root)
+    return latest(*(m.frame(f, rows=TECH_LOOKBACK) for f in FIELDS))
+
+
+# ========================================================
+# 3. 增量更新
+# ========================================================
+def _dates(df):
+    return pd.DatetimeIndex(df.index).tz_localize(None).normalize()
+
+def update(stock_ids, root=STORE_DIR):
+    """
+    把 stock_ids 的本地日線 (prices.refresh 之後) 併入矩陣，只讀取內容有變的檔 (本地資料庫 changed_at)。
+    只有新 K 棒 (日期都在最後一列之後、既有列不變) 時在檔尾追加列；新股票、插入中間日期或既有列有變時整份寫成新一代。
+    回傳更新的檔數。
+    """
+    store = get_store()
+    ids = list(dict.fromkeys(map(clean_id, stock_ids)))
+    with singleflight.hold(('matrix', MATRIX_DIR), root=root):
+        meta = _read_meta(root)
+        stamps = meta['stamps']
+        status = {sid: store.status(PRICE_DATASET, sid) for sid in ids}
+        changed = [sid for sid in ids if status[sid] and (sid not in stamps or stamps[sid] != status[sid]['changed_at'])]
+        if not changed: return 0
+
+        frames = {}
+        for sid in changed:
+            df = prices.read(sid)
+            df = df[~_dates(df).duplicated(keep='last')] if len(df) else df
+            frames[sid] = df
+        old_dates, old_tickers = pd.DatetimeIndex(meta['dates']), list(meta['tickers'])
+        dates = old_dates.union(pd.DatetimeIndex(np.concatenate([_dates(df).values for df in frames.values()])).unique())
+        tickers = old_tickers + [sid for sid in changed if sid not in set(old_tickers)]
+        append = len(tickers) == len(old_tickers) and dates[:len(old_dates)].equals(old_dates)
+
+        def column(df, field):
+            out = np.full(len(dates), np.nan, dtype=np.float32)
+            if len(df) and field in df.columns: out[dates.get_indexer(_dates(df))] = df[field].to_numpy(dtype=np.float32)
+            return out
+        columns = {field: {sid: column(df, field) for sid, df in frames.items()} for field in FIELDS}
+
+        # 就地追加只寫讀取端映射範圍 (meta 的列數) 之外的新列；既有列有變 (還原權值、更正) 時改寫成新一代，
+        # 否則其他程序正在讀的矩陣會新舊混雜
+        n_old, col_of = len(old_dates), {sid: i for i, sid in enumerate(tickers)}
+        if append and n_old:
+            for field in FIELDS:
+                old = np.memmap(_file(root, field, meta['generation']), dtype=np.float32, mode='r',
+                                shape=(n_old, len(old_tickers)))
+                append = all(np.array_equal(old[:, col_of[sid]], columns[field][sid][:n_old], equal_nan=True)
+                             for sid in frames)
+                del old
+                if not append: break
+
+        os.makedirs(_dir(root), exist_ok=True)
+        gen = meta['generation'] if append else meta['generation'] + 1
+        shape = (len(dates), len(tickers))
+        for field in FIELDS:
+            if append:
+                # 檔尾補上新日期的空列，只填新列 (讀取端只會看到 meta 所記錄的列數)
+                with open(_file(root, field, gen), 'ab') as f:
+                    np.full((len(dates) - n_old, len(tickers)), np.nan, dtype=np.float32).tofile(f)
+                arr = np.memmap(_file(root, field, gen), dtype=np.float32, mode='r+', shape=shape)
+                for sid, col in columns[field].items(): arr[n_old:, col_of[sid]] = col[n_old:]
+            else:
+                tmp = _file(root, field, gen) + '.tmp'
+                arr = np.memmap(tmp, dtype=np.float32, mode='w+', shape=shape)
+                arr[:] = np.nan
+                if n_old and old_tickers:
+                    old = np.memmap(_file(root, field, meta['generation']), dtype=np.float32, mode='r',
+                                    shape=(n_old, len(old_tickers)))
+                    arr[dates.get_indexer(old_dates), :len(old_tickers)] = old
+                    del old
+                for sid, col in columns[field].items(): arr[:, col_of[sid]] = col  # 整行改寫 (還原權值時整段價格都會變)
+            arr.flush()
+            del arr
+            if not append: os.replace(tmp, _file(root, field, gen))
+
+        stamps.update({sid: status[sid]['changed_at'] for sid in changed})
+        new_meta = {'version': meta['version'] + 1, 'generation': gen, 'tickers': tickers,
+                    'dates': [d.strftime('%Y-%m-%d') for d in dates], 'stamps': stamps}
+        tmp = os.path.join(_dir(root), 'meta.json.tmp')
+        with open(tmp, 'w') as f: json.dump(new_meta, f)
+        os.replace(tmp, os.path.join(_dir(root), 'meta.json'))
+        if not append and meta['tickers']:
+            for field in FIELDS:
+                try: os.remove(_file(root, field, meta['generation']))
+                except FileNotFoundError: pass
+        return len(changed)
@@ -0,0 +1,131 @@
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+import pandas as pd
+import plotly.graph_objects as go
+from .config import TELEMETRY_LOG
+
+# 結構化日誌: 每個階段一行 JSON (logger 名稱 twquant.telemetry)，設定 TELEMETRY_LOG 時另寫入檔案
+logger = logging.getLogger('twquant.telemetry')
+if TELEMETRY_LOG and not logger.handlers:
+    _handler = logging.FileHandler(TELEMETRY_LOG, encoding='utf-8')
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+SPAN_FIELDS = ['trace', 'stage', 'name', 'start', 'duration', 'rows', 'bytes', 'retries', 'cache', 'status', 'error', 'thread']
+
+# 目前的追蹤與階段 (經由 copy_context 帶進執行緒池)
+_trace = contextvars.ContextVar('twquant_trace', default=None)
+_span = contextvars.ContextVar('twquant_span', default=None)
+# 進行中的 watch() 區塊 (由外而內)，error() 等降級事件記到每一層
+_watches = contextvars.ContextVar('twquant_watches', default=())
+
+
+class Trace:
+    """一次分析 (例如單一股票) 的所有階段紀錄，start 為相對於追蹤開始的秒數"""
+    def __init__(self, name):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock: self.spans.append(record)
+
+    def frame(self):
+        """所有階段 (依開始時間排序) 的 DataFrame，供瀑布圖與除錯表格使用"""
+        with self._lock: spans = list(self.spans)
+        if not spans: return pd.DataFrame(columns=SPAN_FIELDS)
+        return pd.DataFrame(spans, columns=SPAN_FIELDS).sort_values('start', kind='stable').reset_index(drop=True)
+
+
+@contextmanager
+def trace(name):
+    tr = Trace(name)
+    token = _trace.set(tr)
+    try: yield tr
+    finally: _trace.reset(token)
+
+@contextmanager
+def span(stage, name, **attrs):
+    """
+    量測一個階段的耗時，區塊內可填入 rows / bytes / cache 等欄位。
+    區塊內拋出的例外會記為 error 後照常往外拋。
+    """
+    tr = _trace.get()
+    t = time.perf_counter()
+    record = {'trace': tr.name if tr else None, 'stage': stage, 'name': name,
+              'start': t - tr.t0 if tr else 0.0, 'duration': None, 'rows': None, 'bytes': None,
+              'retries': 0, 'cache': None, 'status': 'ok', 'error': None,
+              'thread': threading.current_thread().name, **attrs}
+    token = _span.set(record)
+    try:
+        yield record
+    except Exception as e:
+        record['status'] = 'error'; record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['duration'] = time.perf_counter() - t
+        _span.reset(token)
+        if tr is not None: tr.add(record)
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+def annotate(**fields):
+    """更新目前階段的欄位 (不在任何階段內時忽略)"""
+    record = _span.get()
+    if record is not None: record.update(fields)
+
+def incr(field, n=1):
+    """累加目前階段的計數欄位 (retries、bytes...)"""
+    record = _span.get()
+    if record is not None: record[field] = (record.get(field) or 0) + n
+
+@contextmanager
+def watch():
+    """
+    收集區塊內 (含經 copy_context 帶進執行緒池的工作) 發生的降級事件 {種類: 次數}，
+    只計本次呼叫 (不受其他執行緒影響)；例如結果含預設值時不寫入快取。
+    """
+    events = {}
+    token = _watches.set(_watches.get() + (events,))
+    try: yield events
+    finally: _watches.reset(token)
+
+def flag(kind):
+    """記一次降級事件 (error: 吞下例外改用預設值；stale: 改用本地舊資料)，進行中的 watch() 區塊都會看到"""
+    for events in _watches.get(): events[kind] = events.get(kind, 0) + 1
+
+def error(where, exc):
+    """記錄被吞下 (改用預設值) 的例外: 目前階段標為 degraded 並寫入警告日誌"""
+    flag('error')
+    msg = f"{type(exc).__name__}: {exc}"
+    record = _span.get()
+    if record is not None and record['status'] == 'ok':
+        record['status'] = 'degraded'; record['error'] = f"{where}: {msg}"
+    logger.warning(json.dumps({'event': 'error', 'where': where, 'error': msg,
+                               'trace': record['trace'] if record else None}, ensure_ascii=False))
+
+def frame_size(df):
+    """DataFrame 的 (列數, 記憶體位元組)"""
+    if df is None: return 0, 0
+    return len(df), int(df.memory_usage(index=True, deep=True).sum())
+
+def waterfall(tr):
+    """瀑布圖: 每個階段一條橫條 (起點=開始時間，長度=耗時)，顏色代表快取狀態，黑色為錯誤"""
+    df = tr.frame()
+    total = (df['start'] + df['duration']).max() * 1000 if len(df) else 0
+    colors = {'hit': '#2ca02c', 'store': '#17becf', 'shared': '#9467bd', 'miss': '#ff7f0e', 'api': '#d62728', 'stale': '#bcbd22'}
+    df['label'] = df['stage'] + ' · ' + df['name'].astype(str)
+    df['color'] = df['cache'].map(colors).fillna('#7f7f7f').where(df['status'] == 'ok', '#000000')
+    hover = [f"{r.label}<br>{r.duration * 1000:.1f} ms, rows={r.rows}, bytes={r.bytes}, retries={r.retries}"
+             f"<br>cache={r.cache}, status={r.status}" + (f"<br>{r.error}" if r.error else '')
+             for r in df.itertuples()]
+    fig = go.Figure(go.Bar(y=df['label'], x=df['duration'] * 1000, base=df['start'] * 1000, orientation='h',
+                           marker_color=df['color'], hovertext=hover, hoverinfo='text'))
+    fig.update_layout(xaxis_title='ms', yaxis=dict(autorange='reversed'), height=max(250, 24 * len(df) + 80),
+                      margin=dict(l=10, r=10, t=30, b=30), title=f"{tr.name}: {total:.0f} ms")
+    return fig
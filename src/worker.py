@@ -0,0 +1,138 @@
+"""
+背景預熱 (不需 Streamlit): 依台股資料公布時點刷新觀察清單，
+結果寫入本地資料庫，UI 開啟同一檔股票時直接讀取 (毫秒級)。
+
+    python -m src.worker                          # 立即刷新一次，之後依公布時點常駐排程
+    python -m src.worker --once                   # 只刷新一次
+    python -m src.worker --watchlist 2330 2317 --token <FinMind token>
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import calendar
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from .config import (DATASETS, WATCHLIST, PREWARM_WORKERS, PREWARM_TIMEZONE, PREWARM_DAILY,
+                     REVENUE_DEADLINE_DAY, PREWARM_DEADLINE_TIME, STATEMENT_LAG_DAYS)
+from . import data_loader, telemetry, prices, bulk, technicals
+from .store import get_store
+from .scheduler import use_priority, BACKGROUND
+from .pipeline import update, save_snapshot, clean_id
+
+TZ = ZoneInfo(PREWARM_TIMEZONE)
+STATEMENT_KEYS = ['BALANCE_SHEET', 'INCOME_STATEMENT', 'CASH_FLOW', 'DIVIDEND']
+
+
+# ========================================================
+# 1. 刷新時點 (台北時間)
+# ========================================================
+def _at(day, hhmm):
+    h, m = map(int, hhmm.split(':'))
+    return datetime(day.year, day.month, day.day, h, m, tzinfo=TZ)
+
+def _statement_deadline(year, month):
+    """季底 (year/month 月底) 的財報公告期限"""
+    return date(year, month, calendar.monthrange(year, month)[1]) + timedelta(days=STATEMENT_LAG_DAYS[month])
+
+def events_on(day):
+    """某日的刷新時點 -> {datetime: [需強制重抓的資料集鍵]}"""
+    events = {}
+    if day.weekday() < 5:
+        for hhmm, keys in PREWARM_DAILY: events.setdefault(_at(day, hhmm), []).extend(keys)
+    if day.day == REVENUE_DEADLINE_DAY:
+        events.setdefault(_at(day, PREWARM_DEADLINE_TIME), []).append('REVENUE')
+    if any(_statement_deadline(y, m) == day for y in (day.year - 1, day.year) for m in STATEMENT_LAG_DAYS):
+        events.setdefault(_at(day, PREWARM_DEADLINE_TIME), []).extend(STATEMENT_KEYS)
+    return events
+
+def next_event(after):
+    """after 之後的第一個刷新時點 -> (datetime, 資料集鍵)"""
+    for d in range(8):  # 交易日每天都有刷新，一週內必定找到
+        events = sorted((at, keys) for at, keys in events_on(after.date() + timedelta(days=d)).items() if at > after)
+        if events: return events[0]
+    raise RuntimeError("PREWARM_DAILY 未設定任何時點")
+
+def last_event(now=None):
+    """now 之前最近一次刷新時點 (timestamp)；之前算好的結果早於此時點即視為過期"""
+    now = now or datetime.now(TZ)
+    for d in range(8):
+        events = [at for at in events_on(now.date() - timedelta(days=d)) if at <= now]
+        if events: return max(events).timestamp()
+    return 0.0
+
+
+# ========================================================
+# 2. 刷新觀察清單
+# ========================================================
+def refresh(stock_ids, keys=(), token=None, workers=PREWARM_WORKERS):
+    """
+    keys 中的資料集先標為過期 (剛公布新資料)，其餘依本地資料庫 ttl 決定是否重抓；
+    每檔依輸入變動增量重算後寫入結果快照。回傳 {stock_id: 重算的步驟，或錯誤訊息}。
+    """
+    store = get_store()
+    for sid in map(clean_id, stock_ids):
+        for key in keys: store.invalidate(DATASETS[key], sid)
+    # 常駐程序的 st.cache_data 只在記憶體，每輪清掉以免沿用上一輪的結果
+    for fn in (data_loader.fetch_price_from_yahoo, data_loader.fetch_fundamentals_data, data_loader.fetch_chip_data):
+        fn.clear()
+
+    prices.refresh(stock_ids)  # 日線多檔一次更新，之後逐檔只讀本地資料
+    technicals.update(stock_ids)  # 新 K 棒追加進全市場日線矩陣
+    with use_priority(BACKGROUND):
+        bulk.refresh(stock_ids, token, fresh=keys)  # 籌碼 / 融資: 剛公布的資料集重抓最近一個交易日 (全市場一次)
+    engine = data_loader.DataEngine(token=token)
+
+    def one(stock_id):
+        # 背景優先度: 與 UI 共用額度時讓互動請求先走
+        with use_priority(BACKGROUND), telemetry.trace(stock_id):
+            try:
+                res = update(engine, stock_id)
+                save_snapshot(res)
+                return res['recomputed']
+            except Exception as e:
+                telemetry.error(f"worker({stock_id})", e)
+                return f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(stock_ids, pool.map(one, stock_ids)))
+
+def _run(stock_ids, keys, token, workers, label):
+    t, since = time.perf_counter(), time.time()
+    results = refresh(stock_ids, keys, token, workers)
+    errors = {sid: r for sid, r in results.items() if isinstance(r, str)}
+    recomputed = sum(1 for r in results.values() if isinstance(r, list) and r)
+    # 各資料集這一輪實際有新資料的檔數 (只有這些股票的相關指標被重算)
+    store, ids = get_store(), set(map(clean_id, stock_ids))
+    fresh = {key: len(ids.intersection(store.changed_since(name, since))) for key, name in DATASETS.items()}
+    print(f"[{datetime.now(TZ):%Y-%m-%d %H:%M}] {label}: {len(stock_ids) - len(errors)}/{len(stock_ids)} 檔完成，"
+          f"{recomputed} 檔重算 ({time.perf_counter() - t:.1f}s)"
+          + (f"，新資料: {', '.join(f'{k} {n}' for k, n in fresh.items() if n)}" if any(fresh.values()) else '')
+          + (f"，失敗: {errors}" if errors else ''), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台股量化系統背景預熱")
+    parser.add_argument('--watchlist', nargs='+', default=WATCHLIST, help="股票代號 (預設 config.WATCHLIST)")
+    parser.add_argument('--token', default=os.environ.get('FINMIND_TOKEN'), help="FinMind token (預設環境變數 FINMIND_TOKEN)")
+    parser.add_argument('--workers', type=int, default=PREWARM_WORKERS, help="同時分析的檔數")
+    parser.add_argument('--once', action='store_true', help="刷新一次後結束")
+    args = parser.parse_args(argv)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)  # 非 Streamlit 環境下 st.cache_data 的警告
+
+    _run(args.watchlist, (), args.token, args.workers, 'startup')
+    if args.once: return 0
+
+    # 從上一個時點往後排，主機休眠錯過的時點醒來後立即補跑
+    at = datetime.now(TZ)
+    while True:
+        at, keys = next_event(at)
+        print(f"下次刷新 {at:%Y-%m-%d %H:%M} ({', '.join(keys)})", flush=True)
+        while (wait := at.timestamp() - time.time()) > 0: time.sleep(min(wait, 60))
+        _run(args.watchlist, keys, args.token, args.workers, ', '.join(keys))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
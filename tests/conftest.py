@@ -0,0 +1,20 @@
+"""
+等價性測試 (pytest): 向量化 / 增量版本與逐檔 / 完整計算的結果一致。
+資料使用 benchmarks/fixtures.py 的合成股票，本地資料庫放暫存目錄，不連網。
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+# 必須在匯入 src 前設定: 本地資料庫 (含排程器狀態) 不寫入專案的 data/
+os.environ.setdefault('TWQUANT_STORE_DIR', tempfile.mkdtemp(prefix='twquant-test-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_universe
+
+
+@pytest.fixture(scope='session')
+def universe():
+    """固定 seed 的合成股票 (含金融業、缺漏科目)"""
+    return make_universe(30, seed=1)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.fixtures import frames
+from src.config import INFO_KEYS
+from src.metrics import MetricCalculator
+from src.screener import Screener, FRAME_NAMES
+
+
+def panels(universe):
+    """與 Screener.load 相同的長表面板 (不下載: 直接使用合成資料)"""
+    out = {name: pd.concat([frames(stock)[i].assign(stock_id=sid) for sid, stock in universe.items()], ignore_index=True)
+           for i, name in enumerate(FRAME_NAMES)}
+    out['info'] = pd.DataFrame([{'stock_id': sid, **{k: s['info'].get(k) for k in INFO_KEYS}}
+                                for sid, s in universe.items()]).set_index('stock_id')
+    return out
+
+
+def same(a, b):
+    if a is None or (isinstance(a, float) and np.isnan(a)): return b is None or pd.isna(b)
+    if isinstance(a, (str, bool, np.bool_)): return a == b
+    return np.isclose(float(a), float(b), rtol=1e-6, equal_nan=True)
+
+
+@pytest.fixture(scope='module')
+def card(universe):
+    return Screener(engine=object()).compute(panels(universe))
+
+
+def test_screener_matches_metric_calculator(universe, card):
+    """Screener.compute (截面) 的每個指標 == 逐檔 MetricCalculator"""
+    mismatches = []
+    for sid, stock in universe.items():
+        c = MetricCalculator(*frames(stock), stock['info'])
+        f, _ = c.calculate_f_score(); z, _ = c.calculate_z_score(); mom, yoy = c.calculate_revenue_growth()
+        expected = {'F-Score': f, 'Z-Score': z, 'MoM': mom, 'YoY': yoy, **c.calculate_guru_metrics(),
+                    **c.calculate_chip_metrics(), **c.calculate_margin_metrics()}
+        row = card.loc[sid]
+        mismatches += [(sid, k, v, row[k]) for k, v in expected.items() if not same(v, row[k])]
+    assert not mismatches
+
+
+def test_screener_covers_universe(universe, card):
+    assert sorted(card.index) == sorted(universe)
+    assert card['Score'].is_monotonic_decreasing
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+from src.config import DATASETS
+from src.store import DataStore
+
+DATASET = DATASETS['INSTITUTIONAL']
+
+
+def source(df):
+    """模擬 API: fetch(since) 回傳 since (含) 之後的資料"""
+    calls = []
+    def fetch(since):
+        calls.append(since)
+        return df[df['date'] >= since].reset_index(drop=True)
+    return fetch, calls
+
+
+@pytest.fixture
+def chip(universe):
+    return next(iter(universe.values()))[DATASET]
+
+
+def test_incremental_sync_matches_full_fetch(tmp_path, chip):
+    """分段增量同步 (含重抓最後一天的更正) == 一次抓完整段"""
+    sid, start = chip['stock_id'].iloc[0], chip['date'].min()
+    days = sorted(chip['date'].unique())
+
+    full = DataStore(str(tmp_path / 'full'))
+    expected = full.sync(DATASET, sid, start, source(chip)[0], ttl=3600)
+
+    inc = DataStore(str(tmp_path / 'inc'))
+    for cut in (days[20], days[40]):
+        partial = chip[chip['date'] <= cut].copy()
+        partial.loc[partial['date'] == cut, 'buy'] += 1   # 盤中 / 待更正的最後一天，下次同步會以新值覆蓋
+        inc.sync(DATASET, sid, start, source(partial)[0], ttl=0)
+    fetch, calls = source(chip)
+    got = inc.sync(DATASET, sid, start, fetch, ttl=0)
+
+    assert calls == [days[40]]   # 只抓最後日期 (含) 之後的增量
+    pd.testing.assert_frame_equal(got, expected)
+    pd.testing.assert_frame_equal(inc.read(DATASET, sid), full.read(DATASET, sid))
+    assert inc.status(DATASET, sid)['last_date'] == full.status(DATASET, sid)['last_date']
+
+
+def test_sync_within_ttl_reads_local(tmp_path, chip):
+    store = DataStore(str(tmp_path))
+    sid, start = chip['stock_id'].iloc[0], chip['date'].min()
+    fetch, calls = source(chip)
+    first = store.sync(DATASET, sid, start, fetch, ttl=3600)
+    again = store.sync(DATASET, sid, start, fetch, ttl=3600)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(again, first)
+
+
+def test_empty_first_sync_is_recorded(tmp_path):
+    """首次抓取查無資料也寫入索引，ttl 內不再重抓"""
+    store = DataStore(str(tmp_path))
+    fetch, calls = source(pd.DataFrame({'date': pd.Series(dtype=str)}))
+    assert store.sync(DATASET, '9999', '2020-01-01', fetch, ttl=3600).empty
+    assert store.sync(DATASET, '9999', '2020-01-01', fetch, ttl=3600).empty
+    assert len(calls) == 1
+    assert store.status(DATASET, '9999')['last_date'] is None
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from benchmarks.fixtures import frames
+from src.metrics import MetricCalculator
+from src.strategy import generate_signals, signal_inputs, score_frame
+
+
+def test_score_frame_matches_generate_signals(universe):
+    """score_frame (整欄) 的總分與評級 == 逐檔 generate_signals"""
+    args = []
+    for stock in universe.values():
+        c = MetricCalculator(*frames(stock), stock['info'])
+        f, _ = c.calculate_f_score(); z, _ = c.calculate_z_score(); mom, yoy = c.calculate_revenue_growth()
+        args.append((f, z, stock['info'], mom, yoy, c.calculate_guru_metrics(), c.calculate_chip_metrics(),
+                     c.calculate_margin_metrics()))
+    expected = [generate_signals(*a)[:2] for a in args]
+
+    scored = score_frame(pd.DataFrame([signal_inputs(*a) for a in args], index=list(universe)))
+    assert scored['Score'].tolist() == [score for score, _ in expected]
+    assert scored['Action'].tolist() == [action for _, action in expected]
+    assert len(set(scored['Score'])) > 1  # 合成資料涵蓋多種分數，不是全部相同
+
+
+def test_score_frame_handles_missing_inputs():
+    """指標全缺 (計算失敗) 時與 generate_signals 一樣視為不加分"""
+    args = (None, None, {}, None, None, {}, {}, {})
+    score, action, _, _ = generate_signals(*args)
+    scored = score_frame(pd.DataFrame([signal_inputs(*args)]))
+    assert scored['Score'].iloc[0] == score and scored['Action'].iloc[0] == action
+    assert not np.isnan(scored['Score'].iloc[0])